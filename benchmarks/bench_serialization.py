@@ -0,0 +1,68 @@
+"""
+Micro-benchmark: model -> dict -> JSON throughput.
+
+Compares the old reflective ``to_dict`` (walking ``__table__.columns`` with
+getattr) encoded by Flask's stdlib-backed JSONEncoder against the compiled
+serializers encoded by FastJSONEncoder. No database is needed; the rows
+are transient Product instances.
+
+Run from the repository root:
+    python -m benchmarks.bench_serialization [rows]
+"""
+import json
+import sys
+import time
+from datetime import datetime
+
+from flask.json import JSONEncoder
+
+from src import app
+from src.helpers.json_provider import FastJSONEncoder
+from src.models import Product, Reviews
+
+
+def reflective_to_dict(obj):
+    return {column.name: getattr(obj, column.name) for column in obj.__table__.columns}
+
+
+def make_rows(count):
+    products = [Product(id=i, quantity=i % 100, product_name=f"Product {i}",
+                        product_description=f"A fairly long description of product {i}",
+                        category="Phone" if i % 2 else "Laptop", price=1000 + i,
+                        img_url=f"https://example.com/img/{i}.jpg", rating_count=i % 7,
+                        rating_sum=(i % 7) * 4, rating_1=0, rating_2=0, rating_3=0,
+                        rating_4=i % 7, rating_5=0, avg_rating=4.0, units_sold=i % 50,
+                        units_sold_7d=0, units_sold_30d=i % 5)
+                for i in range(count)]
+    reviews = [Reviews(id=i, customer_id=i, product_id=i, review="Great value",
+                       rating=4, date=datetime(2022, 10, 23, 10, 38, 38))
+               for i in range(count)]
+    return products, reviews
+
+
+def bench(label, rows, to_dict, encoder):
+    best = float("inf")
+    for _ in range(3):
+        start = time.perf_counter()
+        json.dumps({"success": True, "data": {"products": [to_dict(row) for row in rows]}},
+                   cls=encoder, separators=(",", ":"), sort_keys=True)
+        best = min(best, time.perf_counter() - start)
+    rate = len(rows) / best
+    print(f"{label:<44} {rate:>14,.0f} rows/sec")
+    return rate
+
+
+def main(count):
+    products, reviews = make_rows(count)
+    with app.app_context():
+        for name, rows in (("Product", products), ("Reviews", reviews)):
+            print(f"{name} x {count:,}")
+            before = bench("  reflective to_dict + stdlib JSONEncoder", rows,
+                           reflective_to_dict, JSONEncoder)
+            after = bench("  compiled to_dict + FastJSONEncoder", rows,
+                          type(rows[0]).to_dict, FastJSONEncoder)
+            print(f"  speedup: {after / before:.1f}x")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
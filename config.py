@@ -16,9 +16,79 @@ MAIL_USE_SSL = True
 MAIL_USERNAME = os.environ.get("EMAIL")
 MAIL_PASSWORD = os.environ.get("EMAIL_PASSWORD")
 MAIL_DEFAULT_SENDER = os.environ.get("EMAIL")
+# mail is queued in the mail_outbox table and sent by MAIL_WORKERS threads
+# started with each serving process, each over its own kept-alive SMTP
+# connection, see src.helpers.mail_outbox; with 0 workers, schedule
+# `flask send-mail` instead
+MAIL_WORKERS = 2
+MAIL_BATCH_SIZE = 20
+# sends per second over all workers (0 for no limit), in bursts of MAIL_RATE_BURST
+MAIL_RATE_LIMIT = 5
+MAIL_RATE_BURST = 10
+MAIL_MAX_ATTEMPTS = 6
+MAIL_RETRY_BASE = 30
+MAIL_POLL_INTERVAL = 5
+MAIL_LEASE_SECONDS = 300
+# seconds an unused SMTP connection is kept open
+MAIL_CONNECTION_IDLE = 30
 STRIPE_PUBLIC_KEY = os.environ.get("STRIPE_PUBLIC")
 STRIPE_SECRET_KEY = os.environ.get("STRIPE_PRIVATE")
+# Stripe calls go through src.helpers.payment_gateway: seconds to connect
+# and to wait for a reply, retries within STRIPE_TOTAL_TIMEOUT seconds of
+# the call, and the circuit breaker that fails checkout fast with a 503
+# after STRIPE_BREAKER_THRESHOLD failed attempts
+STRIPE_API_BASE = os.environ.get("STRIPE_API_BASE")
+STRIPE_CONNECT_TIMEOUT = 3.05
+STRIPE_READ_TIMEOUT = 10
+STRIPE_TOTAL_TIMEOUT = 15
+STRIPE_MAX_RETRIES = 2
+STRIPE_RETRY_BASE = 0.25
+STRIPE_POOL_SIZE = 10
+STRIPE_BREAKER_THRESHOLD = 5
+STRIPE_BREAKER_RESET = 30
+# mirror products into Stripe Prices so checkout can reference them,
+# see src.helpers.stripe_catalog
+STRIPE_PRICE_SYNC = os.environ.get("STRIPE_PRICE_SYNC") == "1"
 SESSION_TYPE = "filesystem"
+# "filesystem" (Flask-Session, SESSION_TYPE above), "sqlite" or "redis"
+SESSION_BACKEND = os.environ.get("SESSION_BACKEND", "filesystem")
+SESSION_SQLITE_PATH = os.environ.get("SESSION_SQLITE_PATH")
+SESSION_REDIS_URL = os.environ.get("SESSION_REDIS_URL", "redis://localhost:6379/0")
+# seconds between sweeps of expired sessions (sqlite backend)
+SESSION_GC_INTERVAL = 60
+# "session" keeps the cart server side, "cookie" in a signed cookie
+CART_STORAGE = os.environ.get("CART_STORAGE", "session")
+CART_COOKIE_NAME = "cart"
+CART_COOKIE_MAX_BYTES = 2048
+# hold stock for cart lines (seconds until a hold lapses), see src.helpers.reservations
+STOCK_RESERVATIONS = os.environ.get("STOCK_RESERVATIONS") == "1"
+STOCK_SHARDS = 8
+RESERVATION_TTL = 15 * 60
+RESERVATION_CHECKOUT_TTL = 30 * 60
+RESERVATION_SWEEP_INTERVAL = 30
+# payment webhooks are stored, then processed by WEBHOOK_WORKERS threads
+# started with each serving process, see src.helpers.webhook_inbox; with 0
+# workers, schedule `flask process-webhooks` instead
+WEBHOOK_WORKERS = 2
+WEBHOOK_BATCH_SIZE = 50
+WEBHOOK_MAX_ATTEMPTS = 8
+WEBHOOK_RETRY_BASE = 5
+WEBHOOK_POLL_INTERVAL = 1
+WEBHOOK_LEASE_SECONDS = 300
+SUGGEST_MAX_AGE = 300
+CATALOG_VERSION_TTL = 1
+CATALOG_CACHE_MAX_AGE = 0
+IMAGE_ROOT = os.environ.get("IMAGE_ROOT")
+IMAGE_WORKERS = 2
+IMAGE_MAX_BYTES = 10 * 1024 * 1024
+IMAGE_MAX_AGE = 365 * 24 * 3600
+# responses smaller than COMPRESS_MIN_SIZE bytes are sent uncompressed
+COMPRESS_MIN_SIZE = 1024
+COMPRESS_LEVEL = 6
+COMPRESS_BROTLI_LEVEL = 4
+COMPRESS_ZSTD_LEVEL = 3
+# let the front web server send image files (X-Sendfile / X-Accel-Redirect)
+USE_X_SENDFILE = os.environ.get("USE_X_SENDFILE") == "1"
 DEBUG = True
 CORS_METHODS = ["GET", "HEAD", "POST", "OPTIONS", "PUT", "PATCH", "DELETE"]
 # SERVER_NAME = "gadgehaven.herokuapp.com"
@@ -0,0 +1,49 @@
+"""stock reservations
+
+Revision ID: 0c9f3e7a5b84
+Revises: e8a2c6f0b317
+Create Date: 2026-10-18 14:52:03.118547
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0c9f3e7a5b84'
+down_revision = 'e8a2c6f0b317'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('stock_shards',
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.Column('shard', sa.SmallInteger(), autoincrement=False, nullable=False),
+    sa.Column('available', sa.Integer(), nullable=False),
+    sa.CheckConstraint('available>=0'),
+    sa.ForeignKeyConstraint(['product_id'], ['products.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('product_id', 'shard')
+    )
+    op.create_table('stock_reservations',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('cart_id', sa.String(length=64), nullable=False),
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.Column('shard', sa.SmallInteger(), nullable=False),
+    sa.Column('quantity', sa.Integer(), nullable=False),
+    sa.Column('expires_at', sa.DateTime(), nullable=False),
+    sa.CheckConstraint('quantity>0'),
+    sa.ForeignKeyConstraint(['product_id'], ['products.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_stock_reservations_cart_id_product_id', 'stock_reservations',
+                    ['cart_id', 'product_id'], unique=False)
+    op.create_index(op.f('ix_stock_reservations_expires_at'), 'stock_reservations',
+                    ['expires_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_stock_reservations_expires_at'), table_name='stock_reservations')
+    op.drop_index('ix_stock_reservations_cart_id_product_id', table_name='stock_reservations')
+    op.drop_table('stock_reservations')
+    op.drop_table('stock_shards')
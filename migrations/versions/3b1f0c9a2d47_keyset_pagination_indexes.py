@@ -0,0 +1,24 @@
+"""keyset pagination indexes
+
+Revision ID: 3b1f0c9a2d47
+Revises: fc6afd8f2730
+Create Date: 2026-10-18 09:12:40.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3b1f0c9a2d47'
+down_revision = 'fc6afd8f2730'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_products_category_price_id', 'products', ['category', 'price', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_products_category_price_id', table_name='products')
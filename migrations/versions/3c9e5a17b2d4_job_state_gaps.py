@@ -0,0 +1,24 @@
+"""job state gaps
+
+Revision ID: 3c9e5a17b2d4
+Revises: f1b7d2e84a09
+Create Date: 2026-10-18 19:24:51.306418
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c9e5a17b2d4'
+down_revision = 'f1b7d2e84a09'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('job_state', sa.Column('gaps', sa.JSON(), nullable=False, server_default='[]'))
+
+
+def downgrade():
+    op.drop_column('job_state', 'gaps')
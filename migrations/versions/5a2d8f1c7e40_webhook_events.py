@@ -0,0 +1,38 @@
+"""webhook events
+
+Revision ID: 5a2d8f1c7e40
+Revises: 0c9f3e7a5b84
+Create Date: 2026-10-18 16:21:47.305912
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5a2d8f1c7e40'
+down_revision = '0c9f3e7a5b84'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('webhook_events',
+    sa.Column('id', sa.String(length=255), nullable=False),
+    sa.Column('type', sa.String(length=100), nullable=False),
+    sa.Column('payload', sa.Text(), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('next_attempt_at', sa.DateTime(), nullable=False),
+    sa.Column('last_error', sa.Text(), nullable=True),
+    sa.Column('received_at', sa.DateTime(), nullable=False),
+    sa.Column('processed_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_webhook_events_status_next_attempt_at', 'webhook_events',
+                    ['status', 'next_attempt_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_webhook_events_status_next_attempt_at', table_name='webhook_events')
+    op.drop_table('webhook_events')
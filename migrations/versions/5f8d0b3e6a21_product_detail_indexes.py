@@ -0,0 +1,26 @@
+"""product detail indexes
+
+Revision ID: 5f8d0b3e6a21
+Revises: d27a5e913c68
+Create Date: 2026-10-18 11:31:07.662840
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5f8d0b3e6a21'
+down_revision = 'd27a5e913c68'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_reviews_product_id_date_id', 'reviews', ['product_id', 'date', 'id'], unique=False)
+    op.create_index('ix_orders_product_id_id', 'orders', ['product_id', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_orders_product_id_id', table_name='orders')
+    op.drop_index('ix_reviews_product_id_date_id', table_name='reviews')
@@ -0,0 +1,48 @@
+"""related products
+
+Revision ID: 7e1b9d4c2f60
+Revises: a6c3f41d8e92
+Create Date: 2026-10-18 13:05:12.804316
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7e1b9d4c2f60'
+down_revision = 'a6c3f41d8e92'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_orders_order_details_id', 'orders', ['order_details_id'], unique=False)
+    op.create_table('product_pairs',
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.Column('other_id', sa.Integer(), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['product_id'], ['products.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['other_id'], ['products.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('product_id', 'other_id')
+    )
+    op.create_table('product_related',
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.Column('related', sa.JSON(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['product_id'], ['products.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('product_id')
+    )
+    op.create_table('job_state',
+    sa.Column('name', sa.String(length=50), nullable=False),
+    sa.Column('watermark', sa.BigInteger(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade():
+    op.drop_table('job_state')
+    op.drop_table('product_related')
+    op.drop_table('product_pairs')
+    op.drop_index('ix_orders_order_details_id', table_name='orders')
@@ -0,0 +1,56 @@
+"""product rating stats
+
+Revision ID: 9c4e2a7b1f05
+Revises: 3b1f0c9a2d47
+Create Date: 2026-10-18 10:02:13.540917
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9c4e2a7b1f05'
+down_revision = '3b1f0c9a2d47'
+branch_labels = None
+depends_on = None
+
+COUNTERS = ['rating_count', 'rating_sum', 'rating_1', 'rating_2',
+            'rating_3', 'rating_4', 'rating_5']
+
+
+def upgrade():
+    for column in COUNTERS:
+        op.add_column('products', sa.Column(column, sa.Integer(), server_default='0', nullable=False))
+    op.add_column('products', sa.Column('avg_rating', sa.Float(), nullable=True))
+    op.execute("""
+        UPDATE products SET
+            rating_count = stats.rating_count,
+            rating_sum = stats.rating_sum,
+            rating_1 = stats.rating_1,
+            rating_2 = stats.rating_2,
+            rating_3 = stats.rating_3,
+            rating_4 = stats.rating_4,
+            rating_5 = stats.rating_5,
+            avg_rating = stats.rating_sum * 1.0 / stats.rating_count
+        FROM (
+            SELECT product_id,
+                   COUNT(*) AS rating_count,
+                   SUM(rating) AS rating_sum,
+                   SUM(CASE WHEN rating = 1 THEN 1 ELSE 0 END) AS rating_1,
+                   SUM(CASE WHEN rating = 2 THEN 1 ELSE 0 END) AS rating_2,
+                   SUM(CASE WHEN rating = 3 THEN 1 ELSE 0 END) AS rating_3,
+                   SUM(CASE WHEN rating = 4 THEN 1 ELSE 0 END) AS rating_4,
+                   SUM(CASE WHEN rating = 5 THEN 1 ELSE 0 END) AS rating_5
+            FROM reviews GROUP BY product_id
+        ) AS stats
+        WHERE stats.product_id = products.id
+    """)
+    op.create_index('ix_products_avg_rating_id', 'products', ['avg_rating', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_products_avg_rating_id', table_name='products')
+    op.drop_column('products', 'avg_rating')
+    for column in reversed(COUNTERS):
+        op.drop_column('products', column)
@@ -0,0 +1,35 @@
+"""catalog version
+
+Revision ID: a6c3f41d8e92
+Revises: 5f8d0b3e6a21
+Create Date: 2026-10-18 12:20:44.391725
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a6c3f41d8e92'
+down_revision = '5f8d0b3e6a21'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    catalog_version = op.create_table('catalog_version',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('version', sa.BigInteger(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    # 1: CATALOG, any catalog change; 2: PRODUCTS, products saved or deleted
+    now = datetime.utcnow()
+    op.bulk_insert(catalog_version, [{'id': 1, 'version': 1, 'updated_at': now},
+                                     {'id': 2, 'version': 1, 'updated_at': now}])
+
+
+def downgrade():
+    op.drop_table('catalog_version')
@@ -0,0 +1,24 @@
+"""product image id
+
+Revision ID: b4e07a5d9c13
+Revises: 7e1b9d4c2f60
+Create Date: 2026-10-18 13:41:37.215904
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b4e07a5d9c13'
+down_revision = '7e1b9d4c2f60'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('products', sa.Column('image_id', sa.String(length=32), nullable=True))
+
+
+def downgrade():
+    op.drop_column('products', 'image_id')
@@ -0,0 +1,41 @@
+"""mail outbox
+
+Revision ID: c3e9a0b6d215
+Revises: 5a2d8f1c7e40
+Create Date: 2026-10-18 17:08:12.640231
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3e9a0b6d215'
+down_revision = '5a2d8f1c7e40'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('mail_outbox',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('sender', sa.String(length=255), nullable=True),
+    sa.Column('recipients', sa.JSON(), nullable=False),
+    sa.Column('subject', sa.String(length=255), nullable=False),
+    sa.Column('body', sa.Text(), nullable=True),
+    sa.Column('html', sa.Text(), nullable=True),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('next_attempt_at', sa.DateTime(), nullable=False),
+    sa.Column('last_error', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('sent_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_mail_outbox_status_next_attempt_at', 'mail_outbox',
+                    ['status', 'next_attempt_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_mail_outbox_status_next_attempt_at', table_name='mail_outbox')
+    op.drop_table('mail_outbox')
@@ -0,0 +1,61 @@
+"""product sales counters
+
+Revision ID: d27a5e913c68
+Revises: 9c4e2a7b1f05
+Create Date: 2026-10-18 10:48:51.203376
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd27a5e913c68'
+down_revision = '9c4e2a7b1f05'
+branch_labels = None
+depends_on = None
+
+COUNTERS = ['units_sold', 'units_sold_7d', 'units_sold_30d']
+
+
+def upgrade():
+    op.create_table('product_sales_daily',
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('units', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['product_id'], ['products.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('product_id', 'day')
+    )
+    op.create_index(op.f('ix_product_sales_daily_day'), 'product_sales_daily', ['day'], unique=False)
+    for column in COUNTERS:
+        op.add_column('products', sa.Column(column, sa.Integer(), server_default='0', nullable=False))
+        op.create_index(f'ix_products_{column}_id', 'products', [column, 'id'], unique=False)
+    op.execute("""
+        INSERT INTO product_sales_daily (product_id, day, units)
+        SELECT orders.product_id, CAST(order_details.order_date AS DATE), SUM(orders.quantity)
+        FROM orders JOIN order_details ON order_details.id = orders.order_details_id
+        WHERE orders.product_id IS NOT NULL
+        GROUP BY orders.product_id, CAST(order_details.order_date AS DATE)
+    """)
+    op.execute("""
+        UPDATE products SET
+            units_sold = sales.units_sold,
+            units_sold_7d = sales.units_sold_7d,
+            units_sold_30d = sales.units_sold_30d
+        FROM (
+            SELECT product_id,
+                   SUM(units) AS units_sold,
+                   SUM(CASE WHEN day > CURRENT_DATE - 7 THEN units ELSE 0 END) AS units_sold_7d,
+                   SUM(CASE WHEN day > CURRENT_DATE - 30 THEN units ELSE 0 END) AS units_sold_30d
+            FROM product_sales_daily GROUP BY product_id
+        ) AS sales
+        WHERE sales.product_id = products.id
+    """)
+
+
+def downgrade():
+    for column in reversed(COUNTERS):
+        op.drop_index(f'ix_products_{column}_id', table_name='products')
+        op.drop_column('products', column)
+    op.drop_index(op.f('ix_product_sales_daily_day'), table_name='product_sales_daily')
+    op.drop_table('product_sales_daily')
@@ -0,0 +1,25 @@
+"""product price version
+
+Revision ID: e8a2c6f0b317
+Revises: b4e07a5d9c13
+Create Date: 2026-10-18 14:10:52.630118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e8a2c6f0b317'
+down_revision = 'b4e07a5d9c13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('products', sa.Column('price_version', sa.Integer(), server_default='1',
+                                        nullable=False))
+
+
+def downgrade():
+    op.drop_column('products', 'price_version')
@@ -0,0 +1,32 @@
+"""stripe prices
+
+Revision ID: f1b7d2e84a09
+Revises: c3e9a0b6d215
+Create Date: 2026-10-18 18:02:35.917440
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f1b7d2e84a09'
+down_revision = 'c3e9a0b6d215'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('stripe_prices',
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.Column('price_version', sa.Integer(), nullable=False),
+    sa.Column('stripe_product_id', sa.String(length=255), nullable=False),
+    sa.Column('stripe_price_id', sa.String(length=255), nullable=False),
+    sa.Column('synced_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['product_id'], ['products.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('product_id')
+    )
+
+
+def downgrade():
+    op.drop_table('stripe_prices')
@@ -4,10 +4,13 @@ from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_mail import Mail
 from flask_migrate import Migrate
-from flask_session import Session
 from flask_cors import CORS
 from flask_bcrypt import Bcrypt
 
+from src.helpers.compression import init_compression
+from src.helpers.json_provider import init_json
+from src.helpers.session_store import init_sessions
+
 
 def create_app(test_config=None):
     # create and configure the app
@@ -33,11 +36,13 @@ app.permanent_session_lifetime = timedelta(days=30)
 db = SQLAlchemy(app)
 migrate = Migrate(app, db)
 mail_sender = Mail(app)
-Session(app)
+init_sessions(app)
 bcrypt = Bcrypt(app)
+init_json(app)
+init_compression(app)
 
 
 from . import (auth, products, admin_views,
                users, cart,
                payments, ratings,
-               errorhandlers)
+               errorhandlers, commands)
@@ -1,11 +1,15 @@
 import os
 import re
 
-from flask import (request, send_file, jsonify, g)
+from flask import (request, send_file, jsonify, g, json, stream_with_context)
 from flask_expects_json import expects_json
 from sqlalchemy import asc
 
+from src.helpers import mail_outbox, reservations, signals
+from src.helpers.cart_pricing import PRICED_FIELDS
 from src.helpers.errors import invalid_token_response
+from src.helpers.images import image_urls, store_image
+from src.helpers.payment_gateway import gateway
 from src.helpers.auth_tokens import check_valid_header, decode_auth_token
 from src.models import (Customer, Product, Order,
                         Reviews, OrderDetails, Role)
@@ -83,6 +87,8 @@ def restock(prod_id):
     product = Product.query.get(prod_id)
     if not product:
         abort(404, "Product not found")
+    if reservations.reservations_enabled():
+        reservations.adjust_stock(prod_id, 100 - product.quantity)
     product.quantity = 100
     try:
         db.session.commit()
@@ -90,7 +96,7 @@ def restock(prod_id):
         app.logger.error(e)
         abort(422)
     else:
-
+        signals.product_saved.send(app, product=product)
         return jsonify({
             "success": True,
             "data": {
@@ -158,6 +164,7 @@ def upload_product():
     except Exception as e:
         app.logger.error(e)
         abort(422)
+    signals.product_saved.send(app, product=new_product)
 
     return jsonify({
         "success": True,
@@ -189,14 +196,21 @@ def edit_product(prod_id):
     if sanitized_data.get("img_url") and not is_url(sanitized_data.get("img_url")):
         abort(400, "Invalid URL")
 
+    repriced = any(getattr(product_to_edit, key) != value for key, value
+                   in sanitized_data.items() if key in PRICED_FIELDS)
+    if "quantity" in sanitized_data and reservations.reservations_enabled():
+        reservations.adjust_stock(prod_id, sanitized_data["quantity"] - product_to_edit.quantity)
     for key, value in sanitized_data.items():
         setattr(product_to_edit, key, value)
+    if repriced:
+        product_to_edit.price_version = Product.price_version + 1
 
     try:
         db.session.commit()
     except Exception as e:
         app.logger.error(e)
     else:
+        signals.product_saved.send(app, product=product_to_edit)
         return jsonify({
             "success": True,
             "data": {
@@ -205,6 +219,43 @@ def edit_product(prod_id):
         })
 
 
+@app.route("/api/v1/admin/product/<int:prod_id>/image/", methods=["POST"])
+@required_roles("admin")
+def upload_product_image(prod_id):
+    product_to_edit = Product.query.get(prod_id)
+    if not product_to_edit:
+        abort(404, "Product not found")
+    image = request.files.get("image")
+    if not image:
+        abort(400, "No image provided")
+    data = image.read(app.config["IMAGE_MAX_BYTES"] + 1)
+    if len(data) > app.config["IMAGE_MAX_BYTES"]:
+        abort(413)
+
+    try:
+        digest, _ = store_image(data)
+    except ValueError as e:
+        abort(400, str(e))
+    urls = image_urls(digest)
+    product_to_edit.image_id = digest
+    product_to_edit.img_url = urls["medium"]["jpeg"]
+    try:
+        db.session.commit()
+    except Exception as e:
+        app.logger.error(e)
+        abort(422)
+    else:
+        signals.product_saved.send(app, product=product_to_edit)
+        return jsonify({
+            "success": True,
+            "data": {
+                "product_id": prod_id,
+                "image_id": digest,
+                "images": urls
+            }
+        }), 201
+
+
 @app.route("/api/v1/admin/product/<int:prod_id>/", methods=["DELETE"])
 @required_roles("admin")
 def delete(prod_id):
@@ -222,6 +273,7 @@ def delete(prod_id):
         app.logger.error(e)
         abort(422)
     else:
+        signals.product_deleted.send(app, product_id=prod_id)
         return jsonify({
             "success": True,
             "message": "Product deleted",
@@ -229,47 +281,68 @@ def delete(prod_id):
         })
 
 
+REPORT_BATCH = 1000
+
+
+def stream_report(rows):
+    """
+    Stream {"data": {"products": [...]}, "success": true} one row at a time,
+    so a report over the whole table is never held in memory at once.
+
+    :param rows: iterable of dicts
+    """
+    yield '{"data":{"products":['
+    for position, row in enumerate(rows):
+        yield ("," if position else "") + json.dumps(row)
+    yield ']},"success":true}'
+
+
 @app.route("/admin/inventory/report")
 @required_roles("admin")
 def generate_report():
-    all_prods = Product.query.all()
+    all_prods = Product.query.yield_per(REPORT_BATCH)
 
-    prod_list = []
-    for i in all_prods:
-        prod = i.to_dict()
-        prod_list.append(prod)
+    return app.response_class(
+        stream_with_context(stream_report(prod.to_dict() for prod in all_prods)),
+        mimetype="application/json")
 
+
+@app.route("/admin/sales/report")
+@required_roles("admin")
+def generate_sales():
+    all_sales = db.session.query(Order.product_id, Order.quantity, OrderDetails.customer_id,
+                                 OrderDetails.order_date, OrderDetails.to_street,
+                                 OrderDetails.to_city, OrderDetails.zip
+                                 ).join(OrderDetails).yield_per(REPORT_BATCH)
+
+    prod_list = ({
+        "customer_id": i.customer_id,
+        "product_id": i.product_id,
+        "quantity": i.quantity,
+        "order_date": i.order_date,
+        "to_street": i.to_street,
+        "to_city": i.to_city,
+        "zip": i.zip
+    } for i in all_sales)
+    return app.response_class(stream_with_context(stream_report(prod_list)),
+                              mimetype="application/json")
+
+
+@app.route("/api/v1/admin/mail/stats/")
+@required_roles("admin")
+def mail_stats():
     return jsonify({
         "success": True,
-        "data": {
-            "products": prod_list,
-        }
+        "data": mail_outbox.stats(),
     })
 
 
-@app.route("/admin/sales/report")
+@app.route("/api/v1/admin/payments/stats/")
 @required_roles("admin")
-def generate_sales():
-    all_prods = Order.query.all()
-
-    prod_list = []
-    for i in all_prods:
-        order_dets = OrderDetails.query.get(i.order_details_id)
-        prod = {
-            "customer_id": order_dets.customer_id,
-            "product_id": i.product_id,
-            "quantity": i.quantity,
-            "order_date": order_dets.order_date,
-            "to_street": order_dets.to_street,
-            "to_city": order_dets.to_city,
-            "zip": order_dets.zip
-        }
-        prod_list.append(prod)
+def payment_stats():
     return jsonify({
         "success": True,
-        "data": {
-            "products": prod_list,
-        }
+        "data": gateway().stats(),
     })
 
 
@@ -302,13 +375,16 @@ def delete_review(rev_id):
             "message": "Review deleted",
             "review_id": rev_id
         })
+    product_id, rating = rev_to_delete.product_id, rev_to_delete.rating
     db.session.delete(rev_to_delete)
     try:
+        Product.apply_rating(product_id, rating, sign=-1)
         db.session.commit()
     except Exception as e:
         app.logger.error(e)
         abort(422)
     else:
+        signals.review_deleted.send(app, product_id=product_id, rating=rating)
         return jsonify({
             "success": True,
             "message": "Review deleted",
@@ -6,12 +6,13 @@ from flask_expects_json import expects_json
 from .helpers.errors import invalid_token_response
 from .models import (Customer, BlacklistToken)
 from werkzeug.exceptions import abort
-from . import app, db, mail_sender, bcrypt, schema
+from . import app, db, bcrypt, schema
 from .helpers.auth_tokens import (
     encode_auth_token, decode_auth_token,
     check_valid_header
 )
 from .helpers.transform_user import transform_user_response
+from .helpers import mail_outbox
 
 from flask_mail import Message
 import re
@@ -34,7 +35,7 @@ def send_email(user):
     msg.recipients = [user.mail]
     msg.body = f"follow this link to reset your password " \
                f"https://gadgehaven.herokuapp.com{url_for('verify_reset', token=tok)}"
-    mail_sender.send(msg)
+    mail_outbox.enqueue(msg)
 
 
 @app.route("/api/v1/auth/register/", methods=["POST"])
@@ -1,12 +1,41 @@
-from flask import (request, jsonify, session, g)
+from flask import (request, jsonify, g)
 from flask_expects_json import expects_json
 
-from src.models import Product
+from src.helpers.cart_pricing import price_cart
+from src.helpers import cart_store, reservations
 from werkzeug.exceptions import abort
 from src import app
 from flask_login import current_user
 
-from src.schema.defineSchema import add_to_cart_schema, update_cart_schema
+from src.schema.defineSchema import add_to_cart_schema, update_cart_schema, bulk_cart_schema
+
+
+def hold_stock(changes, previous=None):
+    """
+    Hold stock for changed cart lines when STOCK_RESERVATIONS is on. If a
+    line can't be held, the lines already changed go back to their
+    previous quantities and the request is aborted: 404 for a product that
+    doesn't exist, 400 when there is not enough stock.
+
+    :param changes: {product_id: new quantity}
+    :param previous: {product_id: quantity before the change}
+    """
+    if not reservations.reservations_enabled():
+        return
+    cart_id = cart_store.cart_id(create=True)
+    done = []
+    for product_id, quantity in changes.items():
+        try:
+            held = reservations.hold(cart_id, product_id, quantity)
+        except KeyError:
+            held = None
+        if not held:
+            for held_id in done:
+                reservations.hold(cart_id, held_id, (previous or {}).get(held_id, 0))
+            if held is None:
+                abort(404, f"Product with id: {product_id} not found")
+            abort(400, f"Not enough items in stock for product {product_id}")
+        done.append(product_id)
 
 
 @app.route("/api/v1/cart/", methods=['POST'])
@@ -19,18 +48,18 @@ def add_to_cart():
     if not product_id or not quantity:
         abort(400, "Missing product id or quantity")
 
-    # check for ids and quantity in session
-    # flask session can only hold two variables,
-    # so a dictionary is passed into it to hold as many variables necessary
-    # dictionary structure: {product_id:quantity}
-    if "cart_dict" not in session:
-        session["cart_dict"] = {}
-    cart_dict = session["cart_dict"]
+    # the cart is a dictionary {product_id:quantity}, kept in the session
+    # or in a signed cookie depending on CART_STORAGE
+    cart_dict = cart_store.load_cart() or {}
     if product_id in cart_dict:
         cart_dict[product_id] += quantity
     else:
         cart_dict[product_id] = quantity
-    session["cart_dict"] = cart_dict
+    hold_stock({product_id: cart_dict[product_id]})
+    try:
+        cart_store.save_cart(cart_dict)
+    except cart_store.CartTooLarge as e:
+        abort(400, str(e))
 
     return jsonify({"success": True,
                     "message": "Product added to cart",
@@ -47,12 +76,16 @@ def change_cart_quantity(prod_id):
     if not quantity:
         abort(400, "Missing quantity")
 
-    cart_dict = session["cart_dict"]
+    cart_dict = cart_store.load_cart() or {}
     if prod_id not in cart_dict:
         abort(404, "Product not in cart")
 
     cart_dict[prod_id] = quantity
-    session["cart_dict"] = cart_dict
+    hold_stock({prod_id: quantity})
+    try:
+        cart_store.save_cart(cart_dict)
+    except cart_store.CartTooLarge as e:
+        abort(400, str(e))
     return jsonify({"success": True,
                     "data": {
                         "products": cart_dict,
@@ -62,25 +95,64 @@ def change_cart_quantity(prod_id):
 
 
 
+@app.route("/api/v1/cart/bulk/", methods=['POST'])
+@expects_json(bulk_cart_schema)
+def bulk_update_cart():
+    cart_dict = cart_store.load_cart() or {}
+    previous = dict(cart_dict)
+    for operation in g.data["ops"]:
+        product_id = operation["prod_id"]
+        quantity = operation.get("qty")
+        if operation["op"] == "remove" or (operation["op"] == "set" and quantity == 0):
+            cart_dict.pop(product_id, None)
+            continue
+        if not quantity:
+            abort(400, f"Missing quantity for product {product_id}")
+        if operation["op"] == "add":
+            cart_dict[product_id] = cart_dict.get(product_id, 0) + quantity
+        else:
+            cart_dict[product_id] = quantity
+
+    # one query validates every product and prices the cart
+    try:
+        cart_prods, total, snapshot = price_cart(cart_dict)
+    except KeyError as e:
+        abort(404, f"Product with id: {e.args[0]} not found")
+    out_of_stock = [line["prod"]["id"] for line in cart_prods if not line["prod"]["in_stock"]]
+    if out_of_stock:
+        abort(400, "Not enough items in stock for products: "
+              + ", ".join(str(product_id) for product_id in out_of_stock))
+    hold_stock({product_id: cart_dict.get(product_id, 0)
+                for product_id in set(cart_dict) | set(previous)
+                if cart_dict.get(product_id, 0) != previous.get(product_id, 0)}, previous)
+    try:
+        cart_store.save_cart(cart_dict)
+    except cart_store.CartTooLarge as e:
+        abort(400, str(e))
+    cart_store.save_prices(snapshot)
+
+    return jsonify({"success": True,
+                    "message": "Cart updated",
+                    "data": {
+                        "products": cart_prods,
+                        "total_price": total
+                    }})
+
+
 @app.route('/api/v1/cart/')
 def get_cart():
-    try:
-        cart_dict = session["cart_dict"]
-    except KeyError:
+    cart_dict = cart_store.load_cart()
+    if cart_dict is None:
         abort(404, description="key not found")
     else:
-        cart_prods = []
-        calculator_list = []
-        print(cart_dict)
-        for prod_id, qty in cart_dict.items():
-            prd = Product.query.get(prod_id)
-            if not prd: # check if product exists
-                abort(404, f"Product with id: {prod_id} not found")
-            cart_product = {"prod": prd.to_dict(), "qty": qty}
-            price = prd.price * qty
-            calculator_list.append(price)
-            cart_prods.append(cart_product)
-        total = sum(calculator_list)
+        try:
+            cart_prods, total, snapshot = price_cart(cart_dict)
+        except KeyError as e:
+            abort(404, f"Product with id: {e.args[0]} not found")
+        # checkout reuses these prices unless a product's version moves;
+        # saved only when they did, so a GET doesn't rewrite the session
+        if snapshot != cart_store.load_prices():
+            cart_store.save_prices(snapshot)
 
         cart_json = jsonify({
             "data": {
@@ -96,7 +168,7 @@ def get_cart():
 @app.route("/api/v1/cart/<int:prod_id>/", methods=["DELETE"])
 def remove_from_cart(prod_id):
     prod = prod_id
-    cart_dict = session["cart_dict"]
+    cart_dict = cart_store.load_cart() or {}
     if prod not in cart_dict:
         return jsonify({
             "success": True,
@@ -108,7 +180,9 @@ def remove_from_cart(prod_id):
         })
     try:
         cart_dict.pop(prod)
-        session["cart_dict"] = cart_dict
+        cart_store.save_cart(cart_dict)
+        if reservations.reservations_enabled():
+            reservations.release(cart_store.cart_id(), prod)
     except Exception as e:
         app.logger.error(e)
         abort(500)
@@ -125,12 +199,14 @@ def remove_from_cart(prod_id):
 
 @app.route("/api/v1/cart/clear/", methods=["DELETE"])
 def clear_cart():
-    if "cart_dict" not in session:
+    if cart_store.load_cart() is None:
         return jsonify({
             "success": True,
             "message": "cart cleared"
         }), 204
-    session["cart_dict"].clear()
+    if reservations.reservations_enabled():
+        reservations.release(cart_store.cart_id())
+    cart_store.clear_cart()
 
     return jsonify({
         "success": True,
@@ -0,0 +1,204 @@
+import json
+from datetime import date, timedelta
+
+import click
+import requests
+from sqlalchemy import case, func, or_
+
+from src import app, db
+from src.helpers.etags import bump_version
+from src.helpers.images import image_urls, store_image
+from src.helpers.mail_outbox import drain as drain_mail
+from src.helpers.related import refresh_related
+from src.helpers.reservations import SWEEP_BATCH, init_shards, release_expired
+from src.helpers.stripe_catalog import sync_prices
+from src.helpers.webhook_inbox import drain, record_event
+from src.models import Product, Reviews, Order, OrderDetails, ProductSalesDaily
+
+BATCH_SIZE = 1000
+
+
+@app.cli.command("rebuild-rating-stats")
+def rebuild_rating_stats():
+    """Recompute every product's rating stats from the reviews table."""
+    buckets = [func.sum(case((Reviews.rating == star, 1), else_=0)).label(f"rating_{star}")
+               for star in range(1, 6)]
+    stats = db.session.query(Reviews.product_id,
+                             func.count(Reviews.id).label("rating_count"),
+                             func.sum(Reviews.rating).label("rating_sum"),
+                             *buckets).group_by(Reviews.product_id)
+
+    db.session.query(Product).update({
+        Product.rating_count: 0, Product.rating_sum: 0, Product.rating_1: 0,
+        Product.rating_2: 0, Product.rating_3: 0, Product.rating_4: 0,
+        Product.rating_5: 0, Product.avg_rating: None,
+    }, synchronize_session=False)
+    mappings = []
+    updated = 0
+    for row in stats.yield_per(BATCH_SIZE):
+        mapping = dict(row._mapping)
+        mapping["id"] = mapping.pop("product_id")
+        mapping["avg_rating"] = mapping["rating_sum"] / mapping["rating_count"]
+        mappings.append(mapping)
+        if len(mappings) == BATCH_SIZE:
+            db.session.bulk_update_mappings(Product, mappings)
+            updated += len(mappings)
+            mappings = []
+    db.session.bulk_update_mappings(Product, mappings)
+    updated += len(mappings)
+    db.session.commit()
+    bump_version()
+    click.echo(f"Rebuilt rating stats for {updated} products")
+
+
+def refresh_sales_windows():
+    today = date.today()
+    for column, days in ((Product.units_sold_7d, 7), (Product.units_sold_30d, 30)):
+        since = today - timedelta(days=days - 1)
+        recent = db.session.query(ProductSalesDaily.product_id).filter(
+            ProductSalesDaily.day >= since)
+        window = db.session.query(func.coalesce(func.sum(ProductSalesDaily.units), 0)).filter(
+            ProductSalesDaily.product_id == Product.id,
+            ProductSalesDaily.day >= since).scalar_subquery()
+        db.session.query(Product).filter(
+            or_(column > 0, Product.id.in_(recent))
+        ).update({column: window}, synchronize_session=False)
+
+
+@app.cli.command("refresh-sales-windows")
+def refresh_sales_windows_command():
+    """Expire sales older than 7 / 30 days from the windowed counters. Run daily."""
+    refresh_sales_windows()
+    db.session.commit()
+    click.echo("Refreshed 7 and 30 day sales counters")
+
+
+@app.cli.command("rebuild-sales-stats")
+def rebuild_sales_stats():
+    """Recompute every product's sales counters and daily buckets from the orders table."""
+    order_day = func.date(OrderDetails.order_date)
+    daily = db.session.query(Order.product_id, order_day,
+                             func.sum(Order.quantity)
+                             ).join(OrderDetails).filter(Order.product_id.isnot(None)
+                                                         ).group_by(Order.product_id, order_day)
+    totals = db.session.query(Order.product_id,
+                              func.sum(Order.quantity).label("units_sold")
+                              ).filter(Order.product_id.isnot(None)).group_by(Order.product_id)
+
+    db.session.query(ProductSalesDaily).delete(synchronize_session=False)
+    db.session.execute(ProductSalesDaily.__table__.insert().from_select(
+        ["product_id", "day", "units"], daily))
+    db.session.query(Product).update({Product.units_sold: 0, Product.units_sold_7d: 0,
+                                      Product.units_sold_30d: 0}, synchronize_session=False)
+    mappings = []
+    updated = 0
+    for row in totals.yield_per(BATCH_SIZE):
+        mappings.append({"id": row.product_id, "units_sold": row.units_sold})
+        if len(mappings) == BATCH_SIZE:
+            db.session.bulk_update_mappings(Product, mappings)
+            updated += len(mappings)
+            mappings = []
+    db.session.bulk_update_mappings(Product, mappings)
+    updated += len(mappings)
+    refresh_sales_windows()
+    db.session.commit()
+    bump_version()
+    click.echo(f"Rebuilt sales stats for {updated} products")
+
+
+@app.cli.command("build-related")
+@click.option("--full", is_flag=True, help="Rebuild from every order instead of the new ones.")
+def build_related(full):
+    """Fold new orders into the "customers also bought" recommendations."""
+    baskets, products = refresh_related(full=full)
+    click.echo(f"Processed {baskets} orders, refreshed related products for {products} products")
+
+
+@app.cli.command("ingest-images")
+@click.option("--limit", type=int, default=None, help="Stop after this many products.")
+def ingest_images(limit):
+    """Download remote product images and store their resized variants locally."""
+    query = Product.query.filter(Product.image_id.is_(None)).order_by(Product.id)
+    if limit:
+        query = query.limit(limit)
+    pending = []
+    stored = 0
+    with requests.Session() as session:
+        for product in query.all():
+            try:
+                response = session.get(product.img_url, timeout=10)
+                response.raise_for_status()
+                digest, future = store_image(response.content)
+            except (requests.RequestException, ValueError) as e:
+                app.logger.error(e)
+                click.echo(f"Skipped product {product.id}: {e}")
+                continue
+            if future is not None:
+                pending.append(future)
+            product.image_id = digest
+            product.img_url = image_urls(digest)["medium"]["jpeg"]
+            stored += 1
+    for future in pending:
+        future.result()
+    db.session.commit()
+    if stored:
+        bump_version()
+    click.echo(f"Stored images for {stored} products")
+
+
+@app.cli.command("init-stock-shards")
+def init_stock_shards():
+    """Split every product's unreserved stock over its reservation shards."""
+    products = init_shards()
+    db.session.commit()
+    click.echo(f"Initialized stock shards for {products} products")
+
+
+@app.cli.command("release-expired-reservations")
+def release_expired_reservations():
+    """Give the stock of expired cart reservations back."""
+    released = batch = release_expired()
+    while batch == SWEEP_BATCH:
+        batch = release_expired()
+        released += batch
+    click.echo(f"Released {released} expired reservations")
+
+
+@app.cli.command("process-webhooks")
+def process_webhooks():
+    """Process the payment webhook events that are due, e.g. without workers running."""
+    click.echo(f"Processed {drain()} webhook events")
+
+
+@app.cli.command("replay-webhooks")
+@click.argument("files", nargs=-1, type=click.File("rb"), required=True)
+def replay_webhooks(files):
+    """Feed recorded webhook event JSON files through the inbox, then process them."""
+    recorded = 0
+    for file in files:
+        payload = file.read()
+        try:
+            event = json.loads(payload)
+        except ValueError as e:
+            click.echo(f"Skipped {file.name}: {e}")
+            continue
+        if record_event(event, payload):
+            recorded += 1
+        else:
+            click.echo(f"Skipped {file.name}: already in the inbox")
+    click.echo(f"Recorded {recorded} webhook events, processed {drain()}")
+
+
+@app.cli.command("send-mail")
+def send_mail():
+    """Send the queued mail that is due, e.g. without workers running."""
+    click.echo(f"Processed {drain_mail()} queued mails")
+
+
+@app.cli.command("sync-stripe-prices")
+@click.option("--product-id", "product_ids", type=int, multiple=True,
+              help="Only sync these products.")
+def sync_stripe_prices(product_ids):
+    """Create Stripe prices for new and repriced products."""
+    synced = sync_prices(list(product_ids) or None)
+    click.echo(f"Synced Stripe prices for {synced} products")
@@ -74,3 +74,8 @@ def internal_server_error(error):
     return jsonify({"success": False, "error": 500,
                     "message": "internal server error"}), 500
 
+
+@app.errorhandler(503)
+def service_unavailable_error(error):
+    return jsonify({"success": False, "error": error.description,
+                    "message": "service unavailable"}), 503
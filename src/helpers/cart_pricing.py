@@ -0,0 +1,65 @@
+from src.helpers.product_loader import load_products
+
+# product fields shown on a cart line
+CART_FIELDS = ("product_name", "product_description", "price", "img_url", "quantity",
+               "price_version")
+# fields whose change bumps Product.price_version: what a checkout line is built from
+PRICED_FIELDS = frozenset(["price", "product_name", "product_description"])
+
+
+def snapshot_entry(product):
+    return {"version": product.price_version,
+            "price": product.price,
+            "description": product.product_description}
+
+
+def price_cart(cart_dict):
+    """
+    Price a cart with a single query over the few columns a cart line needs.
+
+    :param cart_dict: {product_id: quantity}
+    :return: the cart lines, the total price, and the price snapshot
+        {product_id: {"version", "price", "description"}} to keep in the session
+    :rtype: tuple
+    :raises KeyError: with the id of a product that no longer exists
+    """
+    products = load_products(cart_dict, fields=CART_FIELDS)
+    lines = []
+    total = 0
+    snapshot = {}
+    for prod_id, qty in cart_dict.items():
+        product = products.get(prod_id)
+        if not product:
+            raise KeyError(prod_id)
+        lines.append({"prod": {"id": product.id,
+                               "product_name": product.product_name,
+                               "price": product.price,
+                               "img_url": product.img_url,
+                               "in_stock": product.quantity >= qty,
+                               "version": product.price_version},
+                      "qty": qty})
+        total += product.price * qty
+        snapshot[prod_id] = snapshot_entry(product)
+    return lines, total, snapshot
+
+
+def refresh_snapshot(cart_dict, snapshot):
+    """
+    Bring a price snapshot up to date for checkout: one narrow query reads
+    the current versions and stock, and only the products whose version
+    moved since the snapshot was taken are fetched again.
+
+    :param cart_dict: {product_id: quantity}
+    :param snapshot: the snapshot from price_cart, possibly empty
+    :return: the updated snapshot and the stock left {product_id: quantity};
+        products that no longer exist are absent from both
+    :rtype: tuple
+    """
+    current = load_products(cart_dict, fields=("price_version", "quantity"))
+    snapshot = {prod_id: entry for prod_id, entry in (snapshot or {}).items()
+                if prod_id in current and entry["version"] == current[prod_id].price_version}
+    stale = [prod_id for prod_id in current if prod_id not in snapshot]
+    for prod_id, product in load_products(stale, fields=(
+            "price", "product_description", "price_version")).items():
+        snapshot[prod_id] = snapshot_entry(product)
+    return snapshot, {prod_id: product.quantity for prod_id, product in current.items()}
@@ -0,0 +1,190 @@
+import base64
+import os
+
+from flask import g, request, session
+from itsdangerous import BadSignature, Signer
+
+from src import app
+
+# CART_STORAGE = "session" keeps the cart in the server-side session,
+# "cookie" in a signed cookie, so cart requests need no server-side I/O.
+# Cookie layout, before signing and base64url: a version byte, the 16-byte
+# cart id, then per line (sorted by product id) the varint delta from the
+# previous product id and the varint quantity.
+COOKIE_VERSION = 1
+CART_ID_BYTES = 16
+_MISSING = object()
+
+
+class CartTooLarge(ValueError):
+    pass
+
+
+def _write_varint(value, out):
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data, position):
+    value = shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, position
+        shift += 7
+
+
+def encode_cart(cart_dict, cart_id):
+    """
+    :param cart_dict: {product_id: quantity}, non-negative ints
+    :param cart_id: CART_ID_BYTES bytes identifying the cart
+    :return: the unsigned, base64url encoded cookie payload
+    :rtype: bytes
+    """
+    out = bytearray([COOKIE_VERSION])
+    out += cart_id
+    previous = 0
+    for product_id in sorted(cart_dict):
+        _write_varint(product_id - previous, out)
+        _write_varint(cart_dict[product_id], out)
+        previous = product_id
+    return base64.urlsafe_b64encode(bytes(out)).rstrip(b"=")
+
+
+def decode_cart(payload):
+    """
+    :param payload: output of encode_cart
+    :return: the cart and its id
+    :rtype: tuple
+    :raises ValueError: when the payload is malformed or of another version
+    """
+    try:
+        data = base64.urlsafe_b64decode(payload + b"=" * (-len(payload) % 4))
+        if data[0] != COOKIE_VERSION or len(data) < 1 + CART_ID_BYTES:
+            raise ValueError("Unknown cart cookie version")
+        cart_id = data[1:1 + CART_ID_BYTES]
+        cart_dict = {}
+        position = 1 + CART_ID_BYTES
+        product_id = 0
+        while position < len(data):
+            delta, position = _read_varint(data, position)
+            quantity, position = _read_varint(data, position)
+            product_id += delta
+            cart_dict[product_id] = quantity
+    except (IndexError, TypeError, base64.binascii.Error) as e:
+        raise ValueError("Malformed cart cookie") from e
+    return cart_dict, cart_id
+
+
+def _signer():
+    return Signer(app.secret_key, salt="cart-cookie")
+
+
+def _cookie_mode():
+    return app.config.get("CART_STORAGE", "session") == "cookie"
+
+
+def _read_cookie():
+    if "cart_cookie" not in g:
+        g.cart_cookie = None
+        value = request.cookies.get(app.config.get("CART_COOKIE_NAME", "cart"))
+        if value:
+            try:
+                g.cart_cookie = decode_cart(_signer().unsign(value.encode("ascii")))
+            except (BadSignature, UnicodeEncodeError, ValueError) as e:
+                app.logger.error(e)
+    return g.cart_cookie
+
+
+def load_cart():
+    """
+    :return: the current cart {product_id: quantity}, None when there is none
+    :rtype: dict
+    """
+    if _cookie_mode():
+        cookie = _read_cookie()
+        return None if cookie is None else dict(cookie[0])
+    cart_dict = session.get("cart_dict")
+    if cart_dict is None:
+        return None
+    return {int(product_id): int(quantity) for product_id, quantity in cart_dict.items()}
+
+
+def save_cart(cart_dict):
+    """
+    :raises CartTooLarge: when the cart no longer fits in CART_COOKIE_MAX_BYTES
+    """
+    cart_dict = {int(product_id): int(quantity) for product_id, quantity in cart_dict.items()}
+    if not _cookie_mode():
+        session["cart_dict"] = cart_dict
+        return
+    cookie = _read_cookie()
+    cart_id = cookie[1] if cookie else os.urandom(CART_ID_BYTES)
+    value = _signer().sign(encode_cart(cart_dict, cart_id))
+    if len(value) > app.config.get("CART_COOKIE_MAX_BYTES", 2048):
+        raise CartTooLarge("Cart is full")
+    g.cart_cookie = (cart_dict, cart_id)
+    g.cart_cookie_value = value.decode("ascii")
+
+
+def clear_cart():
+    if _cookie_mode():
+        g.cart_cookie = None
+        g.cart_cookie_value = ""
+    else:
+        session.pop("cart_dict", None)
+        session.pop("cart_prices", None)
+
+
+def cart_id(create=False):
+    """
+    :param create: start an (empty) cart when there is none yet
+    :return: a stable identifier of the current cart, None without a cart
+    :rtype: str
+    """
+    if _cookie_mode():
+        cookie = _read_cookie()
+        if cookie is None and create:
+            cookie = g.cart_cookie = ({}, os.urandom(CART_ID_BYTES))
+        return None if cookie is None else cookie[1].hex()
+    return getattr(session, "sid", None)
+
+
+def load_prices():
+    # the price snapshot is only kept server side; in cookie mode checkout
+    # fetches the prices again
+    if _cookie_mode() or "cart_prices" not in session:
+        return None
+    return {int(product_id): entry for product_id, entry in session["cart_prices"].items()}
+
+
+def save_prices(snapshot):
+    if not _cookie_mode():
+        session["cart_prices"] = snapshot
+
+
+@app.before_request
+def _forget_cart_cookie():
+    # g outlives the request when an app context was already pushed, as in
+    # tests: the cookie must be read from this request, not a previous one
+    g.pop("cart_cookie", None)
+    g.pop("cart_cookie_value", None)
+
+
+@app.after_request
+def _write_cart_cookie(response):
+    value = g.get("cart_cookie_value", _MISSING)
+    if value is _MISSING:
+        return response
+    name = app.config.get("CART_COOKIE_NAME", "cart")
+    if value:
+        response.set_cookie(name, value, max_age=app.permanent_session_lifetime,
+                            secure=app.config.get("SESSION_COOKIE_SECURE", False),
+                            httponly=True, samesite="Lax")
+    else:
+        response.delete_cookie(name)
+    return response
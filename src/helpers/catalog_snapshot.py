@@ -0,0 +1,255 @@
+import math
+import threading
+import time
+
+import numpy as np
+
+from src import db
+from src.helpers import signals
+from src.helpers.etags import CATALOG, PRODUCTS, current_version, up_to_date
+from src.models import Product
+
+# upper bounds of the price histogram buckets; the last bucket is open ended
+PRICE_BUCKETS = (50000, 100000, 200000, 400000, 800000)
+SORTS = ("price", "-price", "rating")
+
+
+class CatalogSnapshot:
+    """
+    Columnar copy of the products table (price, quantity, category code,
+    average rating) held in NumPy arrays, so filtering and facet counting
+    is a vectorized pass over memory instead of several SQL round trips.
+
+    Rows are patched in place from the catalog signals; deleted products
+    are masked out until the next rebuild, which happens when another
+    worker changes the products.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._categories = []
+        self._category_codes = {}
+        self._positions = {}
+        self.ids = np.empty(0, dtype=np.int64)
+        self.price = np.empty(0, dtype=np.int64)
+        self.quantity = np.empty(0, dtype=np.int64)
+        self.category = np.empty(0, dtype=np.int32)
+        self.rating = np.empty(0, dtype=np.float64)
+        self.alive = np.empty(0, dtype=bool)
+        self.built_at = None
+        self.version = None
+        self.catalog_version = None
+
+    def build(self, rows, version=None, catalog_version=None):
+        """
+        :param rows: iterable of (id, price, quantity, category, avg_rating)
+        :param version: products version read before rows
+        :param catalog_version: catalog version read before rows
+        """
+        rows = list(rows)
+        with self._lock:
+            self._categories = sorted({row[3] for row in rows})
+            self._category_codes = {name: code for code, name in enumerate(self._categories)}
+            self.ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+            self.price = np.fromiter((row[1] for row in rows), dtype=np.int64, count=len(rows))
+            self.quantity = np.fromiter((row[2] for row in rows), dtype=np.int64, count=len(rows))
+            self.category = np.fromiter((self._category_codes[row[3]] for row in rows),
+                                        dtype=np.int32, count=len(rows))
+            self.rating = np.fromiter((math.nan if row[4] is None else row[4] for row in rows),
+                                      dtype=np.float64, count=len(rows))
+            self.alive = np.ones(len(rows), dtype=bool)
+            self._positions = {product_id: position for position, product_id
+                               in enumerate(self.ids.tolist())}
+            self.built_at = time.monotonic()
+            self.version = version
+            self.catalog_version = catalog_version
+
+    def _category_code(self, name):
+        if name not in self._category_codes:
+            self._category_codes[name] = len(self._categories)
+            self._categories.append(name)
+        return self._category_codes[name]
+
+    def upsert(self, product_id, price, quantity, category, rating):
+        with self._lock:
+            code = self._category_code(category)
+            rating = math.nan if rating is None else rating
+            position = self._positions.get(product_id)
+            if position is None:
+                self._positions[product_id] = len(self.ids)
+                self.ids = np.append(self.ids, product_id)
+                self.price = np.append(self.price, price)
+                self.quantity = np.append(self.quantity, quantity)
+                self.category = np.append(self.category, np.int32(code))
+                self.rating = np.append(self.rating, rating)
+                self.alive = np.append(self.alive, True)
+            else:
+                self.price[position] = price
+                self.quantity[position] = quantity
+                self.category[position] = code
+                self.rating[position] = rating
+                self.alive[position] = True
+
+    def update_column(self, column, values):
+        """
+        :param column: "quantity" or "rating"
+        :param values: {product_id: value}
+        """
+        with self._lock:
+            array = getattr(self, column)
+            for product_id, value in values.items():
+                position = self._positions.get(product_id)
+                if position is not None:
+                    array[position] = math.nan if value is None else value
+
+    def refresh_columns(self, rows, catalog_version=None):
+        """
+        Re-read the columns orders and reviews change, for every product.
+
+        :param rows: iterable of (id, quantity, avg_rating)
+        :param catalog_version: catalog version read before rows
+        """
+        rows = list(rows)
+        with self._lock:
+            positions = np.fromiter((self._positions.get(row[0], -1) for row in rows),
+                                    dtype=np.int64, count=len(rows))
+            known = positions >= 0
+            quantity = np.fromiter((row[1] for row in rows), dtype=np.int64, count=len(rows))
+            rating = np.fromiter((math.nan if row[2] is None else row[2] for row in rows),
+                                 dtype=np.float64, count=len(rows))
+            self.quantity[positions[known]] = quantity[known]
+            self.rating[positions[known]] = rating[known]
+            self.catalog_version = catalog_version
+
+    def remove(self, product_id):
+        with self._lock:
+            position = self._positions.get(product_id)
+            if position is not None:
+                self.alive[position] = False
+
+    def search(self, categories=None, price_ranges=None, in_stock=False, min_rating=None,
+               sort="price", limit=20, offset=0):
+        """
+        :param categories: category names to keep, None for all
+        :param price_ranges: list of (min, max) price ranges, inclusive; None
+            bound means unbounded
+        :param in_stock: only keep products with quantity left
+        :param min_rating: only keep products rated at least this much
+        :param sort: one of SORTS
+        :return: total matches, the requested page of product ids and the
+            facet counts (each facet ignores its own filter, so a client can
+            still offer the other categories / price buckets)
+        :rtype: tuple
+        """
+        with self._lock:
+            ids, price, quantity = self.ids, self.price, self.quantity
+            category, rating, alive = self.category, self.rating, self.alive
+            categories_by_code = list(self._categories)
+            codes = None if categories is None else [self._category_codes[name] for name in
+                                                     categories if name in self._category_codes]
+
+        base = alive.copy()
+        if in_stock:
+            base &= quantity > 0
+        if min_rating is not None:
+            base &= rating >= min_rating  # NaN (unrated) compares False
+        category_mask = np.ones_like(base) if codes is None else np.isin(category, codes)
+        price_mask = np.ones_like(base)
+        if price_ranges:
+            price_mask = np.zeros_like(base)
+            for low, high in price_ranges:
+                in_range = np.ones_like(base)
+                if low is not None:
+                    in_range &= price >= low
+                if high is not None:
+                    in_range &= price <= high
+                price_mask |= in_range
+
+        matches = base & category_mask & price_mask
+        positions = np.flatnonzero(matches)
+        if sort == "rating":
+            order = np.lexsort((ids[positions], -np.nan_to_num(rating[positions], nan=-1.0)))
+        elif sort == "-price":
+            order = np.lexsort((ids[positions], -price[positions]))
+        else:
+            order = np.lexsort((ids[positions], price[positions]))
+        page = ids[positions[order[offset:offset + limit]]].tolist()
+
+        by_category = np.bincount(category[base & price_mask],
+                                  minlength=len(categories_by_code))
+        edges = np.asarray(PRICE_BUCKETS)
+        by_price = np.bincount(np.searchsorted(edges, price[base & category_mask], side="left"),
+                               minlength=len(edges) + 1)
+        lows = (0,) + tuple(edge + 1 for edge in PRICE_BUCKETS)
+        highs = PRICE_BUCKETS + (None,)
+        facets = {
+            "categories": {name: int(count) for name, count
+                           in zip(categories_by_code, by_category) if count},
+            "price": [{"min": low, "max": high, "count": int(count)}
+                      for low, high, count in zip(lows, highs, by_price)],
+            "in_stock": int(np.count_nonzero(matches & (quantity > 0))),
+        }
+        return len(positions), page, facets
+
+
+catalog_snapshot = CatalogSnapshot()
+
+
+def _current(version, catalog_version):
+    if catalog_snapshot.built_at is None \
+            or not up_to_date(PRODUCTS, catalog_snapshot.version, version) \
+            or not up_to_date(CATALOG, catalog_snapshot.catalog_version, catalog_version):
+        return False
+    catalog_snapshot.version = version
+    catalog_snapshot.catalog_version = catalog_version
+    return True
+
+
+def ensure_catalog_snapshot():
+    # this worker's writes are patched in by the signal handlers below;
+    # another worker's product writes rebuild the snapshot, its orders and
+    # reviews only re-read the stock and rating columns
+    version, _ = current_version(PRODUCTS)
+    catalog_version, _ = current_version(CATALOG)
+    if _current(version, catalog_version):
+        return catalog_snapshot
+    with catalog_snapshot._lock:
+        if catalog_snapshot.built_at is None \
+                or not up_to_date(PRODUCTS, catalog_snapshot.version, version):
+            catalog_snapshot.build(db.session.query(Product.id, Product.price, Product.quantity,
+                                                    Product.category, Product.avg_rating
+                                                    ).yield_per(1000), version, catalog_version)
+        elif not up_to_date(CATALOG, catalog_snapshot.catalog_version, catalog_version):
+            catalog_snapshot.refresh_columns(db.session.query(
+                Product.id, Product.quantity, Product.avg_rating).yield_per(1000),
+                catalog_version)
+        _current(version, catalog_version)
+    return catalog_snapshot
+
+
+@signals.product_saved.connect
+def _on_product_saved(sender, product, **extra):
+    if catalog_snapshot.built_at is not None:
+        catalog_snapshot.upsert(product.id, product.price, product.quantity,
+                                product.category, product.avg_rating)
+
+
+@signals.product_deleted.connect
+def _on_product_deleted(sender, product_id, **extra):
+    catalog_snapshot.remove(product_id)
+
+
+@signals.review_added.connect
+@signals.review_deleted.connect
+def _on_review_changed(sender, product_id, **extra):
+    if catalog_snapshot.built_at is not None:
+        catalog_snapshot.update_column("rating", dict(
+            Product.query.with_entities(Product.id, Product.avg_rating).filter_by(id=product_id)))
+
+
+@signals.order_placed.connect
+def _on_order_placed(sender, quantities, **extra):
+    if catalog_snapshot.built_at is not None and quantities:
+        catalog_snapshot.update_column("quantity", dict(
+            Product.query.with_entities(Product.id, Product.quantity).filter(
+                Product.id.in_(list(quantities)))))
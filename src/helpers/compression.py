@@ -0,0 +1,143 @@
+import zlib
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli is optional
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - zstandard is optional
+    zstandard = None
+
+from flask import request
+
+# mimetypes worth compressing; images, archives and the like are already
+# compressed and are left alone
+COMPRESSIBLE = frozenset(["application/json", "application/javascript", "application/xml",
+                          "image/svg+xml", "text/css", "text/csv", "text/html",
+                          "text/javascript", "text/plain", "text/xml"])
+
+
+class _Gzip:
+    def __init__(self, level):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+class _Brotli:
+    def __init__(self, level):
+        self._compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+class _Zstd:
+    def __init__(self, level):
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+def available_encodings():
+    """
+    :return: the supported content codings, most preferred first
+    :rtype: list
+    """
+    encodings = []
+    if zstandard is not None:
+        encodings.append("zstd")
+    if brotli is not None:
+        encodings.append("br")
+    encodings.append("gzip")
+    return encodings
+
+
+def compressor(encoding, config):
+    if encoding == "zstd":
+        return _Zstd(config.get("COMPRESS_ZSTD_LEVEL", 3))
+    if encoding == "br":
+        return _Brotli(config.get("COMPRESS_BROTLI_LEVEL", 4))
+    return _Gzip(config.get("COMPRESS_LEVEL", 6))
+
+
+def compress(data, encoding, config):
+    codec = compressor(encoding, config)
+    return codec.compress(data) + codec.finish()
+
+
+def _compress_stream(chunks, codec):
+    # flush after every chunk, so a streamed response still reaches the
+    # client as it is produced
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode("utf-8")
+            if chunk:
+                yield codec.compress(chunk) + codec.flush()
+        yield codec.finish()
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
+
+
+def compress_response(response, config):
+    """
+    Compress a response with the best coding the client accepts.
+    Small bodies, uncompressible mimetypes, files sent with send_file and
+    responses already encoded are returned untouched.
+    """
+    if (response.status_code < 200 or response.status_code in (204, 206, 304)
+            or response.direct_passthrough
+            or "Content-Encoding" in response.headers
+            or response.mimetype not in COMPRESSIBLE):
+        return response
+    response.vary.add("Accept-Encoding")
+    if response.cache_control.no_transform:
+        return response
+    encoding = request.accept_encodings.best_match(available_encodings())
+    if encoding is None:
+        return response
+    if not response.is_streamed and (response.content_length or 0) < config.get(
+            "COMPRESS_MIN_SIZE", 1024):
+        return response
+
+    if response.is_streamed:
+        response.response = _compress_stream(response.response, compressor(encoding, config))
+        response.headers.pop("Content-Length", None)
+    else:
+        response.set_data(compress(response.get_data(), encoding, config))
+    response.headers["Content-Encoding"] = encoding
+    # the compressed body is a different representation of the same resource
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def init_compression(app):
+    @app.after_request
+    def _compress(response):
+        return compress_response(response, app.config)
@@ -0,0 +1,170 @@
+import hashlib
+import threading
+import time
+from datetime import datetime, timezone
+from functools import wraps
+
+from flask import request, make_response
+
+from src import app, db
+from src.helpers import signals
+from src.models import CatalogVersion
+
+# CatalogVersion rows: CATALOG moves on every catalog change and backs the
+# ETags, PRODUCTS only when a product is saved or deleted, for the caches
+# that don't show ratings, sales or stock
+CATALOG = 1
+PRODUCTS = 2
+
+# versions bumped by this process, at most OWN_VERSIONS per scope
+OWN_VERSIONS = 1000
+
+_lock = threading.Lock()
+_cached = {"versions": None, "read_at": 0.0}
+_own = {CATALOG: set(), PRODUCTS: set()}
+_pending_bump = None
+
+
+def _utc(value):
+    return value.replace(tzinfo=timezone.utc, microsecond=0)
+
+
+def current_version(scope=CATALOG):
+    """
+    :param scope: CATALOG or PRODUCTS
+    :return: the scope's version and the time it last changed, re-read
+        from the database at most every CATALOG_VERSION_TTL seconds
+    :rtype: tuple
+    """
+    ttl = app.config.get("CATALOG_VERSION_TTL", 1)
+    versions = _cached["versions"]
+    if versions is None or time.monotonic() - _cached["read_at"] > ttl:
+        # every scope in one read, so they are consistent with each other
+        versions = {row.id: (row.version, _utc(row.updated_at))
+                    for row in CatalogVersion.query.all()}
+        with _lock:
+            _cached.update(versions=versions, read_at=time.monotonic())
+    return versions.get(scope, (0, _utc(datetime(2022, 1, 1))))
+
+
+def bump_version(scopes=(CATALOG,)):
+    now = datetime.utcnow()
+    for scope in scopes:
+        updated = CatalogVersion.query.filter_by(id=scope).update(
+            {CatalogVersion.version: CatalogVersion.version + 1,
+             CatalogVersion.updated_at: now}, synchronize_session=False)
+        if not updated:
+            db.session.add(CatalogVersion(id=scope, version=1, updated_at=now))
+    try:
+        # the rows are locked by the update, so these are this bump's versions
+        bumped = dict(db.session.query(CatalogVersion.id, CatalogVersion.version).filter(
+            CatalogVersion.id.in_(scopes)))
+        db.session.commit()
+    except Exception as e:
+        app.logger.error(e)
+        db.session.rollback()
+    else:
+        with _lock:
+            for scope, version in bumped.items():
+                own = _own.setdefault(scope, set())
+                own.add(version)
+                own.difference_update([old for old in own if old <= version - OWN_VERSIONS])
+            # make this worker see its own write straight away
+            _cached["read_at"] = 0.0
+
+
+def up_to_date(scope, built_version, version):
+    """
+    Whether a cache built at built_version is current at version: nothing
+    changed since, or only this process bumped the version since. The bump
+    comes after the signal handlers, so the cache has applied those changes.
+
+    :rtype: bool
+    """
+    if built_version is None:
+        return False
+    if built_version == version:
+        return True
+    own = _own.get(scope, ())
+    return built_version < version and all(
+        bumped in own for bumped in range(built_version + 1, version + 1))
+
+
+def _run_pending_bump():
+    global _pending_bump
+    with _lock:
+        _pending_bump = None
+    with app.app_context():
+        try:
+            bump_version()
+        finally:
+            db.session.remove()
+
+
+def schedule_bump():
+    """
+    Bump the CATALOG version within CATALOG_VERSION_TTL seconds. Other
+    workers only re-read the version that often, so the orders and reviews
+    of that span share one bump instead of each updating the row.
+    """
+    global _pending_bump
+    ttl = app.config.get("CATALOG_VERSION_TTL", 1)
+    if not ttl:
+        bump_version()
+        return
+    with _lock:
+        if _pending_bump is not None:
+            return
+        _pending_bump = threading.Timer(ttl, _run_pending_bump)
+        _pending_bump.name = "catalog-version-bump"
+        timer = _pending_bump
+    timer.start()
+
+
+def conditional(view):
+    """
+    Answer If-None-Match / If-Modified-Since with 304 from the catalog
+    version alone, before the view runs any query, and tag successful
+    responses with a strong ETag and Last-Modified.
+    """
+    @wraps(view)
+    def decorated_function(*args, **kwargs):
+        version, updated_at = current_version()
+        digest = hashlib.blake2b(request.full_path.encode("utf-8"), digest_size=6).hexdigest()
+        etag = f"{version}-{digest}"
+
+        if request.if_none_match:
+            # weak comparison, so the weak ETag of a compressed response matches
+            not_modified = request.if_none_match.contains_weak(etag)
+        else:
+            not_modified = (request.if_modified_since is not None
+                            and updated_at <= request.if_modified_since)
+        if not_modified:
+            response = app.response_class(status=304)
+        else:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        response.set_etag(etag)
+        response.last_modified = updated_at
+        response.cache_control.public = True
+        response.cache_control.max_age = app.config.get("CATALOG_CACHE_MAX_AGE", 0)
+        response.cache_control.must_revalidate = True
+        return response
+
+    return decorated_function
+
+
+# connected last: the caches' handlers have applied the change by the time
+# the version moves, which is what up_to_date relies on
+@signals.product_saved.connect_last
+@signals.product_deleted.connect_last
+def _on_product_changed(sender, **extra):
+    bump_version((CATALOG, PRODUCTS))
+
+
+@signals.review_added.connect_last
+@signals.review_deleted.connect_last
+@signals.order_placed.connect_last
+def _on_catalog_changed(sender, **extra):
+    schedule_bump()
@@ -0,0 +1,141 @@
+import hashlib
+import io
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image, ImageOps
+
+from src import app
+
+# longest side of each variant, in pixels
+VARIANTS = {"thumb": 160, "medium": 480, "large": 1200}
+# extension: (Pillow format, mimetype, save options)
+FORMATS = {
+    "webp": ("WEBP", "image/webp", {"quality": 80, "method": 4}),
+    "jpeg": ("JPEG", "image/jpeg", {"quality": 85, "optimize": True, "progressive": True}),
+}
+ACCEPTED_FORMATS = frozenset(["JPEG", "PNG", "WEBP", "GIF"])
+MAX_PIXELS = 40_000_000
+IMAGE_URL = "/api/v1/images/{digest}/{variant}.{extension}"
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def image_root():
+    return app.config.get("IMAGE_ROOT") or os.path.join(app.instance_path, "images")
+
+
+def image_dir(digest, root=None):
+    """
+    Variants are stored by the hash of the uploaded bytes, so the same
+    picture uploaded twice is processed and stored once.
+    """
+    return os.path.join(root or image_root(), digest[:2], digest[2:4], digest)
+
+
+def variant_path(digest, variant, extension):
+    return os.path.join(image_dir(digest), f"{variant}.{extension}")
+
+
+def render_variants(data, directory):
+    """
+    Write every variant of an image into directory. Runs in the worker
+    processes, so it must only depend on its arguments.
+
+    :param data: the uploaded image bytes
+    :param directory: the content-addressed directory of the image
+    :return: file names written
+    :rtype: list
+    """
+    written = []
+    with Image.open(io.BytesIO(data)) as source:
+        source = ImageOps.exif_transpose(source)
+        has_alpha = source.mode in ("RGBA", "LA") or "transparency" in source.info
+        source = source.convert("RGBA" if has_alpha else "RGB")
+        for variant, size in VARIANTS.items():
+            image = source.copy()
+            image.thumbnail((size, size), Image.LANCZOS)
+            for extension, (image_format, _, options) in FORMATS.items():
+                name = f"{variant}.{extension}"
+                path = os.path.join(directory, name)
+                if os.path.exists(path):
+                    continue
+                output = image
+                if image_format == "JPEG" and output.mode == "RGBA":
+                    output = Image.new("RGB", image.size, (255, 255, 255))
+                    output.paste(image, mask=image.getchannel("A"))
+                # write aside and rename, so a variant is never served half written
+                temporary = f"{path}.{os.getpid()}.tmp"
+                output.save(temporary, image_format, **options)
+                os.replace(temporary, path)
+                written.append(name)
+    return written
+
+
+def image_urls(digest):
+    """
+    :return: {variant: {extension: url}} of an image
+    :rtype: dict
+    """
+    return {variant: {extension: IMAGE_URL.format(digest=digest, variant=variant,
+                                                  extension=extension)
+                      for extension in FORMATS}
+            for variant in VARIANTS}
+
+
+def _log_failure(future):
+    if future.exception() is not None:
+        app.logger.error(future.exception())
+
+
+def _executor():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=app.config.get("IMAGE_WORKERS"))
+        return _pool
+
+
+def variants_ready(digest):
+    directory = image_dir(digest)
+    return all(os.path.exists(os.path.join(directory, f"{variant}.{extension}"))
+               for variant in VARIANTS for extension in FORMATS)
+
+
+def store_image(data):
+    """
+    Check an uploaded image, keep the original and queue its variants on
+    the process pool, without waiting for them.
+
+    :param data: the uploaded image bytes
+    :return: the image digest and the future of the variants, None when
+        they already exist
+    :rtype: tuple
+    :raises ValueError: when data is not an accepted image
+    """
+    try:
+        with Image.open(io.BytesIO(data)) as image:  # reads the header only
+            image_format = image.format
+            width, height = image.size
+    except (OSError, Image.DecompressionBombError) as e:
+        raise ValueError("Not a valid image") from e
+    if image_format not in ACCEPTED_FORMATS:
+        raise ValueError(f"Unsupported image format {image_format}")
+    if width * height > MAX_PIXELS:
+        raise ValueError("Image is too large")
+
+    digest = hashlib.sha256(data).hexdigest()[:32]
+    if variants_ready(digest):
+        return digest, None
+    directory = image_dir(digest)
+    os.makedirs(directory, exist_ok=True)
+    original = os.path.join(directory, "original")
+    if not os.path.exists(original):
+        with open(f"{original}.{os.getpid()}.tmp", "wb") as file:
+            file.write(data)
+        os.replace(f"{original}.{os.getpid()}.tmp", original)
+    future = _executor().submit(render_variants, data, directory)
+    future.add_done_callback(_log_failure)
+    return digest, future
@@ -0,0 +1,88 @@
+from sqlalchemy import text
+
+from src import db
+from src.helpers.product_loader import load_products
+from src.models import Product
+
+
+def stock_levels(product_ids):
+    """
+    :return: the stock left of each existing product, {product_id: quantity}
+    :rtype: dict
+    """
+    return {product_id: row.quantity for product_id, row
+            in load_products(product_ids, fields=("quantity",)).items()}
+
+
+def validate_cart(cart_dict, stock=None):
+    """
+    Check a whole cart against stock read in one query.
+
+    :param cart_dict: {product_id: quantity}
+    :param stock: {product_id: quantity} already read, None to read it now
+    :return: the lines that can't be bought, as dicts with product_id,
+        requested and available (None for a product that doesn't exist)
+    :rtype: list
+    """
+    if stock is None:
+        stock = stock_levels(cart_dict)
+    return [{"product_id": product_id, "requested": quantity,
+             "available": stock.get(product_id)}
+            for product_id, quantity in cart_dict.items()
+            if quantity > stock.get(product_id, 0)]
+
+
+def _supports_update_returning():
+    dialect = db.engine.dialect
+    if dialect.name == "postgresql":
+        return True
+    # UPDATE ... FROM needs SQLite 3.33, RETURNING 3.35
+    return dialect.name == "sqlite" and dialect.dbapi.sqlite_version_info >= (3, 35)
+
+
+def apply_decrements(quantities):
+    """
+    Take sold quantities off stock in the current transaction with one
+    guarded statement:
+
+        WITH v(id, n) AS (VALUES ...)
+        UPDATE products SET quantity = quantity - v.n FROM v
+        WHERE products.id = v.id AND products.quantity >= v.n RETURNING id
+
+    The database applies each decrement against the row as it is when it
+    locks it, so concurrent orders for one product never read-modify-write
+    a stale quantity, and a line that would go below zero is left alone.
+
+    :param quantities: {product_id: quantity}
+    :return: the lines that were not applied, as in validate_cart
+    :rtype: list
+    """
+    quantities = {int(product_id): int(quantity) for product_id, quantity
+                  in quantities.items() if quantity}
+    if not quantities:
+        return []
+    if _supports_update_returning():
+        params = {}
+        rows = []
+        for position, (product_id, quantity) in enumerate(quantities.items()):
+            params[f"id_{position}"] = product_id
+            params[f"n_{position}"] = quantity
+            rows.append(f"(:id_{position}, :n_{position})")
+        statement = text(f"WITH v(id, n) AS (VALUES {', '.join(rows)}) "
+                         "UPDATE products SET quantity = products.quantity - v.n FROM v "
+                         "WHERE products.id = v.id AND products.quantity >= v.n "
+                         "RETURNING products.id")
+        applied = {row[0] for row in db.session.execute(statement, params)}
+    else:
+        applied = set()
+        for product_id, quantity in quantities.items():
+            result = db.session.query(Product).filter(
+                Product.id == product_id, Product.quantity >= quantity).update(
+                {Product.quantity: Product.quantity - quantity}, synchronize_session=False)
+            if result:
+                applied.add(product_id)
+
+    failed = [product_id for product_id in quantities if product_id not in applied]
+    stock = stock_levels(failed) if failed else {}
+    return [{"product_id": product_id, "requested": quantities[product_id],
+             "available": stock.get(product_id)} for product_id in failed]
@@ -0,0 +1,60 @@
+try:
+    import orjson
+except ImportError:  # pragma: no cover - falls back to the stdlib encoder
+    orjson = None
+
+from flask.json import JSONEncoder
+
+try:
+    from flask.json.provider import DefaultJSONProvider
+except ImportError:  # Flask < 2.2 has no JSON provider interface
+    DefaultJSONProvider = None
+
+
+def _options(sort_keys, indent):
+    # datetimes go through default(), keeping Flask's RFC 822 format
+    option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+    if sort_keys:
+        option |= orjson.OPT_SORT_KEYS
+    if indent:
+        option |= orjson.OPT_INDENT_2
+    return option
+
+
+class FastJSONEncoder(JSONEncoder):
+    """
+    JSON encoder backed by orjson. UUIDs are encoded natively; datetimes,
+    dates and anything else orjson can't handle go through Flask's usual
+    default(), so datetimes keep their RFC 822 format.
+    """
+
+    def encode(self, o):
+        if orjson is None:
+            return super().encode(o)
+        return orjson.dumps(o, default=self.default,
+                            option=_options(self.sort_keys, self.indent)).decode("utf-8")
+
+
+if DefaultJSONProvider is not None:
+    class FastJSONProvider(DefaultJSONProvider):
+        def dumps(self, obj, **kwargs):
+            if orjson is None:
+                return super().dumps(obj, **kwargs)
+            return orjson.dumps(obj, default=self.default,
+                                option=_options(kwargs.get("sort_keys", self.sort_keys),
+                                                kwargs.get("indent"))).decode("utf-8")
+
+        def response(self, *args, **kwargs):
+            obj = self._prepare_response_obj(args, kwargs)
+            return self._app.response_class(
+                orjson.dumps(obj, default=self.default,
+                             option=_options(self.sort_keys, None)) if orjson is not None
+                else self.dumps(obj),
+                mimetype=self.mimetype)
+
+
+def init_json(app):
+    if DefaultJSONProvider is not None:
+        app.json = FastJSONProvider(app)
+    else:
+        app.json_encoder = FastJSONEncoder
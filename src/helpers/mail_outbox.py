@@ -0,0 +1,267 @@
+import smtplib
+import threading
+import time
+from datetime import datetime, timedelta
+
+from flask_mail import Connection, Message
+from sqlalchemy import func, or_, update
+
+from src import app, db
+from src.helpers.metrics import Counters, Histogram
+from src.helpers.retry import backoff
+from src.models import MailOutbox
+
+PENDING = "pending"
+SENDING = "sending"
+SENT = "sent"
+DEAD = "dead"
+
+send_latency = Histogram()
+counters = Counters()
+
+_workers = []
+_workers_lock = threading.Lock()
+_wake = threading.Event()
+
+
+class RateLimiter:
+    """
+    Token bucket shared by the workers: at most rate sends per second on
+    average, in bursts of up to burst.
+    """
+
+    def __init__(self, rate, burst=1, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.burst = burst
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = burst
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Wait until a send is allowed."""
+        if not self.rate:
+            return
+        while True:
+            with self._lock:
+                now = self._clock()
+                self._tokens = min(self.burst,
+                                   self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            self._sleep(wait)
+
+
+class Mailer:
+    """
+    One worker's SMTP connection, opened on the first send and kept open
+    for the following ones until it has been idle for idle_timeout seconds.
+
+    :param state: the Flask-Mail settings, app.extensions["mail"]
+    """
+
+    def __init__(self, state, idle_timeout=30):
+        self.state = state
+        self.idle_timeout = idle_timeout
+        self._connection = None
+        self._last_used = 0
+
+    def send(self, message):
+        if self._connection is None:
+            self._connection = Connection(self.state).__enter__()
+            counters.inc("connections_opened")
+        try:
+            self._connection.send(message)
+        except (smtplib.SMTPServerDisconnected, OSError):
+            self.close()
+            raise
+        self._last_used = time.monotonic()
+
+    def close_if_idle(self):
+        if self._connection is not None and \
+                time.monotonic() - self._last_used >= self.idle_timeout:
+            self.close()
+
+    def close(self):
+        connection, self._connection = self._connection, None
+        if connection is not None:
+            try:
+                connection.__exit__(None, None, None)
+            except (smtplib.SMTPException, OSError):
+                pass
+
+
+def _rate_limiter():
+    limiter = app.extensions.get("mail_rate_limiter")
+    if limiter is None:
+        limiter = app.extensions["mail_rate_limiter"] = RateLimiter(
+            app.config.get("MAIL_RATE_LIMIT", 0), app.config.get("MAIL_RATE_BURST", 1))
+    return limiter
+
+
+def enqueue(message, commit=True):
+    """
+    Queue a flask_mail Message for the outbox workers.
+
+    :param commit: commit now and wake the workers; pass False to queue the
+        mail in the caller's transaction and call wake() after committing
+    """
+    db.session.add(MailOutbox(sender=message.sender, recipients=list(message.recipients),
+                              subject=message.subject or "", body=message.body,
+                              html=message.html))
+    if commit:
+        db.session.commit()
+        wake()
+
+
+def wake():
+    start_workers()
+    _wake.set()
+
+
+def claim_batch(limit):
+    """
+    Lease up to limit due mails to this worker, as webhook_inbox.claim_batch.
+
+    :return: ids of the claimed mails, oldest first
+    :rtype: list
+    """
+    now = datetime.utcnow()
+    due = db.session.query(MailOutbox.id, MailOutbox.next_attempt_at).filter(
+        or_(MailOutbox.status == PENDING, MailOutbox.status == SENDING),
+        MailOutbox.next_attempt_at <= now).order_by(
+        MailOutbox.id).limit(limit).with_for_update(skip_locked=True).all()
+    lease_until = now + timedelta(seconds=app.config.get("MAIL_LEASE_SECONDS", 300))
+    claimed = []
+    for mail_id, due_at in due:
+        if db.session.execute(update(MailOutbox).where(
+                MailOutbox.id == mail_id, MailOutbox.next_attempt_at == due_at).values(
+                status=SENDING, attempts=MailOutbox.attempts + 1,
+                next_attempt_at=lease_until)).rowcount == 1:
+            claimed.append(mail_id)
+    db.session.commit()
+    return claimed
+
+
+def _permanent(error):
+    # 5xx replies (unknown mailbox, rejected message) won't succeed on retry
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _ in error.recipients.values())
+    return isinstance(error, smtplib.SMTPResponseException) and error.smtp_code >= 500 \
+        and not isinstance(error, smtplib.SMTPAuthenticationError)
+
+
+def _send(mailer, mail):
+    message = Message(subject=mail.subject, recipients=mail.recipients, body=mail.body,
+                      html=mail.html, sender=mail.sender)
+    _rate_limiter().acquire()
+    started = time.perf_counter()
+    try:
+        mailer.send(message)
+    except Exception as e:
+        counters.inc("failed")
+        app.logger.error(f"Sending mail {mail.id} failed: {e}")
+        mail.last_error = repr(e)[:2000]
+        if _permanent(e) or mail.attempts >= app.config.get("MAIL_MAX_ATTEMPTS", 6):
+            mail.status = DEAD
+            counters.inc("dead")
+        else:
+            mail.status = PENDING
+            mail.next_attempt_at = datetime.utcnow() + timedelta(seconds=backoff(
+                mail.attempts, app.config.get("MAIL_RETRY_BASE", 30)))
+    else:
+        send_latency.observe(time.perf_counter() - started)
+        counters.inc("sent")
+        mail.status = SENT
+        mail.sent_at = datetime.utcnow()
+        mail.last_error = None
+    db.session.commit()
+
+
+def process_batch(mailer, limit=None):
+    """
+    Claim and send one batch of due mails over mailer's connection.
+
+    :return: number of mails claimed
+    :rtype: int
+    """
+    claimed = claim_batch(limit or app.config.get("MAIL_BATCH_SIZE", 20))
+    for mail_id in claimed:
+        mail = MailOutbox.query.get(mail_id)
+        if mail is not None and mail.status == SENDING:
+            _send(mailer, mail)
+    return len(claimed)
+
+
+def drain(mailer=None):
+    """
+    :return: number of mails claimed until none were due
+    :rtype: int
+    """
+    mailer = mailer or Mailer(app.extensions["mail"])
+    total = 0
+    try:
+        while True:
+            claimed = process_batch(mailer)
+            if not claimed:
+                return total
+            total += claimed
+    finally:
+        mailer.close()
+
+
+def queue_depth():
+    """
+    :return: number of mails per status, {status: count}
+    :rtype: dict
+    """
+    return dict(db.session.query(MailOutbox.status, func.count(MailOutbox.id)).filter(
+        MailOutbox.status != SENT).group_by(MailOutbox.status).all())
+
+
+def stats():
+    return {"queue": queue_depth(), "send_latency": send_latency.snapshot(),
+            **counters.snapshot()}
+
+
+def _work():
+    interval = app.config.get("MAIL_POLL_INTERVAL", 5)
+    with app.app_context():
+        mailer = Mailer(app.extensions["mail"], app.config.get("MAIL_CONNECTION_IDLE", 30))
+    while True:
+        with app.app_context():
+            try:
+                claimed = process_batch(mailer)
+            except Exception as e:  # keep working after a transient error
+                app.logger.error(e)
+                db.session.rollback()
+                claimed = 0
+            finally:
+                db.session.remove()
+        if not claimed:
+            mailer.close_if_idle()
+            _wake.wait(interval)
+            _wake.clear()
+
+
+@app.before_first_request
+def _start_on_boot():
+    # mail a previous process left queued is sent without waiting for the
+    # next enqueue; run in the serving process, after any fork
+    start_workers()
+
+
+def start_workers():
+    # started by the first request rather than at import, so CLI commands
+    # and forking servers don't inherit running threads
+    with _workers_lock:
+        if _workers:
+            return
+        for number in range(app.config.get("MAIL_WORKERS", 0)):
+            worker = threading.Thread(target=_work, name=f"mail-worker-{number}", daemon=True)
+            worker.start()
+            _workers.append(worker)
@@ -0,0 +1,55 @@
+import bisect
+import threading
+
+# upper bounds, in seconds, of the latency buckets; the last bucket is open ended
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Histogram:
+    """
+    In-process histogram of observed values, e.g. call latencies, with
+    cumulative bucket counts in the style of Prometheus.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self._counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._sum += value
+
+    def snapshot(self):
+        """
+        :return: count, sum and the cumulative count of each bucket keyed by
+            its upper bound ("+Inf" for the last one)
+        :rtype: dict
+        """
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        cumulative = {}
+        running = 0
+        for bound, count in zip([*map(str, self.buckets), "+Inf"], counts):
+            running += count
+            cumulative[bound] = running
+        return {"count": running, "sum": round(total, 6), "buckets": cumulative}
+
+
+class Counters:
+    """Named in-process counters."""
+
+    def __init__(self):
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, amount=1):
+        with self._lock:
+            self._values[name] = self._values.get(name, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._values)
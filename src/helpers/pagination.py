@@ -0,0 +1,109 @@
+import base64
+import json
+from datetime import datetime
+
+from sqlalchemy import and_, or_, tuple_
+from werkzeug.exceptions import abort
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+
+def wants_cursor(args):
+    """
+    Cursor (keyset) pagination is opt-in: a request asking for
+    ``?cursor=...`` or ``?limit=...`` gets it, everything else keeps the
+    page/pages response.
+    """
+    return "cursor" in args or "limit" in args
+
+
+def page_limit(args):
+    limit = args.get("limit", DEFAULT_LIMIT, type=int)
+    if limit < 1:
+        abort(400, "limit must be positive")
+    return min(limit, MAX_LIMIT)
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {"dt": value.isoformat()}
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict):
+        return datetime.fromisoformat(value["dt"])
+    return value
+
+
+def encode_cursor(values):
+    raw = json.dumps([_encode_value(value) for value in values],
+                     separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode("ascii")
+
+
+def decode_cursor(cursor, size):
+    """
+    :param cursor: opaque cursor from a previous response
+    :param size: number of sort key values the cursor must hold
+    :return: the sort key values of the last row of the previous page,
+        or None for the first page
+    :rtype: list
+    """
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+        if not isinstance(values, list) or len(values) != size:
+            raise ValueError(cursor)
+        return [_decode_value(value) for value in values]
+    except (ValueError, TypeError, KeyError):
+        abort(400, "Invalid cursor")
+
+
+def keyset_filter(order, values):
+    """
+    Build the "comes after" predicate for the sort key. A key sorted in one
+    direction becomes a row-value comparison, (a, b) > (x, y), which a
+    composite index on (a, b) serves directly; mixed directions are expanded
+    to (a > x) OR (a = x AND b > y) OR ...
+
+    :param order: list of (column, descending) pairs, most significant first
+    :param values: sort key values of the last row already returned
+    """
+    directions = {descending for _, descending in order}
+    if len(directions) == 1:
+        columns = tuple_(*[column for column, _ in order])
+        return columns < tuple_(*values) if directions.pop() else columns > tuple_(*values)
+    clauses = []
+    for position, (column, descending) in enumerate(order):
+        equal = [prefix == value for (prefix, _), value
+                 in zip(order[:position], values[:position])]
+        after = column < values[position] if descending else column > values[position]
+        clauses.append(and_(*equal, after))
+    return or_(*clauses)
+
+
+def keyset_page(query, order, values, limit):
+    """
+    Fetch one page of query after a cursor, without OFFSET or COUNT.
+
+    :param query: the filtered query; every sort column must be one of its entities
+    :param order: list of (column, descending) pairs forming a unique sort key
+    :param values: decoded cursor values, or None for the first page
+    :param limit: page size
+    :return: the page rows and the cursor of the next page (None on the last page)
+    :rtype: tuple
+    """
+    if values is not None:
+        query = query.filter(keyset_filter(order, values))
+    query = query.order_by(*[column.desc() if descending else column.asc()
+                             for column, descending in order])
+    rows = query.limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        next_cursor = encode_cursor(getattr(rows[limit - 1], column.key)
+                                    for column, _ in order)
+    return rows[:limit], next_cursor
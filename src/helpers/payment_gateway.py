@@ -0,0 +1,203 @@
+import threading
+import time
+import uuid
+
+import requests
+import stripe
+from requests.adapters import HTTPAdapter
+from stripe.api_requestor import APIRequestor
+from stripe.util import convert_to_stripe_object
+
+from src import app
+from src.helpers.metrics import Counters, Histogram
+from src.helpers.retry import backoff
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+# failures that may go away on their own: network errors and timeouts,
+# 429 and 5xx replies
+RETRYABLE = (stripe.error.APIConnectionError, stripe.error.RateLimitError,
+             stripe.error.APIError)
+
+
+class CircuitOpen(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Opens after failure_threshold calls in a row failed, then turns every
+    call away for reset_timeout seconds before letting one trial call
+    through: the circuit closes again if it succeeds.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._failures = 0
+        self._opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self._opened_at is None:
+            return CLOSED
+        if self._trial or self._clock() - self._opened_at >= self.reset_timeout:
+            return HALF_OPEN
+        return OPEN
+
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._trial or self._clock() - self._opened_at < self.reset_timeout:
+                return False
+            self._trial = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial or self._failures >= self.failure_threshold:
+                self._opened_at = self._clock()
+            self._trial = False
+
+
+class PaymentGateway:
+    """
+    Stripe API calls over a kept-alive connection pool, with connect and
+    read timeouts, bounded retries with jittered backoff, a circuit breaker
+    and a latency histogram per operation.
+
+    A retry is only started if it can finish within total_timeout of the
+    call starting, so a reply that timed out is in practice not waited for
+    again, while a refused connection or a 5xx is retried.
+    """
+
+    def __init__(self, api_key, api_base=None, connect_timeout=3.05, read_timeout=10,
+                 max_retries=2, retry_base=0.25, pool_size=10, breaker=None,
+                 sleep=time.sleep, total_timeout=15):
+        self.api_key = api_key
+        self.api_base = api_base
+        self.read_timeout = read_timeout
+        self.total_timeout = total_timeout
+        self.max_retries = max_retries
+        self.retry_base = retry_base
+        self.breaker = breaker or CircuitBreaker()
+        self._sleep = sleep
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        self.http_client = stripe.http_client.RequestsClient(
+            timeout=(connect_timeout, read_timeout), session=session)
+        self.latency = {}
+        self.counters = Counters()
+
+    def _observe(self, operation, seconds):
+        histogram = self.latency.get(operation)
+        if histogram is None:
+            histogram = self.latency.setdefault(operation, Histogram())
+        histogram.observe(seconds)
+
+    def request(self, operation, method, url, params=None):
+        """
+        :param operation: name the call is counted and timed under
+        :return: the response as a Stripe object
+        :raises CircuitOpen: when Stripe has been failing and isn't tried
+        :raises stripe.error.StripeError: when the call failed
+        """
+        if not self.breaker.allow():
+            self.counters.inc(f"{operation}.short_circuited")
+            raise CircuitOpen("Stripe is unavailable")
+        # the same key on every attempt, so a retried create that did
+        # reach Stripe isn't applied twice
+        headers = {"Idempotency-Key": uuid.uuid4().hex} if method == "post" else None
+        requestor = APIRequestor(self.api_key, client=self.http_client, api_base=self.api_base)
+        deadline = time.monotonic() + self.total_timeout
+        attempt = 0
+        while True:
+            attempt += 1
+            started = time.perf_counter()
+            try:
+                response, api_key = requestor.request(method, url, params, headers)
+            except RETRYABLE:
+                self._observe(operation, time.perf_counter() - started)
+                self.counters.inc(f"{operation}.errors")
+                # every failed attempt counts, so the breaker opens after
+                # failure_threshold attempts rather than calls
+                self.breaker.record_failure()
+                delay = backoff(attempt, self.retry_base, cap=2)
+                if attempt > self.max_retries or self.breaker.state != CLOSED \
+                        or time.monotonic() + delay + self.read_timeout > deadline:
+                    raise
+                self.counters.inc(f"{operation}.retries")
+                self._sleep(delay)
+                continue
+            except stripe.error.StripeError:
+                # a rejected request says nothing about Stripe's health
+                self._observe(operation, time.perf_counter() - started)
+                self.counters.inc(f"{operation}.rejected")
+                self.breaker.record_success()
+                raise
+            except BaseException:
+                # anything else must still settle a half-open trial, or the
+                # breaker would turn every later call away
+                self._observe(operation, time.perf_counter() - started)
+                self.counters.inc(f"{operation}.errors")
+                self.breaker.record_failure()
+                raise
+            self._observe(operation, time.perf_counter() - started)
+            self.counters.inc(f"{operation}.ok")
+            self.breaker.record_success()
+            return convert_to_stripe_object(response, api_key)
+
+    def create_checkout_session(self, **params):
+        return self.request("checkout_session_create", "post", "/v1/checkout/sessions", params)
+
+    def create_product(self, **params):
+        return self.request("product_create", "post", "/v1/products", params)
+
+    def update_product(self, product_id, **params):
+        return self.request("product_update", "post", f"/v1/products/{product_id}", params)
+
+    def create_price(self, **params):
+        return self.request("price_create", "post", "/v1/prices", params)
+
+    def update_price(self, price_id, **params):
+        return self.request("price_update", "post", f"/v1/prices/{price_id}", params)
+
+    def stats(self):
+        return {"circuit": self.breaker.state, **self.counters.snapshot(),
+                "latency": {operation: histogram.snapshot()
+                            for operation, histogram in self.latency.items()}}
+
+
+def gateway():
+    """
+    :return: the app's PaymentGateway, configured from the STRIPE_* settings
+    :rtype: PaymentGateway
+    """
+    payment_gateway = app.extensions.get("payment_gateway")
+    if payment_gateway is None:
+        payment_gateway = app.extensions.setdefault("payment_gateway", PaymentGateway(
+            app.config["STRIPE_SECRET_KEY"], api_base=app.config.get("STRIPE_API_BASE"),
+            connect_timeout=app.config.get("STRIPE_CONNECT_TIMEOUT", 3.05),
+            read_timeout=app.config.get("STRIPE_READ_TIMEOUT", 10),
+            max_retries=app.config.get("STRIPE_MAX_RETRIES", 2),
+            total_timeout=app.config.get("STRIPE_TOTAL_TIMEOUT", 15),
+            retry_base=app.config.get("STRIPE_RETRY_BASE", 0.25),
+            pool_size=app.config.get("STRIPE_POOL_SIZE", 10),
+            breaker=CircuitBreaker(app.config.get("STRIPE_BREAKER_THRESHOLD", 5),
+                                   app.config.get("STRIPE_BREAKER_RESET", 30))))
+    return payment_gateway
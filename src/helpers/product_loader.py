@@ -0,0 +1,24 @@
+from src.models import Product
+
+MAX_BATCH = 300
+PRODUCT_FIELDS = Product.PUBLIC_FIELDS
+
+
+def load_products(product_ids, fields=None):
+    """
+    Load many products with a single IN query.
+
+    :param product_ids: iterable of product ids, duplicates allowed
+    :param fields: column names to project, None for full Product entities
+    :return: the products found, keyed by id; missing ids are simply absent
+    :rtype: dict
+    """
+    product_ids = list(set(product_ids))
+    if not product_ids:
+        return {}
+    if fields is None:
+        query = Product.query
+    else:
+        columns = ["id"] + [field for field in fields if field != "id"]
+        query = Product.query.with_entities(*[getattr(Product, field) for field in columns])
+    return {row.id: row for row in query.filter(Product.id.in_(product_ids))}
@@ -0,0 +1,164 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from src import db
+from src.helpers.etags import bump_version
+from src.models import Order, OrderDetails, ProductPair, ProductRelated, JobState
+
+JOB_NAME = "related_products"
+RELATED_TOP_K = 20
+# order_details (baskets) read per round, and products per IN list
+BASKET_BATCH = 5000
+BATCH_SIZE = 1000
+# an id skipped past is folded in if its basket commits later on, until
+# it is this old: by then its transaction was rolled back
+GAP_SECONDS = 60 * 60
+MAX_GAPS = 10000
+
+
+def cooccurrence(baskets, products):
+    """
+    Count, for every ordered pair of distinct products, the baskets holding
+    both: the non-zero cells of the sparse item-item matrix X.T @ X, where X
+    is the basket x product incidence matrix, as (row, column, count) arrays.
+
+    :param baskets: basket id of each order line
+    :param products: product id of each order line
+    :return: product ids, other product ids and co-occurrence counts
+    :rtype: tuple
+    """
+    baskets = np.asarray(baskets, dtype=np.int64)
+    products = np.asarray(products, dtype=np.int64)
+    empty = np.empty(0, dtype=np.int64)
+    if not len(products):
+        return empty, empty, empty
+    width = int(products.max()) + 1
+    # one line per (basket, product), sorted by basket
+    lines = np.unique(baskets * width + products)
+    baskets, products = lines // width, lines % width
+    _, starts, sizes = np.unique(baskets, return_index=True, return_counts=True)
+
+    # pair every line with every line of its basket, itself included
+    line_sizes = np.repeat(sizes, sizes)
+    line_starts = np.repeat(starts, sizes)
+    left = np.repeat(np.arange(len(lines)), line_sizes)
+    offsets = np.arange(len(left)) - np.repeat(np.cumsum(line_sizes) - line_sizes, line_sizes)
+    right = np.repeat(line_starts, line_sizes) + offsets
+    keep = left != right
+
+    pairs, counts = np.unique(products[left[keep]] * width + products[right[keep]],
+                              return_counts=True)
+    return pairs // width, pairs % width, counts
+
+
+def _fold_baskets(*criteria):
+    """
+    Add the baskets matching criteria, on orders.order_details_id, to
+    product_pairs.
+
+    :return: the product ids whose neighbours changed
+    :rtype: set
+    """
+    lines = np.array(db.session.query(Order.order_details_id, Order.product_id).filter(
+        *criteria, Order.product_id.isnot(None)).all(), dtype=np.int64).reshape(-1, 2)
+    left, right, counts = cooccurrence(lines[:, 0], lines[:, 1])
+    rows = [{"product_id": product_id, "other_id": other_id, "count": count}
+            for product_id, other_id, count
+            in zip(left.tolist(), right.tolist(), counts.tolist())]
+    for start in range(0, len(rows), BATCH_SIZE):
+        ProductPair.bump_many(rows[start:start + BATCH_SIZE])
+    return set(left.tolist())
+
+
+def _store_top_k(product_ids):
+    now = datetime.utcnow()
+    product_ids = sorted(product_ids)
+    for start in range(0, len(product_ids), BATCH_SIZE):
+        chunk = product_ids[start:start + BATCH_SIZE]
+        neighbours = {product_id: [] for product_id in chunk}
+        for pair in ProductPair.query.filter(ProductPair.product_id.in_(chunk)).order_by(
+                ProductPair.product_id, ProductPair.count.desc(), ProductPair.other_id):
+            top = neighbours[pair.product_id]
+            if len(top) < RELATED_TOP_K:
+                top.append([pair.other_id, pair.count])
+        ProductRelated.query.filter(ProductRelated.product_id.in_(chunk)).delete(
+            synchronize_session=False)
+        db.session.bulk_insert_mappings(ProductRelated, [
+            {"product_id": product_id, "related": related, "updated_at": now}
+            for product_id, related in neighbours.items() if related])
+
+
+def _fold_late_baskets(gaps):
+    """
+    Fold the baskets of gaps that have been committed since, and forget the
+    gaps folded or too old to ever be.
+
+    :param gaps: first seen time by skipped order_details id, updated
+    :return: the product ids whose neighbours changed and number of baskets
+    :rtype: tuple
+    """
+    touched = set()
+    late = []
+    gap_ids = sorted(gaps)
+    for start in range(0, len(gap_ids), BATCH_SIZE):
+        late += [row.id for row in db.session.query(OrderDetails.id).filter(
+            OrderDetails.id.in_(gap_ids[start:start + BATCH_SIZE]))]
+    if late:
+        touched = _fold_baskets(Order.order_details_id.in_(late))
+    expired = datetime.utcnow() - timedelta(seconds=GAP_SECONDS)
+    for basket_id in late:
+        del gaps[basket_id]
+    for basket_id in [basket_id for basket_id, seen in gaps.items() if seen < expired]:
+        del gaps[basket_id]
+    return touched, len(late)
+
+
+def refresh_related(full=False):
+    """
+    Fold the orders placed since the last run into the co-occurrence counts
+    and recompute the top-K neighbours of the products they touched.
+
+    Ids are handed out before commit, so a basket may become visible after
+    a higher one was folded: the ids skipped past are kept as gaps and
+    folded in on a later run if they show up.
+
+    :param full: drop the counts and rebuild them from every order
+    :return: number of baskets processed and of products refreshed
+    :rtype: tuple
+    """
+    state = JobState.query.filter_by(name=JOB_NAME).with_for_update().first()
+    if state is None:
+        state = JobState(name=JOB_NAME, watermark=0, gaps=[])
+        db.session.add(state)
+    if full:
+        ProductPair.query.delete(synchronize_session=False)
+        ProductRelated.query.delete(synchronize_session=False)
+        state.watermark = 0
+        state.gaps = []
+
+    gaps = {basket_id: datetime.fromisoformat(seen) for basket_id, seen in state.gaps or []}
+    touched, baskets = _fold_late_baskets(gaps)
+    now = datetime.utcnow()
+    while True:
+        basket_ids = [row.id for row in db.session.query(OrderDetails.id).filter(
+            OrderDetails.id > state.watermark).order_by(OrderDetails.id).limit(BASKET_BATCH)]
+        if not basket_ids:
+            break
+        touched |= _fold_baskets(Order.order_details_id > state.watermark,
+                                 Order.order_details_id <= basket_ids[-1])
+        baskets += len(basket_ids)
+        gaps.update((basket_id, now) for basket_id in
+                    set(range(state.watermark + 1, basket_ids[-1])) - set(basket_ids))
+        state.watermark = basket_ids[-1]
+
+    _store_top_k(touched)
+    # a jump in the id sequence is not worth tracking id by id: keep the
+    # gaps closest to the watermark
+    state.gaps = [[basket_id, gaps[basket_id].isoformat()]
+                  for basket_id in sorted(gaps)[-MAX_GAPS:]]
+    state.updated_at = now
+    db.session.commit()
+    if touched:
+        bump_version()
+    return baskets, len(touched)
@@ -0,0 +1,309 @@
+import random
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, update
+
+from src import app, db
+from src.models import Product, StockReservation, StockShard
+
+SWEEP_BATCH = 500
+
+_sweeper = None
+_sweeper_lock = threading.Lock()
+
+
+def reservations_enabled():
+    return bool(app.config.get("STOCK_RESERVATIONS"))
+
+
+def _shard_count():
+    return app.config.get("STOCK_SHARDS", 8)
+
+
+def _expiry(ttl=None):
+    return datetime.utcnow() + timedelta(seconds=ttl or app.config.get("RESERVATION_TTL", 900))
+
+
+def _insert_ignore(model, rows):
+    dialect = db.engine.dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        for row in rows:
+            if not model.query.get((row["product_id"], row["shard"])):
+                db.session.add(model(**row))
+        return
+    db.session.execute(insert(model).on_conflict_do_nothing(), rows)
+
+
+def split_stock(quantity, shards):
+    """
+    :return: quantity spread over shards as evenly as possible
+    :rtype: list
+    """
+    quantity = max(quantity, 0)
+    return [quantity // shards + (1 if shard < quantity % shards else 0)
+            for shard in range(shards)]
+
+
+def init_shards(product_ids=None):
+    """
+    (Re)build the shards of products from their stock, less what is
+    currently held.
+
+    :param product_ids: products to initialize, None for all
+    :return: number of products initialized
+    :rtype: int
+    """
+    held = db.session.query(StockReservation.product_id, func.sum(StockReservation.quantity)
+                            ).group_by(StockReservation.product_id)
+    products = db.session.query(Product.id, Product.quantity)
+    shards = db.session.query(StockShard)
+    if product_ids is not None:
+        held = held.filter(StockReservation.product_id.in_(product_ids))
+        products = products.filter(Product.id.in_(product_ids))
+        shards = shards.filter(StockShard.product_id.in_(product_ids))
+    held = dict(held.all())
+    shards.delete(synchronize_session=False)
+    count = _shard_count()
+    rows = [{"product_id": product.id, "shard": shard, "available": available}
+            for product in products
+            for shard, available in enumerate(split_stock(
+                product.quantity - held.get(product.id, 0), count))]
+    db.session.bulk_insert_mappings(StockShard, rows)
+    return len(rows) // count
+
+
+def _ensure_shards(product_id):
+    if db.session.query(StockShard.shard).filter_by(product_id=product_id).first():
+        return
+    product = Product.query.get(product_id)
+    if product is None:
+        return
+    held = db.session.query(func.coalesce(func.sum(StockReservation.quantity), 0)).filter(
+        StockReservation.product_id == product_id).scalar()
+    # another worker may initialize the same product concurrently
+    _insert_ignore(StockShard, [
+        {"product_id": product_id, "shard": shard, "available": available}
+        for shard, available in enumerate(split_stock(product.quantity - held,
+                                                      _shard_count()))])
+
+
+def _decrement(product_id, shard, quantity):
+    """Conditional decrement: takes quantity only if the shard still has it."""
+    return db.session.execute(update(StockShard).where(
+        StockShard.product_id == product_id, StockShard.shard == shard,
+        StockShard.available >= quantity).values(
+        available=StockShard.available - quantity)).rowcount == 1
+
+
+def _increment(product_id, shard, quantity):
+    db.session.execute(update(StockShard).where(
+        StockShard.product_id == product_id, StockShard.shard == shard).values(
+        available=StockShard.available + quantity))
+
+
+def take_stock(product_id, quantity, partial=False):
+    """
+    Take quantity from a product's shards, starting at a random shard so
+    concurrent requests spread over different rows.
+
+    :param partial: take what is there when there is not enough
+    :return: [(shard, taken), ...]; empty when partial is False and the
+        product has less than quantity left
+    :rtype: list
+    """
+    _ensure_shards(product_id)
+    count = _shard_count()
+    start = random.randrange(count)
+    taken = []
+    remaining = quantity
+    for shard in [(start + offset) % count for offset in range(count)]:
+        if remaining <= 0:
+            break
+        if _decrement(product_id, shard, remaining):
+            taken.append((shard, remaining))
+            remaining = 0
+            break
+        # not enough here: take whatever this shard still has
+        available = db.session.query(StockShard.available).filter_by(
+            product_id=product_id, shard=shard).scalar() or 0
+        if 0 < available < remaining and _decrement(product_id, shard, available):
+            taken.append((shard, available))
+            remaining -= available
+    if remaining and not partial:
+        for shard, quantity_taken in taken:
+            _increment(product_id, shard, quantity_taken)
+        return []
+    return taken
+
+
+def _release_rows(rows):
+    """
+    Delete reservation rows and put their stock back. A row is only given
+    back by whoever deletes it, so a sweep racing a cart update can't
+    return the same stock twice.
+    """
+    returned = defaultdict(int)
+    for row in rows:
+        deleted = StockReservation.query.filter_by(id=row.id).delete(synchronize_session=False)
+        if deleted:
+            returned[(row.product_id, row.shard)] += row.quantity
+    for (product_id, shard), quantity in returned.items():
+        _increment(product_id, shard, quantity)
+
+
+def held_quantities(cart_id):
+    """
+    :return: the quantities held for a cart, {product_id: quantity}
+    :rtype: dict
+    """
+    return dict(db.session.query(StockReservation.product_id,
+                                 func.sum(StockReservation.quantity)).filter(
+        StockReservation.cart_id == cart_id,
+        StockReservation.expires_at > datetime.utcnow()).group_by(
+        StockReservation.product_id).all())
+
+
+def hold(cart_id, product_id, quantity, ttl=None):
+    """
+    Make the stock held for a cart line exactly quantity, taking or giving
+    back the difference, and push the line's expiry back.
+
+    :return: False when there is not enough stock left, nothing changes then
+    :rtype: bool
+    :raises KeyError: with product_id when the product doesn't exist
+    """
+    rows = StockReservation.query.filter_by(cart_id=cart_id, product_id=product_id).order_by(
+        StockReservation.id.desc()).all()
+    held = sum(row.quantity for row in rows)
+    expires_at = _expiry(ttl)
+    try:
+        if quantity > held:
+            taken = take_stock(product_id, quantity - held)
+            if not taken:
+                db.session.rollback()
+                if not Product.query.with_entities(Product.id).filter_by(
+                        id=product_id).first():
+                    raise KeyError(product_id)
+                return False
+            db.session.add_all([StockReservation(cart_id=cart_id, product_id=product_id,
+                                                 shard=shard, quantity=part,
+                                                 expires_at=expires_at)
+                                for shard, part in taken])
+        excess = held - quantity
+        for row in rows:
+            if excess <= 0:
+                break
+            if row.quantity <= excess:
+                _release_rows([row])
+                excess -= row.quantity
+            else:
+                row.quantity -= excess
+                _increment(product_id, row.shard, excess)
+                excess = 0
+        StockReservation.query.filter_by(cart_id=cart_id, product_id=product_id).update(
+            {StockReservation.expires_at: expires_at}, synchronize_session=False)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    _start_sweeper()
+    return True
+
+
+def release(cart_id, product_id=None):
+    query = StockReservation.query.filter_by(cart_id=cart_id)
+    if product_id is not None:
+        query = query.filter_by(product_id=product_id)
+    _release_rows(query.all())
+    db.session.commit()
+
+
+def extend(cart_id, ttl=None):
+    StockReservation.query.filter_by(cart_id=cart_id).update(
+        {StockReservation.expires_at: _expiry(ttl)}, synchronize_session=False)
+    db.session.commit()
+
+
+def consume(cart_id, quantities):
+    """
+    Turn a cart's holds into a sale, in the caller's transaction: the held
+    stock is already off the shards, whatever wasn't held (e.g. the hold
+    expired) is taken from the shards now, as far as they go.
+
+    :param quantities: {product_id: quantity} sold
+    """
+    rows = StockReservation.query.filter_by(cart_id=cart_id).all() if cart_id else []
+    held = defaultdict(int)
+    for row in rows:
+        if StockReservation.query.filter_by(id=row.id).delete(synchronize_session=False):
+            held[row.product_id] += row.quantity
+    for product_id, quantity in quantities.items():
+        extra = held.pop(product_id, 0) - quantity
+        if extra < 0:
+            take_stock(product_id, -extra, partial=True)
+        elif extra > 0:
+            _increment(product_id, random.randrange(_shard_count()), extra)
+    # held but not bought: back on the shelf
+    for product_id, quantity in held.items():
+        _increment(product_id, random.randrange(_shard_count()), quantity)
+
+
+def adjust_stock(product_id, delta):
+    """
+    Follow a change of a product's stock (restock, manual edit) on its
+    shards, in the caller's transaction.
+    """
+    if not delta or not db.session.query(StockShard.shard).filter_by(
+            product_id=product_id).first():
+        return
+    if delta > 0:
+        _increment(product_id, random.randrange(_shard_count()), delta)
+    else:
+        take_stock(product_id, -delta, partial=True)
+
+
+def release_expired(limit=SWEEP_BATCH):
+    """
+    :return: number of expired holds released, at most limit
+    :rtype: int
+    """
+    rows = StockReservation.query.filter(
+        StockReservation.expires_at <= datetime.utcnow()).order_by(
+        StockReservation.expires_at).limit(limit).with_for_update(skip_locked=True).all()
+    _release_rows(rows)
+    db.session.commit()
+    return len(rows)
+
+
+def _sweep():
+    interval = app.config.get("RESERVATION_SWEEP_INTERVAL", 30)
+    while True:
+        time.sleep(interval)
+        with app.app_context():
+            try:
+                while release_expired() == SWEEP_BATCH:
+                    pass
+            except Exception as e:  # keep sweeping after a transient error
+                app.logger.error(e)
+                db.session.rollback()
+            finally:
+                db.session.remove()
+
+
+def _start_sweeper():
+    # started by the first hold rather than at import, so CLI commands and
+    # forking servers don't inherit a running thread
+    global _sweeper
+    if not app.config.get("RESERVATION_SWEEP_INTERVAL"):
+        return
+    with _sweeper_lock:
+        if _sweeper is None:
+            _sweeper = threading.Thread(target=_sweep, name="reservation-sweeper", daemon=True)
+            _sweeper.start()
@@ -0,0 +1,12 @@
+import random
+
+
+def backoff(attempts, base, cap=3600):
+    """
+    :param attempts: attempts made so far, from 1
+    :param base: seconds to wait after the first attempt
+    :return: seconds to wait before the next attempt: base doubled per
+        attempt up to cap, with +-50% jitter so retries don't synchronize
+    :rtype: float
+    """
+    return min(base * 2 ** (attempts - 1), cap) * random.uniform(0.5, 1.5)
@@ -0,0 +1,215 @@
+import heapq
+import math
+import re
+import threading
+from collections import defaultdict
+
+from src import db
+from src.helpers import signals
+from src.helpers.etags import PRODUCTS, current_version, up_to_date
+from src.helpers.spelling import SpellingIndex
+from src.models import Product
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+STOP_WORDS = frozenset(["a", "an", "and", "are", "as", "at", "be", "by", "for",
+                        "from", "in", "is", "it", "of", "on", "or", "the", "to",
+                        "with"])
+# (suffix, replacement), longest first. A light stemmer is enough here:
+# "phones"/"phone" and "gaming"/"game" should meet, nothing fancier.
+SUFFIXES = (("ational", "ate"), ("ization", "ize"), ("iveness", "ive"),
+            ("fulness", "ful"), ("ousness", "ous"), ("ations", "ate"),
+            ("ation", "ate"), ("ness", ""), ("ment", ""), ("ings", ""),
+            ("ing", ""), ("ies", "y"), ("ied", "y"), ("sses", "ss"),
+            ("ers", "er"), ("es", ""), ("ed", ""), ("ly", ""), ("s", ""))
+FIELD_WEIGHTS = {"product_name": 3.0, "category": 2.0, "product_description": 1.0}
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def stem(word):
+    if len(word) <= 3 or word.isdigit():
+        return word
+    for suffix, replacement in SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            if suffix == "s" and word.endswith(("ss", "us", "is")):
+                return word
+            word = word[:-len(suffix)] + replacement
+            break
+    # drop a final "e" so "phone" and "phones" meet at "phon", and collapse
+    # a doubled consonant left behind by "shipping" -> "shipp"
+    if len(word) > 3 and word.endswith("e"):
+        word = word[:-1]
+    elif len(word) > 3 and word[-1] == word[-2] and word[-1] not in "lsz":
+        word = word[:-1]
+    return word
+
+
+def words(text):
+    """
+    :param text: free text
+    :return: the lower-cased words of text, stop words removed
+    :rtype: list
+    """
+    return [word for word in TOKEN_PATTERN.findall((text or "").lower())
+            if word not in STOP_WORDS]
+
+
+def tokenize(text):
+    return [stem(word) for word in words(text)]
+
+
+class SearchIndex:
+    """
+    In-process inverted index over product name, description and category,
+    ranked with BM25 over field-weighted term frequencies.
+
+    Postings are kept per term as {product_id: weighted_tf}, so a query only
+    visits the products that contain one of its terms. The unstemmed words
+    also feed a spelling index used to correct queries that match nothing.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self._postings = defaultdict(dict)
+        self._doc_terms = {}
+        self._doc_words = {}
+        self._doc_len = {}
+        self.spelling = SpellingIndex()
+        self._total_len = 0.0
+        self.built = False
+        self.version = None
+
+    def __len__(self):
+        return len(self._doc_len)
+
+    def add(self, product_id, product_name, product_description, category):
+        terms = defaultdict(float)
+        vocabulary = set()
+        for field, text in (("product_name", product_name),
+                            ("product_description", product_description),
+                            ("category", category)):
+            for word in words(text):
+                terms[stem(word)] += FIELD_WEIGHTS[field]
+                vocabulary.add(word)
+        with self._lock:
+            self._remove(product_id)
+            for term, weight in terms.items():
+                self._postings[term][product_id] = weight
+            length = sum(terms.values())
+            self._doc_terms[product_id] = tuple(terms)
+            self._doc_words[product_id] = tuple(vocabulary)
+            self.spelling.add(vocabulary)
+            self._doc_len[product_id] = length
+            self._total_len += length
+
+    def remove(self, product_id):
+        with self._lock:
+            self._remove(product_id)
+
+    def _remove(self, product_id):
+        for term in self._doc_terms.pop(product_id, ()):
+            postings = self._postings[term]
+            postings.pop(product_id, None)
+            if not postings:
+                del self._postings[term]
+        self.spelling.remove(self._doc_words.pop(product_id, ()))
+        self._total_len -= self._doc_len.pop(product_id, 0.0)
+
+    def search(self, query, limit=20, offset=0, after=None):
+        """
+        :param query: free text query
+        :param limit: number of hits to return
+        :param offset: number of hits to skip
+        :param after: (score, product_id) of the last hit already returned;
+            only hits ranked below it are considered
+        :return: total number of matching products and the requested
+            (score, product_id) hits, best first
+        :rtype: tuple
+        """
+        terms = set(tokenize(query))
+        scores = defaultdict(float)
+        with self._lock:
+            doc_count = len(self._doc_len)
+            if not terms or not doc_count:
+                return 0, []
+            avg_len = self._total_len / doc_count
+            for term in terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (doc_count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for product_id, tf in postings.items():
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * self._doc_len[product_id] / avg_len)
+                    scores[product_id] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+        ranked = ((score, -product_id) for product_id, score in scores.items())
+        if after is not None:
+            last = (after[0], -after[1])
+            ranked = (hit for hit in ranked if hit < last)
+        hits = heapq.nlargest(offset + limit, ranked)
+        return len(scores), [(score, -neg_id) for score, neg_id in hits[offset:]]
+
+    def correct(self, query):
+        """
+        :param query: free text query
+        :return: the query with its unknown words replaced by the closest
+            catalog words, or None when there is nothing to correct
+        :rtype: str
+        """
+        corrected = []
+        changed = False
+        for word in TOKEN_PATTERN.findall((query or "").lower()):
+            replacement = None if word in STOP_WORDS else self.spelling.correct(word)
+            corrected.append(replacement or word)
+            changed = changed or replacement is not None
+        return " ".join(corrected) if changed else None
+
+    def build(self, rows, version=None):
+        """
+        :param rows: iterable of (id, product_name, product_description, category)
+        :param version: products version read before rows
+        """
+        with self._lock:
+            self._reset()
+            for row in rows:
+                self.add(*row)
+            self.built = True
+            self.version = version
+
+
+search_index = SearchIndex()
+
+
+def _current(version):
+    if not search_index.built or not up_to_date(PRODUCTS, search_index.version, version):
+        return False
+    search_index.version = version
+    return True
+
+
+def ensure_search_index():
+    # this worker's product writes are applied by the signal handlers below;
+    # a write from another worker moves the version past them and rebuilds
+    version, _ = current_version(PRODUCTS)
+    if not _current(version):
+        with search_index._lock:
+            if not _current(version):
+                search_index.build(db.session.query(Product.id,
+                                                    Product.product_name,
+                                                    Product.product_description,
+                                                    Product.category).yield_per(1000), version)
+    return search_index
+
+
+@signals.product_saved.connect
+def _on_product_saved(sender, product, **extra):
+    if search_index.built:
+        search_index.add(product.id, product.product_name,
+                         product.product_description, product.category)
+
+
+@signals.product_deleted.connect
+def _on_product_deleted(sender, product_id, **extra):
+    search_index.remove(product_id)
@@ -0,0 +1,43 @@
+from functools import lru_cache
+
+
+def compile_serializer(model, fields=None):
+    """
+    Build a function turning a model instance into a dict of its columns.
+
+    The function body is generated once, as a dict literal reading the
+    loaded values straight from the instance ``__dict__``, instead of
+    walking ``__table__.columns`` and calling getattr for every column of
+    every row. Rows with expired or deferred columns fall back to plain
+    attribute access, which loads them as usual.
+
+    :param model: a mapped model class
+    :param fields: attribute names to include, default every column
+    :return: function(instance) -> dict
+    """
+    if fields is None:
+        fields = [column.key for column in model.__mapper__.column_attrs]
+    for field in fields:
+        if not field.isidentifier() or not hasattr(model, field):
+            raise ValueError(f"{model.__name__} has no attribute {field!r}")
+    loaded = ", ".join(f"{field!r}: state[{field!r}]" for field in fields)
+    attributes = ", ".join(f"{field!r}: obj.{field}" for field in fields)
+    source = ("def to_dict(obj):\n"
+              "    state = obj.__dict__\n"
+              "    try:\n"
+              f"        return {{{loaded}}}\n"
+              "    except KeyError:\n"
+              f"        return {{{attributes}}}\n")
+    namespace = {}
+    exec(compile(source, f"<{model.__name__} serializer>", "exec"), namespace)
+    return namespace["to_dict"]
+
+
+@lru_cache(maxsize=None)
+def serializer_for(model, fields=None):
+    """
+    :param model: a mapped model class
+    :param fields: tuple of attribute names, None for every column
+    :return: the cached compiled serializer for this model and projection
+    """
+    return compile_serializer(model, fields)
@@ -0,0 +1,185 @@
+import logging
+import os
+import secrets
+import sqlite3
+import threading
+import time
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface
+from flask_session import Session
+from flask_session.sessions import ServerSideSession
+
+try:
+    import redis
+except ImportError:  # pragma: no cover - only needed for SESSION_BACKEND = "redis"
+    redis = None
+
+GC_BATCH = 1000
+SID_LENGTH = 43  # secrets.token_urlsafe(32)
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteSessionStore:
+    """
+    Sessions in one SQLite table keyed by session id, in WAL mode so readers
+    never wait for the writer. An index on the expiry time lets the
+    collector delete expired sessions without scanning the live ones.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self._connection() as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS sessions ("
+                               "sid TEXT PRIMARY KEY, data BLOB NOT NULL, "
+                               "expires REAL NOT NULL) WITHOUT ROWID")
+            connection.execute("CREATE INDEX IF NOT EXISTS ix_sessions_expires "
+                               "ON sessions (expires)")
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def get(self, sid):
+        row = self._connection().execute(
+            "SELECT data FROM sessions WHERE sid = ? AND expires > ?",
+            (sid, time.time())).fetchone()
+        return None if row is None else row[0]
+
+    def set(self, sid, data, ttl):
+        self._connection().execute(
+            "INSERT INTO sessions (sid, data, expires) VALUES (?, ?, ?) "
+            "ON CONFLICT (sid) DO UPDATE SET data = excluded.data, expires = excluded.expires",
+            (sid, data, time.time() + ttl))
+
+    def delete(self, sid):
+        self._connection().execute("DELETE FROM sessions WHERE sid = ?", (sid,))
+
+    def gc(self, limit=GC_BATCH):
+        """
+        :return: number of expired sessions deleted, at most limit
+        :rtype: int
+        """
+        return self._connection().execute(
+            "DELETE FROM sessions WHERE sid IN "
+            "(SELECT sid FROM sessions WHERE expires <= ? LIMIT ?)",
+            (time.time(), limit)).rowcount
+
+
+class RedisSessionStore:
+    """
+    Sessions as plain keys with a TTL in Redis or anything speaking its
+    protocol; expiry is left to the server.
+    """
+
+    def __init__(self, client, prefix="session:"):
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, sid):
+        return self.client.get(self.prefix + sid)
+
+    def set(self, sid, data, ttl):
+        self.client.set(self.prefix + sid, data, ex=max(int(ttl), 1))
+
+    def delete(self, sid):
+        self.client.delete(self.prefix + sid)
+
+    def gc(self, limit=GC_BATCH):
+        return 0
+
+
+class StoreSessionInterface(SessionInterface):
+    """
+    Server-side sessions in a key-value store, serialized as tagged JSON
+    instead of pickle. A session is read with one lookup by id and written
+    back only when it changed (or must be refreshed).
+    """
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, store, gc_interval=60):
+        self.store = store
+        self.gc_interval = gc_interval
+        self._gc_thread = None
+        self._gc_lock = threading.Lock()
+
+    def _start_gc(self):
+        # started by the first request rather than at import, so CLI
+        # commands and forking servers don't inherit a running thread
+        with self._gc_lock:
+            if self._gc_thread is None and self.gc_interval:
+                self._gc_thread = threading.Thread(target=self._collect, name="session-gc",
+                                                   daemon=True)
+                self._gc_thread.start()
+
+    def _collect(self):
+        while True:
+            time.sleep(self.gc_interval)
+            try:
+                while self.store.gc() >= GC_BATCH:
+                    pass
+            except Exception as e:  # keep collecting after a transient error
+                logger.error(e)
+
+    @staticmethod
+    def _cookie_name(app):
+        return app.config["SESSION_COOKIE_NAME"]
+
+    def open_session(self, app, request):
+        self._start_gc()
+        sid = request.cookies.get(self._cookie_name(app))
+        if sid and len(sid) == SID_LENGTH:
+            data = self.store.get(sid)
+            if data is not None:
+                try:
+                    return ServerSideSession(self.serializer.loads(data), sid=sid)
+                except ValueError as e:
+                    app.logger.error(e)
+        # unknown or expired id: start over with a fresh one
+        return ServerSideSession(sid=secrets.token_urlsafe(32))
+
+    def save_session(self, app, session, response):
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if not session:
+            if session.modified:
+                self.store.delete(session.sid)
+                response.delete_cookie(self._cookie_name(app), domain=domain, path=path)
+            return
+        if not self.should_set_cookie(app, session):
+            return
+
+        self.store.set(session.sid, self.serializer.dumps(dict(session)).encode("utf-8"),
+                       app.permanent_session_lifetime.total_seconds())
+        response.set_cookie(self._cookie_name(app), session.sid,
+                            expires=self.get_expiration_time(app, session),
+                            httponly=self.get_cookie_httponly(app), domain=domain,
+                            path=path, secure=self.get_cookie_secure(app),
+                            samesite=self.get_cookie_samesite(app))
+
+
+def init_sessions(app):
+    """
+    SESSION_BACKEND picks the session store: "filesystem" (Flask-Session,
+    the default), "sqlite" or "redis".
+    """
+    backend = app.config.get("SESSION_BACKEND", "filesystem")
+    gc_interval = app.config.get("SESSION_GC_INTERVAL", 60)
+    if backend == "sqlite":
+        path = app.config.get("SESSION_SQLITE_PATH") or os.path.join(app.instance_path,
+                                                                      "sessions.db")
+        app.session_interface = StoreSessionInterface(SQLiteSessionStore(path), gc_interval)
+    elif backend == "redis":
+        if redis is None:
+            raise RuntimeError("SESSION_BACKEND = \"redis\" needs the redis package")
+        client = redis.Redis.from_url(app.config["SESSION_REDIS_URL"])
+        app.session_interface = StoreSessionInterface(RedisSessionStore(client), gc_interval)
+    else:
+        Session(app)
@@ -0,0 +1,81 @@
+import threading
+
+from flask import json
+
+from src.helpers.etags import current_version
+from src.models import Product
+
+SHELF_SIZE = 4
+CATEGORY_SHELVES = {"phones": "Phone", "laptops": "Laptop"}
+RANKED_SHELVES = ("highly_rated", "most_purchased")
+
+
+class ShelfEngine:
+    """
+    Keeps the homepage shelves in memory as a pre-serialized payload.
+
+    The shelves are rebuilt from indexed lookups (category, avg_rating,
+    units_sold) whenever the catalog version moves, whichever worker made
+    the change, so a homepage hit only returns bytes.
+    """
+
+    def __init__(self, size=SHELF_SIZE):
+        self.size = size
+        self._lock = threading.RLock()
+        self._shelves = {}
+        self._payload = None
+        self._version = None
+
+    def payload(self):
+        """
+        :return: the serialized homepage response body
+        :rtype: bytes
+        """
+        # read before the shelves are, so they are never older than it says
+        version, _ = current_version()
+        if self._payload is None or self._version != version:
+            with self._lock:
+                if self._payload is None or self._version != version:
+                    self._warm(version)
+        return self._payload
+
+    def _warm(self, version):
+        for shelf, category in CATEGORY_SHELVES.items():
+            self._shelves[shelf] = self._category_shelf(category)
+        for shelf in RANKED_SHELVES:
+            self._shelves[shelf] = self._load(self._rank(shelf))
+        self._serialize()
+        self._version = version
+
+    def _category_shelf(self, category):
+        products = Product.query.filter_by(
+            category=category).order_by(Product.id).limit(self.size).all()
+        return [prod.to_dict() for prod in products]
+
+    def _rank(self, shelf):
+        column = Product.avg_rating if shelf == "highly_rated" else Product.units_sold
+        counter = Product.rating_count if shelf == "highly_rated" else Product.units_sold
+        return [prod_id for prod_id, in Product.query.with_entities(Product.id).filter(
+            counter > 0).order_by(column.desc(), Product.id.desc()).limit(self.size)]
+
+    @staticmethod
+    def _load(product_ids):
+        if not product_ids:
+            return []
+        rows = {prod.id: prod for prod in
+                Product.query.filter(Product.id.in_(product_ids))}
+        return [rows[prod_id].to_dict() for prod_id in product_ids if prod_id in rows]
+
+    def _serialize(self):
+        self._payload = json.dumps({
+            "data": {
+                "products": {"phones": self._shelves["phones"],
+                             "laptops": self._shelves["laptops"],
+                             "most_purchased": self._shelves["most_purchased"],
+                             "highly_rated": self._shelves["highly_rated"]}
+            },
+            "success": True,
+        }).encode("utf-8")
+
+
+shelves = ShelfEngine()
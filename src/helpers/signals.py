@@ -0,0 +1,41 @@
+from blinker import Namespace, NamedSignal
+
+# Catalog signals, sent with the app as sender once the write has been
+# committed. In-memory caches (homepage shelves, search index, ...) subscribe
+# to these instead of being called from every view that changes the catalog.
+catalog_signals = Namespace()
+
+
+class CatalogSignal(NamedSignal):
+    """
+    A signal whose connect_last receivers run after all the others, so the
+    catalog version only moves once every in-process cache applied the change.
+    """
+
+    def __init__(self, name, doc=None):
+        super().__init__(name, doc)
+        self._last = []
+
+    def connect_last(self, receiver):
+        self._last.append(receiver)
+        return receiver
+
+    def send(self, *sender, **kwargs):
+        results = super().send(*sender, **kwargs)
+        return results + [(receiver, receiver(*sender, **kwargs)) for receiver in self._last]
+
+
+def _signal(name):
+    return catalog_signals.setdefault(name, CatalogSignal(name))
+
+
+# kwargs: product
+product_saved = _signal("product-saved")
+# kwargs: product_id
+product_deleted = _signal("product-deleted")
+# kwargs: product_id, rating
+review_added = _signal("review-added")
+# kwargs: product_id, rating
+review_deleted = _signal("review-deleted")
+# kwargs: quantities ({product_id: quantity})
+order_placed = _signal("order-placed")
@@ -0,0 +1,122 @@
+import itertools
+import threading
+from collections import defaultdict
+
+# only the first PREFIX_LENGTH letters of a word are expanded into deletes,
+# which bounds the index size while the full words are still compared
+PREFIX_LENGTH = 7
+MAX_DISTANCE = 2
+MIN_WORD_LENGTH = 3
+
+
+def max_distance(word):
+    return 1 if len(word) <= 4 else MAX_DISTANCE
+
+
+def deletes(word, distance):
+    """
+    :param word: a vocabulary or query word
+    :param distance: maximum number of letters to delete
+    :return: word and every string obtained by deleting up to distance letters
+    :rtype: set
+    """
+    variants = {word}
+    frontier = {word}
+    for _ in range(distance):
+        frontier = {variant[:position] + variant[position + 1:]
+                    for variant in frontier for position in range(len(variant))}
+        variants |= frontier
+    return variants
+
+
+def edit_distance(source, target, limit):
+    """
+    Optimal string alignment distance: insertions, deletions, substitutions
+    and transpositions of adjacent letters ("iphnoe" -> "iphone") each cost 1.
+
+    :return: the distance, or limit + 1 once it is known to exceed limit
+    :rtype: int
+    """
+    if abs(len(source) - len(target)) > limit:
+        return limit + 1
+    previous = None
+    current = list(range(len(target) + 1))
+    for i, source_char in enumerate(source, 1):
+        before, previous, current = previous, current, [i] + [0] * len(target)
+        for j, target_char in enumerate(target, 1):
+            cost = source_char != target_char
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if (cost and before is not None and i > 1 and j > 1
+                    and source_char == target[j - 2] and source[i - 2] == target_char):
+                current[j] = min(current[j], before[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+    return current[-1]
+
+
+class SpellingIndex:
+    """
+    Symmetric delete spelling corrector over the catalog vocabulary.
+
+    Every vocabulary word is indexed under the strings left after deleting
+    up to MAX_DISTANCE of its letters; a misspelled word finds its candidates
+    by looking up its own deletes, so a correction costs a few dictionary
+    lookups and edit distances instead of a scan of the vocabulary.
+    Words are reference counted so products can be added and removed.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._counts = {}
+        self._deletes = defaultdict(set)
+
+    def __contains__(self, word):
+        return word in self._counts
+
+    def add(self, words):
+        with self._lock:
+            for word in words:
+                if word in self._counts:
+                    self._counts[word] += 1
+                    continue
+                self._counts[word] = 1
+                for variant in deletes(word[:PREFIX_LENGTH], MAX_DISTANCE):
+                    self._deletes[variant].add(word)
+
+    def remove(self, words):
+        with self._lock:
+            for word in words:
+                count = self._counts.get(word, 0) - 1
+                if count > 0:
+                    self._counts[word] = count
+                    continue
+                self._counts.pop(word, None)
+                for variant in deletes(word[:PREFIX_LENGTH], MAX_DISTANCE):
+                    candidates = self._deletes.get(variant)
+                    if candidates is not None:
+                        candidates.discard(word)
+                        if not candidates:
+                            del self._deletes[variant]
+
+    def correct(self, word):
+        """
+        :param word: a lower-cased query word
+        :return: the closest, most frequent vocabulary word, or None when
+            the word is known or nothing is close enough
+        :rtype: str
+        """
+        if word in self._counts or len(word) < MIN_WORD_LENGTH or word.isdigit():
+            return None
+        limit = max_distance(word)
+        best = None
+        with self._lock:
+            candidates = set(itertools.chain.from_iterable(
+                self._deletes.get(variant, ()) for variant
+                in deletes(word[:PREFIX_LENGTH], limit)))
+            for candidate in candidates:
+                distance = edit_distance(word, candidate, limit)
+                if distance <= limit:
+                    rank = (distance, -self._counts[candidate], candidate)
+                    if best is None or rank < best:
+                        best = rank
+        return None if best is None else best[2]
@@ -0,0 +1,140 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from src import app, db
+from src.helpers import signals
+from src.helpers.payment_gateway import CircuitOpen, gateway
+from src.models import Product, StripePrice
+
+CURRENCY = "usd"
+# catalog prices are divided by PRICE_RATE to get dollars; Stripe wants cents
+PRICE_RATE = 744
+SYNC_BATCH = 100
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def sync_enabled():
+    return bool(app.config.get("STRIPE_PRICE_SYNC"))
+
+
+def unit_amount(price):
+    """
+    :return: a catalog price in the smallest unit of CURRENCY
+    :rtype: int
+    """
+    return int((price / PRICE_RATE) * 100)
+
+
+def lookup_key(product_id):
+    return f"product-{product_id}"
+
+
+def price_ids(versions):
+    """
+    :param versions: {product_id: price_version} of the products to look up
+    :return: {product_id: Stripe price id} for the products whose synced
+        price is for that version
+    :rtype: dict
+    """
+    if not versions:
+        return {}
+    rows = db.session.query(StripePrice.product_id, StripePrice.price_version,
+                            StripePrice.stripe_price_id).filter(
+        StripePrice.product_id.in_(versions)).all()
+    return {product_id: price_id for product_id, version, price_id in rows
+            if versions[product_id] == version}
+
+
+def _sync_product(product, synced):
+    """
+    Mirror one product into Stripe: its Product is created once and renamed
+    when needed, a Price is created per price_version (prices can't be
+    changed) and the previous one is archived.
+    """
+    stripe_gateway = gateway()
+    if synced is None:
+        stripe_product_id = stripe_gateway.create_product(
+            name=product.product_name, metadata={"product_id": product.id}).id
+    else:
+        stripe_product_id = synced.stripe_product_id
+        stripe_gateway.update_product(stripe_product_id, name=product.product_name)
+    # the lookup key moves to the new price, so a price created by a sync
+    # that died before saving it isn't left current
+    price_id = stripe_gateway.create_price(
+        product=stripe_product_id, currency=CURRENCY, unit_amount=unit_amount(product.price),
+        lookup_key=lookup_key(product.id), transfer_lookup_key=True,
+        metadata={"product_id": product.id, "price_version": product.price_version}).id
+    if synced is None:
+        synced = StripePrice(product_id=product.id, stripe_product_id=stripe_product_id)
+        db.session.add(synced)
+    elif synced.stripe_price_id != price_id:
+        stripe_gateway.update_price(synced.stripe_price_id, active=False)
+    synced.price_version = product.price_version
+    synced.stripe_price_id = price_id
+    synced.synced_at = datetime.utcnow()
+
+
+def sync_prices(product_ids=None):
+    """
+    Sync the products that have no Stripe price yet or whose price_version
+    moved since, committing after each one so a failure keeps the progress.
+
+    :param product_ids: products to sync, None for all
+    :return: number of products synced
+    :rtype: int
+    """
+    query = db.session.query(Product, StripePrice).outerjoin(
+        StripePrice, StripePrice.product_id == Product.id).filter(
+        (StripePrice.product_id.is_(None))
+        | (StripePrice.price_version != Product.price_version)).order_by(Product.id)
+    if product_ids is not None:
+        query = query.filter(Product.id.in_(product_ids))
+    synced_count = 0
+    last_id = 0
+    while True:
+        batch = query.filter(Product.id > last_id).limit(SYNC_BATCH).all()
+        if not batch:
+            return synced_count
+        for product, synced in batch:
+            last_id = product.id
+            try:
+                _sync_product(product, synced)
+                db.session.commit()
+            except CircuitOpen:
+                db.session.rollback()
+                raise
+            except Exception as e:
+                app.logger.error(f"Syncing product {product.id} to Stripe failed: {e}")
+                db.session.rollback()
+                continue
+            synced_count += 1
+
+
+def _run_sync(product_ids):
+    with app.app_context():
+        try:
+            sync_prices(product_ids)
+        except Exception as e:
+            app.logger.error(e)
+        finally:
+            db.session.remove()
+
+
+def resync_async(product_ids):
+    """Sync products in the background, one sync at a time."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="stripe-sync")
+    _executor.submit(_run_sync, list(product_ids))
+
+
+@signals.product_saved.connect
+def _on_product_saved(sender, product, **extra):
+    # a new product or a repriced one gets its Stripe price straight away;
+    # other edits leave the version alone and make the sync a no-op
+    if sync_enabled():
+        resync_async([product.id])
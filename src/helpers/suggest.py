@@ -0,0 +1,237 @@
+import bisect
+import heapq
+import threading
+import time
+
+from src import app, db
+from src.helpers import signals
+from src.helpers.etags import PRODUCTS, current_version, up_to_date
+from src.helpers.search_index import TOKEN_PATTERN
+from src.models import Product
+
+# above this many keys a prefix is answered from its cached top list
+# instead of scanning its whole range
+SCAN_LIMIT = 2000
+MAX_SUGGESTIONS = 10
+
+
+def normalize(text):
+    return " ".join(TOKEN_PATTERN.findall((text or "").lower()))
+
+
+def suggestion_weight(units_sold, avg_rating):
+    return (units_sold or 0) + 10 * (avg_rating or 0)
+
+
+class SuggestIndex:
+    """
+    Prefix index for typeahead, kept as a sorted list of keys searched
+    with bisect.
+
+    Each product contributes one key per word of its name (so "iph" finds
+    "Apple iPhone 13"), each category one key. A key is the lower-cased
+    text from that word on, followed by the product id to keep keys unique.
+    Short, popular prefixes cover many keys, so their best matches are
+    cached until the next change; a re-weighted product only updates the
+    cached lists of the prefixes it matches.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self._keys = []
+        self._entries = {}  # {key: (kind, value, label)}
+        self._weights = {}  # {(kind, value): weight}
+        self._product_keys = {}  # {product_id: ([key, ...], category)}
+        self._category_counts = {}  # {category: number of products}
+        self._top = {}
+        self._building = False
+        self.built_at = None
+        self.version = None
+
+    def _insert(self, key, entry):
+        if key not in self._entries and not self._building:
+            bisect.insort(self._keys, key)
+        self._entries[key] = entry
+
+    def _delete(self, key):
+        position = bisect.bisect_left(self._keys, key)
+        if position < len(self._keys) and self._keys[position] == key:
+            del self._keys[position]
+        self._entries.pop(key, None)
+
+    def add_product(self, product_id, product_name, category, weight):
+        with self._lock:
+            self._remove_product(product_id)
+            normalized = normalize(product_name)
+            keys = []
+            for match in TOKEN_PATTERN.finditer(normalized):
+                key = f"{normalized[match.start():]}\x00{product_id}"
+                self._insert(key, ("product", product_id, product_name))
+                keys.append(key)
+            self._product_keys[product_id] = (keys, category)
+            self._weights[("product", product_id)] = weight
+            if category:
+                count = self._category_counts.get(category, 0)
+                self._category_counts[category] = count + 1
+                self._insert(f"{category.lower()}\x00", ("category", category, category))
+                self._weights[("category", category)] = count + 1
+            self._top.clear()
+
+    def remove_product(self, product_id):
+        with self._lock:
+            self._remove_product(product_id)
+            self._top.clear()
+
+    def _remove_product(self, product_id):
+        keys, category = self._product_keys.pop(product_id, ((), None))
+        for key in keys:
+            self._delete(key)
+        self._weights.pop(("product", product_id), None)
+        if category:
+            count = self._category_counts.get(category, 1) - 1
+            if count:
+                self._category_counts[category] = count
+                self._weights[("category", category)] = count
+            else:
+                self._category_counts.pop(category, None)
+                self._weights.pop(("category", category), None)
+                self._delete(f"{category.lower()}\x00")
+
+    def set_weight(self, product_id, weight):
+        with self._lock:
+            item = ("product", product_id)
+            if item not in self._weights:
+                return
+            previous = self._weights[item]
+            self._weights[item] = weight
+            keys, _ = self._product_keys[product_id]
+            for prefix, top in list(self._top.items()):
+                if any(key.startswith(prefix) for key in keys):
+                    self._reweigh(prefix, top, product_id, keys, previous, weight)
+
+    def _reweigh(self, prefix, top, product_id, keys, previous, weight):
+        """Update the cached top list of prefix after product_id was re-weighted."""
+        listed = [suggestion for suggestion in top
+                  if suggestion["type"] == "product" and suggestion["id"] == product_id]
+        if not listed:
+            if len(top) >= MAX_SUGGESTIONS and weight <= self._suggestion_weight(top[-1]):
+                return
+            top = top + [{"type": "product", "id": product_id,
+                          "label": self._entries[keys[0]][2]}]
+        elif weight < previous:
+            # a product left out of the list may outrank it now
+            del self._top[prefix]
+            return
+        self._top[prefix] = sorted(top, key=self._suggestion_weight,
+                                   reverse=True)[:MAX_SUGGESTIONS]
+
+    def _suggestion_weight(self, suggestion):
+        kind = suggestion["type"]
+        return self._weights.get((kind, suggestion["id" if kind == "product" else "name"]), 0)
+
+    def suggest(self, prefix, limit=MAX_SUGGESTIONS):
+        """
+        :param prefix: what the user typed so far
+        :param limit: maximum number of suggestions
+        :return: suggestions, heaviest first, as dicts with type, id/name and label
+        :rtype: list
+        """
+        prefix = normalize(prefix)
+        limit = min(limit, MAX_SUGGESTIONS)
+        if not prefix:
+            return []
+        with self._lock:
+            cached = self._top.get(prefix)
+            if cached is not None:
+                return cached[:limit]
+            low = bisect.bisect_left(self._keys, prefix)
+            high = bisect.bisect_left(self._keys, prefix + "\uffff", low)
+            best = {}
+            for key in self._keys[low:high]:
+                kind, value, label = self._entries[key]
+                best[(kind, value)] = label
+            top = heapq.nlargest(MAX_SUGGESTIONS, best.items(),
+                                 key=lambda item: self._weights.get(item[0], 0))
+            result = [{"type": kind, ("id" if kind == "product" else "name"): value,
+                       "label": label} for (kind, value), label in top]
+            if high - low > SCAN_LIMIT:
+                self._top[prefix] = result
+            return result[:limit]
+
+    def build(self, rows, version=None):
+        """
+        :param rows: iterable of (id, product_name, category, units_sold, avg_rating)
+        :param version: products version read before rows
+        """
+        with self._lock:
+            self._reset()
+            # collect every key first and sort once, rather than insort per key
+            self._building = True
+            for product_id, product_name, category, units_sold, avg_rating in rows:
+                self.add_product(product_id, product_name, category,
+                                 suggestion_weight(units_sold, avg_rating))
+            self._keys = sorted(self._entries)
+            self._building = False
+            self.built_at = time.monotonic()
+            self.version = version
+
+
+suggest_index = SuggestIndex()
+
+
+def _current(version):
+    max_age = app.config.get("SUGGEST_MAX_AGE")
+    built_at = suggest_index.built_at
+    if built_at is None or (max_age and time.monotonic() - built_at > max_age) \
+            or not up_to_date(PRODUCTS, suggest_index.version, version):
+        return False
+    suggest_index.version = version
+    return True
+
+
+def ensure_suggest_index():
+    # this worker's writes are applied by the signal handlers below; a
+    # product saved or deleted in another worker rebuilds the index, its
+    # weights (sales, ratings) are caught up every SUGGEST_MAX_AGE
+    version, _ = current_version(PRODUCTS)
+    if not _current(version):
+        with suggest_index._lock:
+            if not _current(version):
+                suggest_index.build(db.session.query(Product.id, Product.product_name,
+                                                     Product.category, Product.units_sold,
+                                                     Product.avg_rating).yield_per(1000),
+                                    version)
+    return suggest_index
+
+
+@signals.product_saved.connect
+def _on_product_saved(sender, product, **extra):
+    if suggest_index.built_at is not None:
+        suggest_index.add_product(product.id, product.product_name, product.category,
+                                  suggestion_weight(product.units_sold, product.avg_rating))
+
+
+@signals.product_deleted.connect
+def _on_product_deleted(sender, product_id, **extra):
+    suggest_index.remove_product(product_id)
+
+
+@signals.review_added.connect
+@signals.review_deleted.connect
+def _on_review_changed(sender, product_id, **extra):
+    if suggest_index.built_at is not None:
+        for row in Product.query.with_entities(Product.units_sold, Product.avg_rating
+                                               ).filter_by(id=product_id):
+            suggest_index.set_weight(product_id, suggestion_weight(*row))
+
+
+@signals.order_placed.connect
+def _on_order_placed(sender, quantities, **extra):
+    if suggest_index.built_at is not None and quantities:
+        for row in Product.query.with_entities(Product.id, Product.units_sold,
+                                               Product.avg_rating
+                                               ).filter(Product.id.in_(list(quantities))):
+            suggest_index.set_weight(row.id, suggestion_weight(row.units_sold, row.avg_rating))
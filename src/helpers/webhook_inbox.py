@@ -0,0 +1,216 @@
+import hashlib
+import json
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import or_, update
+
+from src import app, db
+from src.helpers.retry import backoff
+from src.models import WebhookEvent
+
+PENDING = "pending"
+PROCESSING = "processing"
+DONE = "done"
+DEAD = "dead"
+
+# {event type: handler}; a handler does its database work without
+# committing and may return a callable to run once that work is committed
+_handlers = {}
+
+_workers = []
+_workers_lock = threading.Lock()
+_wake = threading.Event()
+
+
+def handles(event_type):
+    def register(handler):
+        _handlers[event_type] = handler
+        return handler
+    return register
+
+
+def event_id(event, payload):
+    """
+    :return: the provider's event id, or a hash of the payload for events
+        without one (e.g. hand-written test events)
+    :rtype: str
+    """
+    return event.get("id") or "sha256:" + hashlib.sha256(payload).hexdigest()
+
+
+def record_event(event, payload):
+    """
+    Append a verified event to the inbox, in its own transaction. An event
+    already in the inbox (a provider retry) is ignored.
+
+    :param event: the parsed event
+    :param payload: the raw request body
+    :return: False when the event was a duplicate
+    :rtype: bool
+    """
+    now = datetime.utcnow()
+    row = {"id": event_id(event, payload), "type": event.get("type", ""),
+           "payload": payload.decode("utf-8"), "status": PENDING, "attempts": 0,
+           "next_attempt_at": now, "received_at": now}
+    dialect = db.engine.dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        if dialect == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        inserted = db.session.execute(
+            insert(WebhookEvent).values(**row).on_conflict_do_nothing()).rowcount
+    else:
+        inserted = 0
+        if not WebhookEvent.query.get(row["id"]):
+            db.session.add(WebhookEvent(**row))
+            inserted = 1
+    db.session.commit()
+    _wake.set()
+    return bool(inserted)
+
+
+def claim_batch(limit):
+    """
+    Lease up to limit due events to this worker. An event whose worker died
+    mid-way becomes due again when its lease runs out.
+
+    :return: ids of the claimed events, oldest first, and the time their
+        lease runs out
+    :rtype: tuple
+    """
+    now = datetime.utcnow()
+    due = db.session.query(WebhookEvent.id, WebhookEvent.next_attempt_at).filter(
+        or_(WebhookEvent.status == PENDING, WebhookEvent.status == PROCESSING),
+        WebhookEvent.next_attempt_at <= now).order_by(
+        WebhookEvent.received_at).limit(limit).with_for_update(skip_locked=True).all()
+    lease_until = now + timedelta(seconds=app.config.get("WEBHOOK_LEASE_SECONDS", 300))
+    claimed = []
+    for event_id, due_at in due:
+        # conditional on the row being unchanged, so on databases without
+        # SKIP LOCKED two workers still can't lease the same event
+        if db.session.execute(update(WebhookEvent).where(
+                WebhookEvent.id == event_id, WebhookEvent.next_attempt_at == due_at).values(
+                status=PROCESSING, attempts=WebhookEvent.attempts + 1,
+                next_attempt_at=lease_until)).rowcount == 1:
+            claimed.append(event_id)
+    db.session.commit()
+    return claimed, lease_until
+
+
+def _settle(event_id, lease_until, **values):
+    """
+    Update a claimed event, provided this worker still holds its lease:
+    once the lease ran out another worker may have claimed it again.
+
+    :return: False when the lease was lost
+    :rtype: bool
+    """
+    return db.session.execute(update(WebhookEvent).where(
+        WebhookEvent.id == event_id, WebhookEvent.status == PROCESSING,
+        WebhookEvent.next_attempt_at == lease_until).values(**values).execution_options(
+        synchronize_session=False)).rowcount == 1
+
+
+def _process(event_id, lease_until):
+    event = WebhookEvent.query.get(event_id)
+    if event is None or event.status != PROCESSING:
+        db.session.rollback()
+        return
+    after_commit = None
+    try:
+        handler = _handlers.get(event.type)
+        if handler is None:
+            app.logger.info(f"Unhandled event type {event.type}")
+        else:
+            after_commit = handler(json.loads(event.payload))
+        # marked done in the same transaction as the handler's writes, so
+        # the work is applied exactly once
+        if not _settle(event_id, lease_until, status=DONE, processed_at=datetime.utcnow(),
+                       last_error=None):
+            app.logger.error(f"Webhook event {event_id} lost its lease, dropping this attempt")
+            db.session.rollback()
+            return
+        db.session.commit()
+    except Exception as e:
+        app.logger.error(f"Webhook event {event_id} failed: {e}")
+        db.session.rollback()
+        event = WebhookEvent.query.get(event_id)
+        values = {"last_error": repr(e)[:2000]}
+        if event.attempts >= app.config.get("WEBHOOK_MAX_ATTEMPTS", 8):
+            values["status"] = DEAD
+        else:
+            values["status"] = PENDING
+            values["next_attempt_at"] = datetime.utcnow() + timedelta(seconds=backoff(
+                event.attempts, app.config.get("WEBHOOK_RETRY_BASE", 5)))
+        _settle(event_id, lease_until, **values)
+        db.session.commit()
+        return
+    if after_commit is not None:
+        try:
+            after_commit()
+        except Exception as e:
+            app.logger.error(e)
+
+
+def process_batch(limit=None):
+    """
+    Claim and process one batch of due events, each in its own transaction.
+
+    :return: number of events claimed
+    :rtype: int
+    """
+    claimed, lease_until = claim_batch(limit or app.config.get("WEBHOOK_BATCH_SIZE", 50))
+    for event_id in claimed:
+        _process(event_id, lease_until)
+    return len(claimed)
+
+
+def drain():
+    """
+    :return: number of events claimed until none were due
+    :rtype: int
+    """
+    total = 0
+    while True:
+        claimed = process_batch()
+        if not claimed:
+            return total
+        total += claimed
+
+
+def _work():
+    interval = app.config.get("WEBHOOK_POLL_INTERVAL", 1)
+    while True:
+        with app.app_context():
+            try:
+                claimed = process_batch()
+            except Exception as e:  # keep working after a transient error
+                app.logger.error(e)
+                db.session.rollback()
+                claimed = 0
+            finally:
+                db.session.remove()
+        if not claimed:
+            _wake.wait(interval)
+            _wake.clear()
+
+
+@app.before_first_request
+def _start_on_boot():
+    # events a previous process left pending are picked up without waiting
+    # for the next webhook; run in the serving process, after any fork
+    start_workers()
+
+
+def start_workers():
+    # started by the first request rather than at import, so CLI commands
+    # and forking servers don't inherit running threads
+    with _workers_lock:
+        if _workers:
+            return
+        for number in range(app.config.get("WEBHOOK_WORKERS", 0)):
+            worker = threading.Thread(target=_work, name=f"webhook-worker-{number}", daemon=True)
+            worker.start()
+            _workers.append(worker)
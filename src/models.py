@@ -1,15 +1,15 @@
 import enum
-from datetime import datetime
+from datetime import date, datetime
 
 from flask_login import UserMixin
 from src import db, app
+from src.helpers.serializers import serializer_for
 import jwt
 from sqlalchemy.orm import relationship
-from sqlalchemy import Enum
+from sqlalchemy import Enum, func
 from time import time
 
 
-
 class Product(db.Model):
     __tablename__ = "products"
     id = db.Column(db.Integer, primary_key=True)
@@ -19,14 +19,111 @@ class Product(db.Model):
     category = db.Column(db.String(30), nullable=False, index=True)
     price = db.Column(db.Integer, nullable=False, index=True)
     img_url = db.Column(db.String(500), nullable=False)
+    # digest of the locally stored image, see src.helpers.images
+    image_id = db.Column(db.String(32), nullable=True)
+    # bumped whenever price, name or description change, so a cart's price
+    # snapshot knows when to refetch
+    price_version = db.Column(db.Integer, nullable=False, default=1, server_default="1")
+    # denormalized review stats, maintained by apply_rating
+    rating_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    rating_sum = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    rating_1 = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    rating_2 = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    rating_3 = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    rating_4 = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    rating_5 = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    avg_rating = db.Column(db.Float, nullable=True)
+    # denormalized sales counters, maintained by record_sale
+    units_sold = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    units_sold_7d = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    units_sold_30d = db.Column(db.Integer, nullable=False, default=0, server_default="0")
     order = db.relationship("Order", back_populates="product_name", cascade="all, delete")
     reviews = db.relationship("Reviews", backref="product")
 
+    # what to_dict and the API serve: the stats counters stay internal
+    PUBLIC_FIELDS = ("id", "quantity", "product_name", "product_description", "category",
+                     "price", "img_url", "image_id", "avg_rating")
+
+    # keyset pagination sort keys: (price, id) within a category,
+    # (avg_rating, id) for the highly rated listing, (units_sold*, id) for
+    # the most purchased listings
+    __table_args__ = (db.Index("ix_products_category_price_id", "category", "price", "id"),
+                      db.Index("ix_products_avg_rating_id", "avg_rating", "id"),
+                      db.Index("ix_products_units_sold_id", "units_sold", "id"),
+                      db.Index("ix_products_units_sold_7d_id", "units_sold_7d", "id"),
+                      db.Index("ix_products_units_sold_30d_id", "units_sold_30d", "id"))
+
     def __repr__(self):
         return f"<name:{self.product_name}>"
 
-    def to_dict(self):
-        return {column.name: getattr(self, column.name) for column in self.__table__.columns}
+    @staticmethod
+    def apply_rating(product_id, rating, sign=1):
+        """
+        Add (sign=1) or remove (sign=-1) one review from the product's rating
+        stats. The update runs in the current transaction, so commit it
+        together with the review itself.
+        """
+        bucket = getattr(Product, f"rating_{rating}")
+        db.session.query(Product).filter(Product.id == product_id).update({
+            Product.rating_count: Product.rating_count + sign,
+            Product.rating_sum: Product.rating_sum + sign * rating,
+            bucket: bucket + sign,
+            Product.avg_rating: (Product.rating_sum + sign * rating) * 1.0 / func.nullif(
+                Product.rating_count + sign, 0),
+        }, synchronize_session=False)
+
+    @staticmethod
+    def record_sale(product_id, quantity, day=None):
+        """
+        Count quantity units of the product as sold on day (default today):
+        bumps the running counters and the product's daily sales bucket in
+        the current transaction.
+        """
+        db.session.query(Product).filter(Product.id == product_id).update({
+            Product.units_sold: Product.units_sold + quantity,
+            Product.units_sold_7d: Product.units_sold_7d + quantity,
+            Product.units_sold_30d: Product.units_sold_30d + quantity,
+        }, synchronize_session=False)
+        ProductSalesDaily.bump(product_id, day or date.today(), quantity)
+
+    def rating_summary(self):
+        return {
+            "average_rating": round(self.avg_rating, 1) if self.avg_rating is not None else None,
+            "rating_count": self.rating_count,
+            "histogram": {str(star): getattr(self, f"rating_{star}") for star in range(1, 6)},
+        }
+
+
+class ProductSalesDaily(db.Model):
+    """
+    Units sold per product per day, the source of the windowed
+    units_sold_7d / units_sold_30d counters.
+    """
+    __tablename__ = "product_sales_daily"
+    product_id = db.Column(db.Integer, db.ForeignKey("products.id", ondelete="CASCADE"),
+                           primary_key=True)
+    day = db.Column(db.Date, primary_key=True, index=True)
+    units = db.Column(db.Integer, nullable=False, default=0)
+
+    @staticmethod
+    def bump(product_id, day, quantity):
+        dialect = db.engine.dialect.name
+        if dialect == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert
+        elif dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            bucket = ProductSalesDaily.query.get((product_id, day))
+            if bucket:
+                bucket.units += quantity
+            else:
+                db.session.add(ProductSalesDaily(product_id=product_id, day=day, units=quantity))
+            return
+        statement = insert(ProductSalesDaily).values(product_id=product_id, day=day,
+                                                     units=quantity)
+        db.session.execute(statement.on_conflict_do_update(
+            index_elements=["product_id", "day"],
+            set_={"units": ProductSalesDaily.units + statement.excluded.units}))
 
 
 class Customer(UserMixin, db.Model):
@@ -64,9 +161,6 @@ class Customer(UserMixin, db.Model):
             return None
         return Customer.query.filter_by(mail=user).first()
 
-    def to_dict(self):
-        return {column.name: getattr(self, column.name) for column in self.__table__.columns}
-
 
 class Order(db.Model):
     __tablename__ = "orders"
@@ -79,10 +173,13 @@ class Order(db.Model):
     order_details_id = db.Column(db.Integer, db.ForeignKey("order_details.id"))
     order_name = db.relationship("OrderDetails", back_populates="order")
 
+    # a product's order history, newest first; baskets in order for the
+    # related products job
+    __table_args__ = (db.Index("ix_orders_product_id_id", "product_id", "id"),
+                      db.Index("ix_orders_order_details_id", "order_details_id"))
+
     def __repr__(self):
         return f"<name:{self.product_id}>"
-    def to_dict(self):
-        return {column.name: getattr(self, column.name) for column in self.__table__.columns}
 
 
 class OrderDetails(db.Model):
@@ -99,9 +196,6 @@ class OrderDetails(db.Model):
     zip = db.Column(db.String(250), nullable=False)
     order_date = db.Column(db.DateTime, nullable=False)
 
-    def to_dict(self):
-        return {column.name: getattr(self, column.name) for column in self.__table__.columns}
-
 
 class Reviews(db.Model):
     __tablename__ = "reviews"
@@ -112,12 +206,12 @@ class Reviews(db.Model):
     rating = db.Column(db.Integer, nullable=False)
     date = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
 
-    __table_args__ = (db.UniqueConstraint('customer_id', 'product_id'),)
+    # a product's reviews, newest first
+    __table_args__ = (db.UniqueConstraint('customer_id', 'product_id'),
+                      db.Index("ix_reviews_product_id_date_id", "product_id", "date", "id"))
 
     def __repr__(self):
         return f"<name:{self.customer}>, <product{self.product}>"
-    def to_dict(self):
-        return {column.name: getattr(self, column.name) for column in self.__table__.columns}
 
 
 class Role(db.Model):
@@ -129,8 +223,177 @@ class Role(db.Model):
 
     def __repr__(self):
         return f"<id: {self.id}>, <role {self.name}>"
-    def to_dict(self):
-        return {column.name: getattr(self, column.name) for column in self.__table__.columns}
+
+
+class CatalogVersion(db.Model):
+    """
+    Single row counting catalog changes, shared by every worker. Its
+    version and timestamp back the catalog ETag / Last-Modified headers.
+    """
+    __tablename__ = "catalog_version"
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+
+class ProductPair(db.Model):
+    """
+    How many orders contained both products, stored in both directions
+    so a product's neighbours are one index range.
+    """
+    __tablename__ = "product_pairs"
+    product_id = db.Column(db.Integer, db.ForeignKey("products.id", ondelete="CASCADE"),
+                           primary_key=True)
+    other_id = db.Column(db.Integer, db.ForeignKey("products.id", ondelete="CASCADE"),
+                         primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    @staticmethod
+    def bump_many(rows):
+        """
+        :param rows: list of {"product_id", "other_id", "count"} increments
+        """
+        if not rows:
+            return
+        dialect = db.engine.dialect.name
+        if dialect == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert
+        elif dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            for row in rows:
+                pair = ProductPair.query.get((row["product_id"], row["other_id"]))
+                if pair:
+                    pair.count += row["count"]
+                else:
+                    db.session.add(ProductPair(**row))
+            return
+        statement = insert(ProductPair)
+        db.session.execute(statement.on_conflict_do_update(
+            index_elements=["product_id", "other_id"],
+            set_={"count": ProductPair.count + statement.excluded["count"]}), rows)
+
+
+class ProductRelated(db.Model):
+    """
+    Top co-purchased products of a product as [[product_id, count], ...],
+    best first, precomputed from product_pairs so serving is a primary key
+    lookup.
+    """
+    __tablename__ = "product_related"
+    product_id = db.Column(db.Integer, db.ForeignKey("products.id", ondelete="CASCADE"),
+                           primary_key=True)
+    related = db.Column(db.JSON, nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+
+class JobState(db.Model):
+    """
+    Progress of an incremental batch job, e.g. the last order_details id
+    folded into product_pairs, and the ids below it not committed yet.
+    """
+    __tablename__ = "job_state"
+    name = db.Column(db.String(50), primary_key=True)
+    watermark = db.Column(db.BigInteger, nullable=False, default=0)
+    # [id, first seen] of the ids skipped past, which a slower transaction
+    # may still commit
+    gaps = db.Column(db.JSON, nullable=False, default=list)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+
+class StockShard(db.Model):
+    """
+    Stock available for reservation, split over a few rows per product so
+    concurrent reservations of a hot product take different row locks.
+    """
+    __tablename__ = "stock_shards"
+    product_id = db.Column(db.Integer, db.ForeignKey("products.id", ondelete="CASCADE"),
+                           primary_key=True)
+    shard = db.Column(db.SmallInteger, primary_key=True, autoincrement=False)
+    available = db.Column(db.Integer, db.CheckConstraint("available>=0"), nullable=False,
+                          default=0)
+
+
+class StockReservation(db.Model):
+    """
+    Stock held for a cart until expires_at, taken from one shard. A cart
+    line may be held by several rows.
+    """
+    __tablename__ = "stock_reservations"
+    id = db.Column(db.Integer, primary_key=True)
+    cart_id = db.Column(db.String(64), nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey("products.id", ondelete="CASCADE"),
+                           nullable=False)
+    shard = db.Column(db.SmallInteger, nullable=False)
+    quantity = db.Column(db.Integer, db.CheckConstraint("quantity>0"), nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    __table_args__ = (db.Index("ix_stock_reservations_cart_id_product_id",
+                               "cart_id", "product_id"),)
+
+
+class StripePrice(db.Model):
+    """
+    The Stripe Product and Price mirroring a product, as of price_version:
+    checkout can reference the price while the product's price_version
+    still matches.
+    """
+    __tablename__ = "stripe_prices"
+    product_id = db.Column(db.Integer, db.ForeignKey("products.id", ondelete="CASCADE"),
+                           primary_key=True)
+    price_version = db.Column(db.Integer, nullable=False)
+    stripe_product_id = db.Column(db.String(255), nullable=False)
+    stripe_price_id = db.Column(db.String(255), nullable=False)
+    synced_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+
+class WebhookEvent(db.Model):
+    """
+    Payment provider event, stored as received before it is processed.
+    Keyed by the provider's event id so a redelivered event is stored once.
+    next_attempt_at is when the event is due, or while it is being
+    processed, when the worker's lease on it runs out.
+    """
+    __tablename__ = "webhook_events"
+    id = db.Column(db.String(255), primary_key=True)
+    type = db.Column(db.String(100), nullable=False)
+    payload = db.Column(db.Text, nullable=False)
+    # pending, processing, done or dead
+    status = db.Column(db.String(20), nullable=False, default="pending")
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    last_error = db.Column(db.Text)
+    received_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    processed_at = db.Column(db.DateTime)
+
+    __table_args__ = (db.Index("ix_webhook_events_status_next_attempt_at",
+                               "status", "next_attempt_at"),)
+
+
+class MailOutbox(db.Model):
+    """
+    Mail waiting to be sent by the outbox workers. Written in the
+    transaction that decides to send it, so a rolled back order sends no
+    receipt. next_attempt_at works as in WebhookEvent.
+    """
+    __tablename__ = "mail_outbox"
+    id = db.Column(db.Integer, primary_key=True)
+    sender = db.Column(db.String(255))
+    recipients = db.Column(db.JSON, nullable=False)
+    subject = db.Column(db.String(255), nullable=False, default="")
+    body = db.Column(db.Text)
+    html = db.Column(db.Text)
+    # pending, sending, sent or dead
+    status = db.Column(db.String(20), nullable=False, default="pending")
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+
+    __table_args__ = (db.Index("ix_mail_outbox_status_next_attempt_at",
+                               "status", "next_attempt_at"),)
+
 
 class BlacklistToken(db.Model):
     """
@@ -159,5 +422,11 @@ class BlacklistToken(db.Model):
             return False
 
 
+# compiled once at import, instead of walking __table__.columns on every row
+for _model in (Customer, Order, OrderDetails, Reviews, Role):
+    _model.to_dict = serializer_for(_model)
+Product.to_dict = serializer_for(Product, Product.PUBLIC_FIELDS)
+
+
 # db.drop_all()
 # db.create_all()
\ No newline at end of file
@@ -1,18 +1,22 @@
 from flask import (url_for,
                    request,
-                   jsonify, session, abort, g)
+                   jsonify, abort, g)
 from flask_expects_json import expects_json
 
+from src.helpers import signals
 from src.helpers.errors import invalid_token_response
 from src.helpers.auth_tokens import check_valid_header, decode_auth_token
+from src.helpers import cart_store, mail_outbox, reservations, stripe_catalog, webhook_inbox
+from src.helpers.inventory import apply_decrements, validate_cart
+from src.helpers.cart_pricing import refresh_snapshot
+from src.helpers.payment_gateway import CircuitOpen, gateway
 from src.models import (Product,
                         Order, OrderDetails, Customer
                         )
-from src import app, mail_sender, db
+from src import app, db
 from flask_login import (login_required,
                          current_user)
 from flask_mail import Message
-from threading import Thread
 from datetime import date
 import stripe
 import json
@@ -24,11 +28,6 @@ stripe.api_key = app.config['STRIPE_SECRET_KEY']
 endpoint_secret = os.environ.get("endpoint_secret")
 
 
-def send_mail(app, msg):
-    with app.app_context():
-        mail_sender.send(msg)
-
-
 @app.route('/api/v1/user/<int:user_id>/payments/checkout/', methods=['POST'])
 @expects_json(checkout_schema)
 def create_checkout_session(user_id):
@@ -42,30 +41,52 @@ def create_checkout_session(user_id):
     if decoded_token != user_id:
         return invalid_token_response()
     request_data = g.data
-    if "cart_dict" not in session:
-        abort(404, "No items in cart")
-
-    if session["cart_dict"] == {}:
+    cart_dict = cart_store.load_cart()
+    if not cart_dict:
         abort(404, "No items in cart")
 
-    cart_dict = session["cart_dict"]
-
     items_to_buy = []
+    prices, stock = refresh_snapshot(cart_dict, cart_store.load_prices())
+    cart_store.save_prices(prices)
+    cart_id = None
+    held = {}
+    if reservations.reservations_enabled():
+        cart_id = cart_store.cart_id(create=True)
+        held = reservations.held_quantities(cart_id)
+    if any(prod_id not in prices for prod_id in cart_dict):
+        abort(404, "Product not found")
+    if cart_id is None:
+        short = validate_cart(cart_dict, stock)
+        if short:
+            abort(400, "Not enough items in stock for products: "
+                  + ", ".join(str(line["product_id"]) for line in short))
+    price_ids = {}
+    if stripe_catalog.sync_enabled():
+        price_ids = stripe_catalog.price_ids({prod_id: prices[prod_id]["version"]
+                                              for prod_id in cart_dict})
+        unsynced = [prod_id for prod_id in cart_dict if prod_id not in price_ids]
+        if unsynced:
+            stripe_catalog.resync_async(unsynced)
     for prod_id, quantity in cart_dict.items():
-        product_to_buy = Product.query.get(prod_id)
-        if not product_to_buy:
-            abort(404, "Product not found")
-        qty_left = product_to_buy.quantity
-        if quantity > qty_left:
-            abort(400, "Not enough items in stock")
+        # top up holds that expired or were never taken
+        if cart_id is not None and held.get(prod_id, 0) < quantity:
+            try:
+                if not reservations.hold(cart_id, prod_id, quantity):
+                    abort(400, "Not enough items in stock")
+            except KeyError:
+                abort(404, "Product not found")
 
+        if prod_id in price_ids:
+            # synced for this very version, so it has the current price
+            items_to_buy.append({'price': price_ids[prod_id], 'quantity': quantity})
+            continue
         line_dict = {
             'price_data': {
-                'currency': 'usd',
+                'currency': stripe_catalog.CURRENCY,
                 'product_data': {
-                    'name': product_to_buy.product_description,
+                    'name': prices[prod_id]["description"],
                 },
-                'unit_amount': int((product_to_buy.price / 744) * 100),
+                'unit_amount': stripe_catalog.unit_amount(prices[prod_id]["price"]),
             },
             'quantity': quantity,
 
@@ -80,9 +101,12 @@ def create_checkout_session(user_id):
         abort(400)
     prod_ids = (str([*cart_dict.keys()]))
     prod_qty = (str([*cart_dict.values()]))
+    if cart_id is not None:
+        # keep the stock while the customer is on the payment page
+        reservations.extend(cart_id, app.config.get("RESERVATION_CHECKOUT_TTL"))
 
     try:
-        checkout_session = stripe.checkout.Session.create(
+        checkout_session = gateway().create_checkout_session(
             line_items=items_to_buy,
             mode='payment',
             success_url=url_for("success", user_id=user_id,
@@ -94,9 +118,13 @@ def create_checkout_session(user_id):
                       "city": city,
                       "zip": to_zip,
                       "user_id": user_id,
+                      "cart_id": cart_id or "",
                       }
 
         )
+    except CircuitOpen as e:
+        app.logger.error(e)
+        abort(503, "Payments are temporarily unavailable, please try again shortly")
     except Exception as e:
         app.logger.error(e)
         abort(500)
@@ -124,7 +152,7 @@ def success(user_id):
     decoded_token = decode_auth_token(resp)
     if decoded_token != user_id:
         return invalid_token_response()
-    session["cart_dict"].clear()
+    cart_store.clear_cart()
     return jsonify({
         "success": True,
         "message": "Transaction successful"
@@ -133,7 +161,6 @@ def success(user_id):
 
 @app.route('/api/v1/payments/stripe-webhooks/', methods=['POST'])
 def webhook():
-    receipt_url = ""
     payload = request.data
     event = None
 
@@ -154,65 +181,82 @@ def webhook():
             app.logger.error('Webhook signature verification failed.' + str(e))
             return jsonify(success=False)
 
-        # Handle the event
-    if event and event['type'] == 'payment_intent.succeeded':
-        payment_intent = event['data']['object']  # contains a stripe.PaymentIntent
-        app.logger.info('Payment for {} succeeded'.format(payment_intent['amount']))
-        receipt_url = (payment_intent["charges"]["data"][0]["receipt_url"])
-        print("payment intent succeeded")
+    # stored first and processed by the inbox workers, so Stripe gets its
+    # answer without waiting on the database work or the mail
+    try:
+        webhook_inbox.record_event(event, payload)
+    except Exception as e:
+        app.logger.error(e)
+        db.session.rollback()
+        abort(500)
+    webhook_inbox.start_workers()
+    return jsonify(success=True)
 
 
-    elif event['type'] == 'payment_intent.payment_failed':
-        return jsonify({
-            "success": False,
-            "error": "payment_intent failed",
-        }), 400
-    else:
-        # Unexpected event type
-        app.logger.info('Unhandled event type {}'.format(event['type']))
-    if event['type'] == 'checkout.session.completed':
-        app.logger.info('Checkout session completed')
-
-        session_completed = event['data']["object"]
-        user = Customer.query.get(int(session_completed['metadata']['user_id']))
-        customer_order = OrderDetails(
-            customer_name=user,
-            to_street=session_completed['metadata']['street'],
-            to_city=session_completed['metadata']['city'],
-            zip=session_completed['metadata']['zip'],
-            order_date=date.today()
+@webhook_inbox.handles('payment_intent.succeeded')
+def payment_intent_succeeded(event):
+    payment_intent = event['data']['object']  # contains a stripe.PaymentIntent
+    app.logger.info('Payment for {} succeeded'.format(payment_intent['amount']))
+
+
+@webhook_inbox.handles('payment_intent.payment_failed')
+def payment_intent_failed(event):
+    # acknowledged with 200 like any stored event: a failed payment isn't a
+    # delivery error, and a 400 only made Stripe redeliver it
+    payment_intent = event['data']['object']
+    app.logger.info('Payment for {} failed'.format(payment_intent.get('amount')))
+
+
+@webhook_inbox.handles('checkout.session.completed')
+def checkout_session_completed(event):
+    app.logger.info('Checkout session completed')
+
+    session_completed = event['data']["object"]
+    user = Customer.query.get(int(session_completed['metadata']['user_id']))
+    customer_order = OrderDetails(
+        customer_name=user,
+        to_street=session_completed['metadata']['street'],
+        to_city=session_completed['metadata']['city'],
+        zip=session_completed['metadata']['zip'],
+        order_date=date.today()
+    )
+    product_ids = (
+        session_completed["metadata"]["prod_ids"]).replace("[",
+                                                           "").replace("]",
+                                                                       "").split(",")
+    product_qty = (
+        session_completed["metadata"]["prod_qty"]).replace("[",
+                                                           "").replace("]",
+                                                                       "").split(",")
+    db.session.add(customer_order)
+    quantities = {}
+    for index, item in enumerate(product_ids):
+        app.logger.info("adding order")
+        order = Order(
+            product_id=int(item),
+            quantity=int(product_qty[index]),
+            order_name=customer_order
         )
-        product_ids = (
-            session_completed["metadata"]["prod_ids"]).replace("[",
-                                                               "").replace("]",
-                                                                           "").split(",")
-        product_qty = (
-            session_completed["metadata"]["prod_qty"]).replace("[",
-                                                               "").replace("]",
-                                                                           "").split(",")
-        db.session.add(customer_order)
-        for index, item in enumerate(product_ids):
-            app.logger.info("adding order")
-            prod = Product.query.get(int(item))
-            prod.quantity -= int(product_qty[index])
-            order = Order(
-                product_name=prod,
-                quantity=int(item),
-                order_name=customer_order
-            )
-            db.session.add(order)
-        try:
-            db.session.commit()
-        except Exception as e:
-            app.logger.error(e)
-            abort(500)
-
-        msg = Message()
-        msg.subject = "Receipt from laptohaven"
-        msg.recipients = [user.mail]
-        msg.body = f'Thanks for your patronage, do come again, Here is the link to your receipt{receipt_url}'
-        # msg.html = template
-        Thread(target=send_mail, args=(app, msg)).start()
-
-    print("successfully sent mail and added to db")
-    return jsonify(success=True)
+        db.session.add(order)
+        quantities[order.product_id] = quantities.get(order.product_id, 0) + order.quantity
+    # the customer has paid: record the order even if a line oversold
+    oversold = apply_decrements(quantities)
+    if oversold:
+        app.logger.error(f"Oversold order for customer {user.id}: {oversold}")
+    for prod_id, qty in quantities.items():
+        Product.record_sale(prod_id, qty)
+    if reservations.reservations_enabled():
+        reservations.consume(session_completed["metadata"].get("cart_id"), quantities)
+
+    msg = Message()
+    msg.subject = "Receipt from laptohaven"
+    msg.recipients = [user.mail]
+    msg.body = 'Thanks for your patronage, do come again'
+    # msg.html = template
+    # queued with the order, so the receipt goes out once the order is saved
+    mail_outbox.enqueue(msg, commit=False)
+
+    def after_commit():
+        signals.order_placed.send(app, quantities=quantities)
+        mail_outbox.wake()
+    return after_commit
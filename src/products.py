@@ -1,9 +1,26 @@
-from flask import (request, jsonify, abort, render_template, Blueprint)
-from sqlalchemy import desc, func
+import os
+import re
+
+from flask import (request, jsonify, abort, render_template, Blueprint, send_file)
+from flask_sqlalchemy import Pagination
 
 from src.models import (Product,
-                        Reviews, Order)
+                        Reviews, Order, OrderDetails, ProductRelated)
 from src import app, db
+from src.admin_views import required_roles
+from src.helpers.catalog_snapshot import SORTS, ensure_catalog_snapshot
+from src.helpers.etags import conditional
+from src.helpers.images import FORMATS, VARIANTS, image_dir, variant_path
+from src.helpers.pagination import (wants_cursor, page_limit,
+                                    encode_cursor, decode_cursor, keyset_page)
+from src.helpers.product_loader import MAX_BATCH, PRODUCT_FIELDS, load_products
+from src.helpers.related import RELATED_TOP_K
+from src.helpers.search_index import ensure_search_index
+from src.helpers.shelves import shelves
+from src.helpers.suggest import MAX_SUGGESTIONS, ensure_suggest_index
+
+CARD_COLUMNS = (Product.id, Product.img_url, Product.price, Product.product_description)
+IMAGE_ID_PATTERN = re.compile(r"[0-9a-f]{32}")
 
 
 @app.route("/")
@@ -12,88 +29,85 @@ def get_index_page():
 
 
 def transform_response(
-        result_list, query_result, category=""):
+        result_list, query_result=None, category="", next_cursor=None, per_page=20,
+        extra=None):
     """
     :param result_list: The list containing query result
     :type result_list: list
     :param category: The category of the query
     :type category: str
-    :param query_result: result of the query
+    :param query_result: result of the query, None for a keyset page
     :type query_result: dict
+    :param next_cursor: cursor of the next keyset page, None on the last page
+    :type next_cursor: str
+    :param per_page: size of the page
+    :type per_page: int
+    :param extra: additional fields for the data object
+    :type extra: dict
     :return: json format of the query
     :rtype: object
     """
+    data = {
+        "products": result_list,
+        "category": category,
+        "per_page": per_page
+    }
+    if query_result is None:
+        data["next_cursor"] = next_cursor
+    else:
+        data["pages"] = query_result.pages
+        data["current_page"] = query_result.page
+    if extra:
+        data.update(extra)
 
     return jsonify({
 
         "success": True,
-        "data": {
-            "products": result_list,
-            "category": category,
-            "pages": query_result.pages,
-            "current_page": query_result.page,
-            "per_page": 20
-        }
+        "data": data
     })
 
 
 @app.route("/api/v1/products/", methods=["GET"])
+@conditional
 def home():
     try:
-        phone_cat = Product.query.filter_by(category="Phone").limit(4).all()
-        laptop_cat = Product.query.filter_by(category="Laptop").limit(4).all()
-        highly_rated = Product.query.select_from(
-            Product).join(Reviews).group_by(Product.id).order_by(desc(func.avg(Reviews.rating))
-                                                                 ).limit(4).all()
-        most_purchased = Product.query.select_from(
-            Product).join(Order).group_by(Product.id).order_by(desc(func.sum(Order.quantity))
-                                                               ).limit(4).all()
-        phone_category = [phone.to_dict() for phone in phone_cat]
-        laptop_category = [laptop.to_dict() for laptop in laptop_cat]
-        highly_rated_prods = [prod.to_dict() for prod in highly_rated]
-        most_purchased_prods = [prod.to_dict() for prod in most_purchased]
-        products = {"phones": phone_category,
-                    "laptops": laptop_category,
-                    "most_purchased": most_purchased_prods,
-                    "highly_rated": highly_rated_prods}
-
+        payload = shelves.payload()
     except Exception as e:
         app.logger.error(e)
         abort(404)
     else:
-        product_format = jsonify({
-            "data": {
-                'products': products
-            },
-            'success': True,
-        })
-        return product_format
+        return app.response_class(payload, mimetype="application/json")
+
+
+REVIEWS_ORDER = [(Reviews.date, True), (Reviews.id, True)]
+ORDERS_ORDER = [(Order.id, True)]
+DETAIL_REVIEWS = 10
+
+
+def get_product_or_404(product_id):
+    if not Product.query.with_entities(Product.id).filter_by(id=product_id).first():
+        abort(404, "Product not found")
 
 
 @app.route("/api/v1/product/<int:productId>/")
+@conditional
 def product(productId):
     specific_product = Product.query.get(productId)
     if not specific_product:
         abort(404, "Product not found")
-    all_reviews = Reviews.query.filter_by(product_id=productId)
-    average_rating = Reviews.query.with_entities(func.avg(Reviews.rating).label("average"
-                                                                                )).filter_by(
-        product_id=productId).all()
-
-    all_reviews = [review.to_dict() for review in all_reviews]
-    if average_rating[0][0]:
-        average_rating = round(average_rating[0][0], 1)
-    average_rating = None
-
-    prod_orders = [i.order_name.to_dict() for i in specific_product.order]
-    specific_product = specific_product.to_dict()
+    reviews, next_cursor = keyset_page(Reviews.query.filter_by(product_id=productId),
+                                       REVIEWS_ORDER, None, DETAIL_REVIEWS)
+    rating_summary = specific_product.rating_summary()
+
     product_format = jsonify({
         "data": {
 
-            'prod_orders': prod_orders,
-            'product': specific_product,
-            'average_rating': average_rating,
-            'all_reviews': all_reviews
+            'product': specific_product.to_dict(),
+            'average_rating': rating_summary["average_rating"],
+            'rating_summary': rating_summary,
+            'units_sold': specific_product.units_sold,
+            'reviews': [review.to_dict() for review in reviews],
+            'reviews_next_cursor': next_cursor
         },
         'success': True,
     })
@@ -101,140 +115,353 @@ def product(productId):
     return product_format
 
 
-@app.route("/api/v1/product/category/<category>/")
-def get_by_category(category):
+@app.route("/api/v1/product/<int:productId>/reviews/", methods=["GET"])
+@conditional
+def product_reviews(productId):
+    get_product_or_404(productId)
+    limit = page_limit(request.args)
+    values = decode_cursor(request.args.get("cursor"), len(REVIEWS_ORDER))
+    reviews, next_cursor = keyset_page(Reviews.query.filter_by(product_id=productId),
+                                       REVIEWS_ORDER, values, limit)
+
+    return jsonify({
+        "success": True,
+        "data": {
+            "reviews": [review.to_dict() for review in reviews],
+            "next_cursor": next_cursor,
+            "per_page": limit
+        }
+    })
+
+
+@app.route("/api/v1/product/<int:productId>/orders/", methods=["GET"])
+@required_roles("admin")
+def product_orders(productId):
+    get_product_or_404(productId)
+    limit = page_limit(request.args)
+    values = decode_cursor(request.args.get("cursor"), len(ORDERS_ORDER))
+    query = db.session.query(Order).join(OrderDetails).with_entities(
+        Order.id, Order.quantity, Order.order_details_id, OrderDetails.customer_id,
+        OrderDetails.to_street, OrderDetails.to_city, OrderDetails.zip,
+        OrderDetails.order_date).filter(Order.product_id == productId)
+    orders, next_cursor = keyset_page(query, ORDERS_ORDER, values, limit)
+
+    # customer addresses: never kept by a shared or browser cache
+    response = jsonify({
+        "success": True,
+        "data": {
+            "orders": [{"order_id": order.id,
+                        "quantity": order.quantity,
+                        "order_details_id": order.order_details_id,
+                        "customer_id": order.customer_id,
+                        "to_street": order.to_street,
+                        "to_city": order.to_city,
+                        "zip": order.zip,
+                        "order_date": order.order_date
+                        } for order in orders],
+            "next_cursor": next_cursor,
+            "per_page": limit
+        }
+    })
+    response.cache_control.private = True
+    response.cache_control.no_store = True
+    return response
+
+
+@app.route("/api/v1/product/<int:productId>/related/", methods=["GET"])
+@conditional
+def related_products(productId):
+    limit = min(request.args.get("limit", RELATED_TOP_K, type=int), RELATED_TOP_K)
+    if limit < 1:
+        abort(400, "limit must be positive")
+    get_product_or_404(productId)
+    related = ProductRelated.query.get(productId)
+    ranked_ids = [product_id for product_id, _ in related.related[:limit]] if related else []
+    rows = load_products(ranked_ids, fields=[column.key for column in CARD_COLUMNS])
+
+    return jsonify({
+        "success": True,
+        "data": {
+            "product_id": productId,
+            "products": product_cards([rows[product_id] for product_id in ranked_ids
+                                       if product_id in rows])
+        }
+    })
+
+
+def product_cards(rows):
+    """
+    :param rows: rows holding the card columns of a product
+    :return: the product cards shown on listing pages
+    :rtype: list
+    """
+    return [{"id": result.id,
+             "img_url": result.img_url,
+             "product_description": result.product_description,
+             "price": result.price
+             } for result in rows]
+
+
+def list_products(query, order, error_code, category=""):
+    """
+    Serve a product listing as numbered pages, or as keyset pages when the
+    client opts in with ``?cursor=`` / ``?limit=``.
+
+    :param query: the filtered listing query, selecting the card columns
+        and every sort column
+    :param order: list of (column, descending) pairs forming a unique sort key
+    :param error_code: status to abort with if the query fails
+    :param category: The category of the query
+    """
+    if wants_cursor(request.args):
+        limit = page_limit(request.args)
+        values = decode_cursor(request.args.get("cursor"), len(order))
+        try:
+            rows, next_cursor = keyset_page(query, order, values, limit)
+        except Exception as e:
+            app.logger.error(e)
+            abort(error_code)
+        else:
+            return transform_response(product_cards(rows), category=category,
+                                      next_cursor=next_cursor, per_page=limit)
+
+    page = request.args.get("page", 1, type=int)
     try:
-        page = request.args.get("page", 1, type=int)
-        query_result = Product.query.with_entities(Product.id,
-                                                   Product.img_url,
-                                                   Product.price,
-                                                   Product.product_description
-                                                   ).filter_by(
-            category=category).paginate(
-            per_page=20, page=page
-        )
+        query_result = query.order_by(*[column.desc() if descending else column.asc()
+                                        for column, descending in order]
+                                      ).paginate(per_page=20, page=page)
     except Exception as e:
         app.logger.error(e)
-        abort(500)
+        abort(error_code)
     else:
-        result_list = [{"id": result.id,
-                        "img_url": result.img_url,
-                        "product_description": result.product_description,
-                        "price": result.price
-                        } for result in query_result.items]
+        return transform_response(product_cards(query_result.items), query_result,
+                                  category=category)
 
-        return transform_response(result_list, query_result, category=category)
+
+@app.route("/api/v1/product/category/<category>/")
+@conditional
+def get_by_category(category):
+    query = Product.query.with_entities(*CARD_COLUMNS).filter_by(category=category)
+
+    return list_products(query, [(Product.price, False), (Product.id, False)], 500,
+                         category=category)
 
 
 @app.route("/api/v1/products/rating/")
+@conditional
 def get_by_rating():
-    try:
-        page = request.args.get("page", 1, type=int)
-        query_result = db.session.query(Product).select_from(
-            Product).join(Reviews).group_by(Product.id).order_by(desc(func.avg(Reviews.rating))
-                                                                 ).paginate(
-            per_page=20, page=page
-        )
-    except Exception as e:
-        app.logger.error(e)
-        abort(404)
-    else:
-        result_list = [{"id": result.id,
-                        "img_url": result.img_url,
-                        "product_description": result.product_description,
-                        "price": result.price
-                        } for result in query_result.items]
+    query = Product.query.with_entities(*CARD_COLUMNS, Product.avg_rating).filter(
+        Product.rating_count > 0)
+
+    return list_products(query, [(Product.avg_rating, True), (Product.id, True)], 404,
+                         category="highly_rated")
 
-        category = "highly_rated"
 
-        return transform_response(result_list, query_result, category=category)
+SALES_WINDOWS = {"all": Product.units_sold,
+                 "7d": Product.units_sold_7d,
+                 "30d": Product.units_sold_30d}
 
 
 @app.route("/api/v1/products/most-purchased/")
+@conditional
 def purchased():
-    try:
-        page = request.args.get("page", 1, type=int)
-        query_result = db.session.query(Product).select_from(
-            Product).join(Order).group_by(Product.id).order_by(desc(func.sum(Order.quantity))
-                                                               ).paginate(
-            per_page=20, page=page
-        )
-    except Exception as e:
-        app.logger.error(e)
-        abort(404)
-    else:
-
-        result_list = [{"id": result.id,
-                        "img_url": result.img_url,
-                        "product_description": result.product_description,
-                        "price": result.price
-                        } for result in query_result.items]
-
-        category = "most_purchased"
+    window = request.args.get("window", "all")
+    if window not in SALES_WINDOWS:
+        abort(400, "window must be one of: " + ", ".join(SALES_WINDOWS))
+    units_sold = SALES_WINDOWS[window]
+    query = Product.query.with_entities(*CARD_COLUMNS, units_sold).filter(units_sold > 0)
 
-        return transform_response(result_list, query_result, category=category)
+    return list_products(query, [(units_sold, True), (Product.id, True)], 404,
+                         category="most_purchased")
 
 
 @app.route("/api/v1/products/search/", methods=["GET"])
+@conditional
 def search():
     query = request.args.get('query', None)
     if not query:
         app.logger.error("No query error")
         abort(404, "No query provided")
 
-    page = request.args.get("page", 1, type=int)
+    cursor_mode = wants_cursor(request.args)
+    if cursor_mode:
+        per_page = page_limit(request.args)
+        after = decode_cursor(request.args.get("cursor"), 2)
+        page = 1
+    else:
+        per_page = 20
+        after = None
+        page = request.args.get("page", 1, type=int)
+        if page < 1:
+            abort(404)
+    corrected_query = None
     try:
-        query_result = Product.query.with_entities(Product.id,
-                                                   Product.img_url,
-                                                   Product.price,
-                                                   Product.product_description
-                                                   ).filter(
-            Product.product_name.ilike(f"%{query}%") | Product.product_description.ilike(
-                f"%{query}%")
-            | Product.category.ilike(f"%{query}%")).paginate(per_page=20, page=page)
+        index = ensure_search_index()
+        total, hits = index.search(query, limit=per_page, offset=(page - 1) * per_page,
+                                   after=after)
+        if not total:
+            # nothing matched: retry once with misspelled words corrected
+            corrected_query = index.correct(query)
+            if corrected_query:
+                total, hits = index.search(corrected_query, limit=per_page,
+                                           offset=(page - 1) * per_page, after=after)
+        ranked_ids = [product_id for _, product_id in hits]
+        rows = {row.id: row for row in Product.query.with_entities(*CARD_COLUMNS).filter(
+            Product.id.in_(ranked_ids))} if ranked_ids else {}
+        query_result = Pagination(None, page, per_page, total,
+                                  [rows[product_id] for product_id in ranked_ids
+                                   if product_id in rows])
     except Exception as e:
         app.logger.error(e)
         abort(404)
     else:
-        result_list = [{"id": result.id,
-                        "img_url": result.img_url,
-                        "product_description": result.product_description,
-                        "price": result.price
-                        } for result in query_result.items]
+        result_list = product_cards(query_result.items)
+        extra = {"corrected_query": corrected_query} if corrected_query else None
+        if cursor_mode:
+            next_cursor = encode_cursor(hits[-1]) if len(hits) == per_page else None
+            return transform_response(result_list, next_cursor=next_cursor, per_page=per_page,
+                                      extra=extra)
 
-        return transform_response(result_list, query_result)
+        return transform_response(result_list, query_result, extra=extra)
 
 
 @app.route("/api/v1/products/filter/", methods=["GET"])
+@conditional
 def filter_product():
     max_price = int(request.args.get("max", None))
     min_price = int(request.args.get("min", None))
     category = request.args.get("category", None)
     if max_price and min_price and category and (max_price > min_price):
-        page = request.args.get("page", 1, type=int)
-        try:
-            query_result = Product.query.with_entities(Product.id,
-                                                       Product.img_url,
-                                                       Product.price,
-                                                       Product.product_description
-                                                       ).filter(
-                Product.price >= min_price,
-                Product.price <= max_price,
-                Product.category == category).paginate(per_page=20, page=page)
-        except Exception as e:
-            app.logger.error(e)
-            abort(404)
-        else:
-            result_list = [{"id": result.id,
-                            "img_url": result.img_url,
-                            "product_description": result.product_description,
-                            "price": result.price
-                            } for result in query_result.items]
+        query = Product.query.with_entities(*CARD_COLUMNS).filter(
+            Product.price >= min_price,
+            Product.price <= max_price,
+            Product.category == category)
 
-            return transform_response(result_list, query_result)
+        return list_products(query, [(Product.price, False), (Product.id, False)], 404)
 
     else:
         app.logger.error("Invalid argument error")
         abort(404, "Invalid arguments provided")
 
 
+def parse_price_range(value):
+    low, _, high = value.partition("-")
+    try:
+        return (int(low) if low else None), (int(high) if high else None)
+    except ValueError:
+        abort(400, f"Invalid price range: {value}")
+
+
+@app.route("/api/v1/products/facets/", methods=["GET"])
+@conditional
+def faceted_filter():
+    categories = [category for value in request.args.getlist("category")
+                  for category in value.split(",") if category] or None
+    price_ranges = [parse_price_range(value) for value in request.args.getlist("price")]
+    min_price = request.args.get("min", None, type=int)
+    max_price = request.args.get("max", None, type=int)
+    if min_price is not None or max_price is not None:
+        price_ranges.append((min_price, max_price))
+    in_stock = request.args.get("in_stock", "").lower() in ("1", "true", "yes")
+    min_rating = request.args.get("min_rating", None, type=float)
+    sort = request.args.get("sort", "price")
+    if sort not in SORTS:
+        abort(400, "sort must be one of: " + ", ".join(SORTS))
+    page = request.args.get("page", 1, type=int)
+    if page < 1:
+        abort(404)
+
+    try:
+        total, product_ids, facets = ensure_catalog_snapshot().search(
+            categories=categories, price_ranges=price_ranges, in_stock=in_stock,
+            min_rating=min_rating, sort=sort, limit=20, offset=(page - 1) * 20)
+        rows = {row.id: row for row in Product.query.with_entities(*CARD_COLUMNS).filter(
+            Product.id.in_(product_ids))} if product_ids else {}
+        query_result = Pagination(None, page, 20, total,
+                                  [rows[product_id] for product_id in product_ids
+                                   if product_id in rows])
+    except Exception as e:
+        app.logger.error(e)
+        abort(500)
+    else:
+        return transform_response(product_cards(query_result.items), query_result,
+                                  extra={"total": total, "facets": facets})
+
+
+@app.route("/api/v1/products/batch/", methods=["GET"])
+@conditional
+def batch_products():
+    values = [value for value in request.args.get("ids", "").split(",") if value]
+    if not values:
+        abort(400, "No ids provided")
+    # capped before parsing, duplicates included, so the list itself is bounded
+    if len(values) > MAX_BATCH:
+        abort(400, f"At most {MAX_BATCH} ids can be fetched at once")
+    try:
+        product_ids = [int(value) for value in values]
+    except ValueError:
+        abort(400, "ids must be a comma separated list of product ids")
+
+    fields = request.args.get("fields", None)
+    if fields:
+        fields = [field for field in fields.split(",") if field]
+        unknown = [field for field in fields if field not in PRODUCT_FIELDS]
+        if unknown:
+            abort(400, "Unknown fields: " + ", ".join(unknown))
+    else:
+        fields = None
+
+    try:
+        products = load_products(product_ids, fields)
+    except Exception as e:
+        app.logger.error(e)
+        abort(500)
+    else:
+        return jsonify({
+            "success": True,
+            "data": {
+                "products": {str(product_id): (prod.to_dict() if fields is None
+                                               else dict(prod._mapping))
+                             for product_id, prod in products.items()},
+                "missing": sorted(set(product_ids) - set(products))
+            }
+        })
+
+
+@app.route("/api/v1/products/suggest/", methods=["GET"])
+def suggest():
+    query = request.args.get("q", "")
+    limit = request.args.get("limit", MAX_SUGGESTIONS, type=int)
+    if limit < 1:
+        abort(400, "limit must be positive")
+    try:
+        suggestions = ensure_suggest_index().suggest(query, limit=limit)
+    except Exception as e:
+        app.logger.error(e)
+        abort(500)
+    else:
+        return jsonify({
+            "success": True,
+            "data": {
+                "query": query,
+                "suggestions": suggestions
+            }
+        })
+
+
+@app.route("/api/v1/images/<image_id>/<variant>.<extension>", methods=["GET"])
+def product_image(image_id, variant, extension):
+    if (not IMAGE_ID_PATTERN.fullmatch(image_id) or variant not in VARIANTS
+            or extension not in FORMATS):
+        abort(404)
+    path = variant_path(image_id, variant, extension)
+    if not os.path.exists(path):
+        if os.path.exists(os.path.join(image_dir(image_id), "original")):
+            abort(404, "Image is still being processed")
+        abort(404)
+    # variants never change once written, the URL changes with the image
+    response = send_file(path, mimetype=FORMATS[extension][1],
+                         max_age=app.config["IMAGE_MAX_AGE"], conditional=True)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
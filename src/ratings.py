@@ -2,6 +2,7 @@ from flask import request, jsonify, abort, g
 from flask_expects_json import expects_json
 
 from src import app, db
+from src.helpers import signals
 from src.helpers.auth_tokens import check_valid_header, decode_auth_token
 from src.helpers.errors import invalid_token_response
 from src.models import Customer, Reviews, Product
@@ -28,11 +29,14 @@ def add_rating(prodId):
         customer_id=customer_id)
     db.session.add(new_review)
     try:
+        Product.apply_rating(prodId, rating)
         db.session.commit()
     except Exception as e:
         app.logger.error(e)
         db.session.rollback()
         abort(422, e.args[0])
+    else:
+        signals.review_added.send(app, product_id=prodId, rating=rating)
     finally:
         db.session.close()
 
@@ -91,22 +91,42 @@ update_role_schema = {
 add_to_cart_schema = {
     'required': ['prod_id', 'qty'],
     'properties': {
-        'prod_id': {'type': 'number'},
-        'qty': {'type': 'number', 'minimum': 1}
+        'prod_id': {'type': 'integer', 'minimum': 1},
+        'qty': {'type': 'integer', 'minimum': 1}
     }
 }
 
 update_cart_schema = {
     'required': ['qty'],
     'properties': {
-        'qty': {'type': 'number', 'minimum': 0}
+        'qty': {'type': 'integer', 'minimum': 0}
+    }
+}
+
+bulk_cart_schema = {
+    'required': ['ops'],
+    'properties': {
+        'ops': {
+            'type': 'array',
+            'minItems': 1,
+            'maxItems': 300,
+            'items': {
+                'type': 'object',
+                'required': ['op', 'prod_id'],
+                'properties': {
+                    'op': {'type': 'string', 'enum': ['add', 'set', 'remove']},
+                    'prod_id': {'type': 'integer', 'minimum': 1},
+                    'qty': {'type': 'integer', 'minimum': 0}
+                }
+            }
+        }
     }
 }
 
 add_rating_schema = {
     'required': ['rating', 'review'],
     'properties': {
-        'rating': {'type': 'number', 'minimum': 1, 'maximum': 5},
+        'rating': {'type': 'integer', 'minimum': 1, 'maximum': 5},
         'review': {'type': 'string'}
     }
 }
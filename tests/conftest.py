@@ -1,4 +1,123 @@
+import os
+import tempfile
 
+import pytest
 
+# the app reads its database URL when src is first imported, which happens
+# after this file is loaded: point it at a scratch SQLite database
+_DB_DIR = tempfile.mkdtemp(prefix="laptohaven-tests-")
+os.environ.setdefault("DB_URL", "sqlite:///" + os.path.join(_DB_DIR, "test.db"))
+os.environ.setdefault("SECRET_KEY", "test-secret")
 
+# settings for DB-backed tests: no background threads, immediate version bumps
+TEST_CONFIG = {
+    "TESTING": True,
+    "CATALOG_VERSION_TTL": 0,
+    "WEBHOOK_WORKERS": 0,
+    "MAIL_WORKERS": 0,
+    "RESERVATION_SWEEP_INTERVAL": 0,
+    "STOCK_RESERVATIONS": False,
+    "STRIPE_PRICE_SYNC": False,
+}
 
+
+@pytest.fixture(autouse=True)
+def no_workers(monkeypatch):
+    """The first request starts the outbox workers: not in tests."""
+    from src import app
+
+    monkeypatch.setitem(app.config, "WEBHOOK_WORKERS", 0)
+    monkeypatch.setitem(app.config, "MAIL_WORKERS", 0)
+
+
+@pytest.fixture(autouse=True)
+def session_dir(tmp_path, monkeypatch):
+    """Keep the filesystem sessions tests create out of the working tree."""
+    from flask_session import Session
+    from src import app
+
+    if app.config.get("SESSION_BACKEND", "filesystem") == "filesystem":
+        monkeypatch.setitem(app.config, "SESSION_FILE_DIR", str(tmp_path / "flask_session"))
+        monkeypatch.setattr(app, "session_interface", Session()._get_interface(app))
+
+
+@pytest.fixture
+def database(monkeypatch):
+    """A fresh schema per test, inside an app context."""
+    from src import app, db
+    from src.helpers import etags
+
+    # every test starts its versions over, forget the ones bumped before
+    monkeypatch.setattr(etags, "_own", {etags.CATALOG: set(), etags.PRODUCTS: set()})
+    for key, value in TEST_CONFIG.items():
+        monkeypatch.setitem(app.config, key, value)
+    monkeypatch.setattr(app.extensions["mail"], "suppress", True)
+    with app.app_context():
+        db.create_all()
+        try:
+            yield db
+        finally:
+            db.session.remove()
+            db.drop_all()
+
+
+@pytest.fixture
+def make_product(database):
+    from src.models import Product
+
+    def make(**fields):
+        product = Product(**{"quantity": 10, "product_name": "Product",
+                             "product_description": "A product", "category": "Phone",
+                             "price": 1000, "img_url": "http://example.com/p.png",
+                             **fields})
+        database.session.add(product)
+        database.session.commit()
+        return product
+    return make
+
+
+@pytest.fixture
+def customer(database):
+    from src.models import Customer
+
+    user = Customer(first_name="Ada", last_name="Lovelace", street="1 Main St",
+                    city="London", zip="12345", phone="0700000000",
+                    mail="ada@example.com", password="x", role=2)
+    database.session.add(user)
+    database.session.commit()
+    return user
+
+
+@pytest.fixture
+def other_worker(database):
+    """Bump catalog versions the way another process would, unseen by this one."""
+    from datetime import datetime
+
+    from src.helpers.etags import CATALOG
+    from src.models import CatalogVersion
+
+    def bump(*scopes):
+        for scope in scopes or (CATALOG,):
+            row = CatalogVersion.query.get(scope)
+            if row is None:
+                database.session.add(CatalogVersion(id=scope, version=1,
+                                                    updated_at=datetime.utcnow()))
+            else:
+                row.version += 1
+        database.session.commit()
+    return bump
+
+
+@pytest.fixture
+def admin_headers(database):
+    """Authorization headers of an admin customer."""
+    from src.helpers.auth_tokens import encode_auth_token
+    from src.models import Customer, Role
+
+    database.session.add_all([Role(id=1, name="admin"), Role(id=2, name="customer")])
+    admin = Customer(first_name="Grace", last_name="Hopper", street="2 Main St",
+                     city="London", zip="12345", phone="0700000001",
+                     mail="grace@example.com", password="x", role=1)
+    database.session.add(admin)
+    database.session.commit()
+    return {"Authorization": f"Bearer {encode_auth_token(admin.id)}"}
@@ -0,0 +1,85 @@
+from sqlalchemy import func
+
+from src import app, db
+from src.helpers import reservations
+from src.models import StockReservation
+
+BULK = "/api/v1/cart/bulk/"
+
+
+def held():
+    return dict(db.session.query(StockReservation.product_id,
+                                 func.sum(StockReservation.quantity)).group_by(
+        StockReservation.product_id).all())
+
+
+def cart(client):
+    return {line["prod"]["id"]: line["qty"]
+            for line in client.get("/api/v1/cart/").json["data"]["products"]}
+
+
+def test_bulk_reports_every_short_line_at_once(database, make_product):
+    """
+    GIVEN two products with little stock
+    WHEN one bulk request asks for more than either has
+    THEN both are reported in one 400 and the cart is left unchanged
+    """
+    first, second, third = (make_product(quantity=1), make_product(quantity=1),
+                            make_product())
+    client = app.test_client()
+    client.post(BULK, json={"ops": [{"op": "add", "prod_id": third.id, "qty": 1}]})
+
+    response = client.post(BULK, json={"ops": [
+        {"op": "add", "prod_id": first.id, "qty": 2},
+        {"op": "set", "prod_id": second.id, "qty": 3},
+        {"op": "add", "prod_id": third.id, "qty": 1}]})
+
+    assert response.status_code == 400
+    assert response.json["error"] == \
+        f"Not enough items in stock for products: {first.id}, {second.id}"
+    assert cart(client) == {third.id: 1}
+
+
+def test_bulk_rolls_back_holds_when_a_line_cannot_be_held(database, make_product,
+                                                          monkeypatch):
+    """
+    GIVEN stock reservations, a cart holding 2 of one product and another
+        cart holding most of a second product
+    WHEN a bulk request raises the first line and adds more of the second
+        than is left unheld
+    THEN the request fails and the first line's hold goes back to 2
+    """
+    monkeypatch.setitem(app.config, "STOCK_RESERVATIONS", True)
+    first, second = make_product(), make_product()
+    assert reservations.hold("other-cart", second.id, 8)
+    client = app.test_client()
+    assert client.post(BULK, json={"ops": [
+        {"op": "set", "prod_id": first.id, "qty": 2}]}).status_code == 200
+
+    response = client.post(BULK, json={"ops": [
+        {"op": "set", "prod_id": first.id, "qty": 5},
+        {"op": "add", "prod_id": second.id, "qty": 3}]})
+
+    assert response.status_code == 400
+    assert held() == {first.id: 2, second.id: 8}
+    assert cart(client) == {first.id: 2}
+
+
+def test_bulk_set_to_zero_removes_the_line(database, make_product):
+    """
+    GIVEN a cart with two lines
+    WHEN one is set to 0 and the other removed in the same request
+    THEN the cart is empty
+    """
+    first, second = make_product(), make_product()
+    client = app.test_client()
+    client.post(BULK, json={"ops": [{"op": "add", "prod_id": first.id, "qty": 1},
+                                    {"op": "add", "prod_id": second.id, "qty": 2}]})
+
+    response = client.post(BULK, json={"ops": [
+        {"op": "set", "prod_id": first.id, "qty": 0},
+        {"op": "remove", "prod_id": second.id}]})
+
+    assert response.status_code == 200
+    assert response.json["data"]["products"] == []
+    assert cart(client) == {}
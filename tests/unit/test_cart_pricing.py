@@ -0,0 +1,83 @@
+import pytest
+
+from src import app, db
+from src.helpers import cart_store
+from src.helpers.cart_pricing import price_cart, refresh_snapshot
+from src.models import Product
+
+
+def test_price_cart_lines_total_and_snapshot(database, make_product):
+    """
+    GIVEN a cart over two products, one with too little stock
+    WHEN it is priced
+    THEN the lines, total and snapshot follow the products
+    """
+    phone = make_product(price=1000, quantity=5)
+    laptop = make_product(price=3000, quantity=1, product_description="A laptop")
+
+    lines, total, snapshot = price_cart({phone.id: 2, laptop.id: 2})
+
+    assert [(line["prod"]["id"], line["qty"], line["prod"]["in_stock"]) for line in lines] == [
+        (phone.id, 2, True), (laptop.id, 2, False)]
+    assert total == 8000
+    assert snapshot == {
+        phone.id: {"version": 1, "price": 1000, "description": "A product"},
+        laptop.id: {"version": 1, "price": 3000, "description": "A laptop"}}
+
+
+def test_price_cart_missing_product(database, make_product):
+    phone = make_product()
+    with pytest.raises(KeyError) as error:
+        price_cart({phone.id: 1, phone.id + 1: 1})
+    assert error.value.args == (phone.id + 1,)
+
+
+def test_refresh_snapshot_refetches_only_moved_versions(database, make_product):
+    """
+    GIVEN a snapshot over three products
+    WHEN one is repriced (its version moves), one edited in place without a
+        version bump and one deleted
+    THEN the repriced one is fetched again, the other kept as snapshotted,
+        the deleted one dropped, and the stock left is reported
+    """
+    repriced, kept, deleted = make_product(), make_product(), make_product()
+    cart = {repriced.id: 1, kept.id: 1, deleted.id: 1}
+    _, _, snapshot = price_cart(cart)
+    repriced.price, repriced.price_version = 1500, 2
+    kept.price, kept.quantity = 9999, 3
+    db.session.delete(deleted)
+    db.session.commit()
+
+    refreshed, stock = refresh_snapshot(cart, snapshot)
+
+    assert refreshed == {
+        repriced.id: {"version": 2, "price": 1500, "description": "A product"},
+        kept.id: snapshot[kept.id]}
+    assert stock == {repriced.id: 10, kept.id: 3}
+
+
+def test_get_cart_saves_prices_only_when_they_change(database, make_product, monkeypatch):
+    """
+    GIVEN a cart in the session
+    WHEN it is fetched repeatedly, then after a product's version moves
+    THEN the price snapshot is written on the first fetch and after the move only
+    """
+    product = make_product()
+    saved = []
+    save_prices = cart_store.save_prices
+    monkeypatch.setattr(cart_store, "save_prices",
+                        lambda snapshot: saved.append(snapshot) or save_prices(snapshot))
+    client = app.test_client()
+    assert client.post("/api/v1/cart/", json={"prod_id": product.id, "qty": 1}).status_code == 201
+
+    for _ in range(3):
+        assert client.get("/api/v1/cart/").status_code == 200
+    assert len(saved) == 1
+
+    Product.query.filter_by(id=product.id).update({Product.price: 2000,
+                                                   Product.price_version: 2})
+    db.session.commit()
+    response = client.get("/api/v1/cart/")
+
+    assert response.json["data"]["total_price"] == 2000
+    assert [snapshot[product.id]["version"] for snapshot in saved] == [1, 2]
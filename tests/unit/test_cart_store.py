@@ -0,0 +1,123 @@
+import pytest
+from itsdangerous import Signer
+
+from src import app
+from src.helpers.cart_store import decode_cart, encode_cart
+
+CART_ID = bytes(range(16))
+
+
+def test_cart_cookie_round_trip():
+    """
+    GIVEN a cart with small and large product ids and quantities
+    WHEN it is encoded and decoded
+    THEN the cart and its id come back unchanged, in a compact payload
+    """
+    cart = {7: 1, 3: 200, 1_000_000: 3, 8: 1}
+    payload = encode_cart(cart, CART_ID)
+    assert decode_cart(payload) == (cart, CART_ID)
+    assert len(payload) < 40
+
+
+def test_empty_cart_round_trip():
+    assert decode_cart(encode_cart({}, CART_ID)) == ({}, CART_ID)
+
+
+@pytest.mark.parametrize("payload", [b"", b"Ag", b"AQID", b"!!!"])
+def test_malformed_cookie_is_rejected(payload):
+    with pytest.raises(ValueError):
+        decode_cart(payload)
+
+
+@pytest.fixture
+def cookie_client(database, monkeypatch):
+    monkeypatch.setitem(app.config, "CART_STORAGE", "cookie")
+    return app.test_client()
+
+
+def cart_cookie(client):
+    return next((cookie.value for cookie in client.cookie_jar if cookie.name == "cart"), None)
+
+
+def set_cart_cookie(client, value):
+    client.cookie_jar.clear()
+    client.set_cookie("localhost", "cart", value)
+
+
+def cart(client):
+    response = client.get("/api/v1/cart/")
+    if response.status_code == 404:
+        return None
+    return {line["prod"]["id"]: line["qty"] for line in response.json["data"]["products"]}
+
+
+def test_cookie_cart_add_get_remove(cookie_client, make_product):
+    """
+    GIVEN CART_STORAGE = "cookie"
+    WHEN products are added to the cart, it is read back and one is removed
+    THEN the cart lives in the signed cookie, which follows every change
+    """
+    first, second = make_product(), make_product()
+    assert cart(cookie_client) is None
+
+    assert cookie_client.post("/api/v1/cart/", json={"prod_id": first.id, "qty": 2}
+                              ).status_code == 201
+    assert cookie_client.post("/api/v1/cart/", json={"prod_id": second.id, "qty": 1}
+                              ).status_code == 201
+    assert cookie_client.post("/api/v1/cart/", json={"prod_id": first.id, "qty": 1}
+                              ).status_code == 201
+    value = cart_cookie(cookie_client)
+    assert decode_cart(Signer(app.secret_key, salt="cart-cookie").unsign(
+        value.encode("ascii")))[0] == {first.id: 3, second.id: 1}
+    assert cart(cookie_client) == {first.id: 3, second.id: 1}
+
+    response = cookie_client.delete(f"/api/v1/cart/{first.id}/")
+    assert response.status_code == 200
+    assert response.json["data"]["products"] == {str(second.id): 1}
+    assert cart(cookie_client) == {second.id: 1}
+
+    assert cookie_client.delete("/api/v1/cart/clear/").status_code == 204
+    assert cart_cookie(cookie_client) is None
+    assert cart(cookie_client) is None
+
+
+def test_tampered_cart_cookie_is_ignored(cookie_client, make_product):
+    """
+    GIVEN a cart cookie whose payload was edited, so its signature fails
+    WHEN the cart is read, then added to
+    THEN there is no cart, and adding starts a new one
+    """
+    first, second = make_product(), make_product()
+    cookie_client.post("/api/v1/cart/", json={"prod_id": first.id, "qty": 1})
+    _, signature = cart_cookie(cookie_client).rsplit(".", 1)
+    forged = encode_cart({first.id: 1, second.id: 50}, CART_ID).decode("ascii")
+    set_cart_cookie(cookie_client, f"{forged}.{signature}")
+
+    assert cart(cookie_client) is None
+    cookie_client.post("/api/v1/cart/", json={"prod_id": second.id, "qty": 1})
+    assert cart(cookie_client) == {second.id: 1}
+
+    set_cart_cookie(cookie_client, "not a cart")
+    assert cart(cookie_client) is None
+
+
+def test_cart_too_large_for_its_cookie_is_refused(cookie_client, make_product, monkeypatch):
+    """
+    GIVEN a cookie size limit a few lines can fill
+    WHEN more products are added than the cookie can hold
+    THEN the add is refused with 400 and the cookie keeps the cart it had
+    """
+    monkeypatch.setitem(app.config, "CART_COOKIE_MAX_BYTES", 64)
+    products = [make_product() for _ in range(8)]
+    added = {}
+    for product in products:
+        response = cookie_client.post("/api/v1/cart/", json={"prod_id": product.id, "qty": 1})
+        if response.status_code != 201:
+            break
+        added[product.id] = 1
+
+    assert response.status_code == 400
+    assert response.json["error"] == "Cart is full"
+    assert 0 < len(added) < len(products)
+    assert len(cart_cookie(cookie_client)) <= 64
+    assert cart(cookie_client) == added
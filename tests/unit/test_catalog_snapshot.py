@@ -0,0 +1,109 @@
+import pytest
+
+from src import app, db
+from src.helpers import catalog_snapshot as snapshot_module, signals
+from src.helpers.catalog_snapshot import CatalogSnapshot, ensure_catalog_snapshot
+from src.helpers.etags import CATALOG, PRODUCTS
+from src.models import Product
+
+
+@pytest.fixture()
+def snapshot():
+    snapshot = CatalogSnapshot()
+    snapshot.build([
+        (1, 45000, 3, "Phone", 4.5),
+        (2, 120000, 0, "Phone", None),
+        (3, 350000, 7, "Laptop", 3.0),
+        (4, 900000, 2, "Laptop", 4.8),
+    ])
+    return snapshot
+
+
+def test_filters_combine(snapshot):
+    """
+    GIVEN a snapshot of four products
+    WHEN filtering by category, price range, stock and rating together
+    THEN only the products passing every filter are returned, cheapest first
+    """
+    total, ids, _ = snapshot.search(categories=["Laptop", "Phone"],
+                                    price_ranges=[(None, 100000), (300000, None)],
+                                    in_stock=True, min_rating=4)
+    assert total == 2
+    assert ids == [1, 4]
+
+
+def test_facets_ignore_their_own_filter(snapshot):
+    """
+    GIVEN a category filter
+    WHEN facets are computed
+    THEN category counts cover every category while the price histogram
+        only counts the selected category
+    """
+    _, _, facets = snapshot.search(categories=["Phone"])
+    assert facets["categories"] == {"Laptop": 2, "Phone": 2}
+    assert [bucket["count"] for bucket in facets["price"]] == [1, 0, 1, 0, 0, 0]
+    assert facets["in_stock"] == 1
+
+
+def test_incremental_updates(snapshot):
+    snapshot.upsert(5, 10000, 1, "Tablet", None)
+    snapshot.update_column("quantity", {2: 5})
+    snapshot.remove(3)
+    total, ids, facets = snapshot.search(in_stock=True, sort="-price")
+    assert total == 4
+    assert ids == [4, 2, 1, 5]
+    assert facets["categories"] == {"Laptop": 1, "Phone": 2, "Tablet": 1}
+
+
+@pytest.fixture
+def loads(database, monkeypatch):
+    """A fresh module snapshot, recording its full and column loads."""
+    fresh = CatalogSnapshot()
+    monkeypatch.setattr(snapshot_module, "catalog_snapshot", fresh)
+    calls = []
+    for method in ("build", "refresh_columns"):
+        original = getattr(fresh, method)
+        monkeypatch.setattr(fresh, method, lambda *args, method=method, original=original:
+                            calls.append(method) or original(*args))
+    return calls
+
+
+def test_own_reviews_and_orders_are_patched_in(loads, make_product):
+    """
+    GIVEN a snapshot built by this worker
+    WHEN this worker records a review and an order
+    THEN the snapshot follows without loading the table again
+    """
+    product = make_product(quantity=5)
+    ensure_catalog_snapshot()
+
+    Product.apply_rating(product.id, 4)
+    Product.query.filter_by(id=product.id).update({Product.quantity: 0})
+    db.session.commit()
+    signals.review_added.send(app, product_id=product.id, rating=4)
+    signals.order_placed.send(app, quantities={product.id: 5})
+
+    total, _, facets = ensure_catalog_snapshot().search(min_rating=4)
+    assert total == 1 and facets["in_stock"] == 0
+    assert loads == ["build"]
+
+
+def test_other_workers_orders_refresh_columns_only(loads, make_product, other_worker):
+    """
+    GIVEN a snapshot built by this worker
+    WHEN another worker sells out a product, then adds a product
+    THEN the first re-reads the stock column, the second rebuilds
+    """
+    product = make_product(quantity=5)
+    ensure_catalog_snapshot()
+
+    Product.query.filter_by(id=product.id).update({Product.quantity: 0})
+    db.session.commit()
+    other_worker(CATALOG)
+    assert ensure_catalog_snapshot().search(in_stock=True)[0] == 0
+    assert loads == ["build", "refresh_columns"]
+
+    make_product()
+    other_worker(CATALOG, PRODUCTS)
+    assert ensure_catalog_snapshot().search()[0] == 2
+    assert loads == ["build", "refresh_columns", "build"]
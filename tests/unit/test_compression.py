@@ -0,0 +1,51 @@
+import gzip
+
+from src import app
+from src.helpers.compression import compress_response
+
+CONFIG = {"COMPRESS_MIN_SIZE": 100, "COMPRESS_LEVEL": 6}
+
+
+def _response(body, mimetype="application/json"):
+    return app.response_class(body, mimetype=mimetype)
+
+
+def test_large_json_is_gzipped_with_weak_etag():
+    """
+    GIVEN a JSON response above the size threshold with a strong ETag
+    WHEN the client accepts gzip
+    THEN the body is gzipped, Vary is set and the ETag becomes weak
+    """
+    body = b'{"products": [' + b'{"id": 1},' * 50 + b'{"id": 2}]}'
+    with app.test_request_context(headers={"Accept-Encoding": "gzip"}):
+        response = _response(body)
+        response.set_etag("1-abc")
+        response = compress_response(response, CONFIG)
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in response.vary
+    assert response.get_etag() == ("1-abc", True)
+    assert gzip.decompress(response.get_data()) == body
+
+
+def test_small_images_and_unaccepted_are_left_alone():
+    with app.test_request_context(headers={"Accept-Encoding": "gzip"}):
+        assert "Content-Encoding" not in compress_response(_response(b"{}"), CONFIG).headers
+        image = compress_response(_response(b"x" * 500, "image/webp"), CONFIG)
+        assert "Content-Encoding" not in image.headers
+    with app.test_request_context():
+        assert "Content-Encoding" not in compress_response(_response(b"x" * 500), CONFIG).headers
+
+
+def test_streamed_response_is_compressed_chunk_by_chunk():
+    """
+    GIVEN a response streamed from a generator
+    WHEN it is compressed
+    THEN each chunk is flushed as it is produced and the whole decompresses
+    """
+    chunks = ["[", "1," * 100, "2]"]
+    with app.test_request_context(headers={"Accept-Encoding": "gzip"}):
+        response = compress_response(_response(iter(chunks)), CONFIG)
+    assert "Content-Length" not in response.headers
+    parts = list(response.response)
+    assert len(parts) == len(chunks) + 1
+    assert gzip.decompress(b"".join(parts)) == "".join(chunks).encode()
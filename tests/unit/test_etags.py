@@ -0,0 +1,151 @@
+from datetime import timedelta
+
+import pytest
+
+from src import app, db
+from src.helpers import etags, signals
+from src.helpers.etags import (CATALOG, PRODUCTS, bump_version, current_version,
+                               up_to_date)
+from src.helpers.shelves import ShelfEngine
+from src.models import CatalogVersion, Product
+
+HOME = "/api/v1/products/"
+
+
+@pytest.fixture
+def client(database, make_product, monkeypatch):
+    # a shelf engine of this test's own, the module one may hold an
+    # earlier test's catalog at the same version
+    monkeypatch.setattr("src.products.shelves", ShelfEngine())
+    make_product(product_name="First phone")
+    return app.test_client()
+
+
+def test_matching_etag_gets_304(client):
+    """
+    GIVEN a cached catalog response
+    WHEN it is revalidated with its ETag
+    THEN the answer is 304 with the same ETag and no body
+    """
+    response = client.get(HOME)
+    assert response.status_code == 200
+    etag, _ = response.get_etag()
+
+    revalidated = client.get(HOME, headers={"If-None-Match": f'"{etag}"'})
+
+    assert revalidated.status_code == 304
+    assert revalidated.get_etag() == (etag, False)
+    assert revalidated.data == b""
+
+
+def test_if_modified_since(client):
+    """
+    GIVEN a cached catalog response
+    WHEN it is revalidated with its Last-Modified, or an earlier time
+    THEN the first gets 304 and the second the full response
+    """
+    last_modified = client.get(HOME).last_modified
+
+    assert client.get(HOME, headers={
+        "If-Modified-Since": last_modified.strftime("%a, %d %b %Y %H:%M:%S GMT")
+    }).status_code == 304
+    earlier = last_modified - timedelta(seconds=1)
+    assert client.get(HOME, headers={
+        "If-Modified-Since": earlier.strftime("%a, %d %b %Y %H:%M:%S GMT")
+    }).status_code == 200
+
+
+def test_product_saved_bumps_etag_and_body(client, make_product):
+    """
+    GIVEN a cached catalog response
+    WHEN a product is saved
+    THEN both versions move and revalidating returns the new body
+    """
+    response = client.get(HOME)
+    etag, _ = response.get_etag()
+    catalog, products = current_version(CATALOG)[0], current_version(PRODUCTS)[0]
+
+    product = make_product(product_name="Second phone")
+    signals.product_saved.send(app, product=product)
+
+    assert current_version(CATALOG)[0] == catalog + 1
+    assert current_version(PRODUCTS)[0] == products + 1
+    revalidated = client.get(HOME, headers={"If-None-Match": f'"{etag}"'})
+    assert revalidated.status_code == 200
+    assert revalidated.get_etag()[0] != etag
+    assert b"Second phone" in revalidated.data
+
+
+def test_write_from_another_worker_rebuilds_cached_body(client, other_worker):
+    """
+    GIVEN shelves built by this worker
+    WHEN another worker renames a product and bumps the version, so no
+        signal reaches this one
+    THEN the next response is rebuilt from the database
+    """
+    assert b"First phone" in client.get(HOME).data
+
+    Product.query.update({Product.product_name: "Renamed phone"})
+    db.session.commit()
+    other_worker()
+
+    assert b"Renamed phone" in client.get(HOME).data
+
+
+def test_orders_and_reviews_share_one_delayed_bump(database, monkeypatch):
+    """
+    GIVEN a CATALOG_VERSION_TTL
+    WHEN several orders and reviews land within it
+    THEN the catalog version is bumped once, after the TTL
+    """
+    monkeypatch.setitem(app.config, "CATALOG_VERSION_TTL", 0.05)
+    bump_version()
+
+    signals.order_placed.send(app, quantities={1: 1})
+    pending = etags._pending_bump
+    signals.review_added.send(app, product_id=1, rating=5)
+    signals.order_placed.send(app, quantities={1: 2})
+    assert etags._pending_bump is pending
+    pending.join()
+
+    db.session.expire_all()
+    assert CatalogVersion.query.get(CATALOG).version == 2
+    assert CatalogVersion.query.get(PRODUCTS) is None
+
+
+def test_up_to_date_skips_only_this_workers_bumps(database, other_worker):
+    """
+    GIVEN a cache built at some products version
+    WHEN this worker bumps the version, then another worker does
+    THEN the cache is current after the first and stale after the second
+    """
+    bump_version((PRODUCTS,))
+    built, _ = current_version(PRODUCTS)
+    assert not up_to_date(PRODUCTS, None, built)
+
+    bump_version((CATALOG, PRODUCTS))
+    assert up_to_date(PRODUCTS, built, current_version(PRODUCTS)[0])
+
+    other_worker(PRODUCTS)
+    assert not up_to_date(PRODUCTS, built, current_version(PRODUCTS)[0])
+
+
+def test_version_moves_after_the_other_handlers(database, make_product):
+    """
+    GIVEN a cache handler on product_saved
+    WHEN the signal is sent
+    THEN the handler runs before the catalog version moves
+    """
+    product = make_product()
+    seen = []
+
+    def handler(sender, **extra):
+        seen.append(current_version(PRODUCTS)[0])
+    signals.product_saved.connect(handler)
+    try:
+        signals.product_saved.send(app, product=product)
+    finally:
+        signals.product_saved.disconnect(handler)
+
+    assert seen == [0]
+    assert current_version(PRODUCTS)[0] == 1
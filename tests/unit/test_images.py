@@ -0,0 +1,137 @@
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from PIL import Image
+
+from src import app, db
+from src.helpers import images
+from src.helpers.auth_tokens import encode_auth_token
+from src.helpers.images import FORMATS, VARIANTS, image_urls, render_variants, store_image
+
+
+def test_render_variants_writes_every_size_and_format(tmp_path):
+    """
+    GIVEN a transparent PNG larger than the biggest variant
+    WHEN its variants are rendered
+    THEN every variant fits its size, keeps the aspect ratio and exists
+        as WebP and JPEG
+    """
+    data = io.BytesIO()
+    Image.new("RGBA", (1600, 800), (10, 20, 30, 100)).save(data, "PNG")
+    written = render_variants(data.getvalue(), str(tmp_path))
+
+    assert len(written) == len(VARIANTS) * len(FORMATS)
+    for variant, size in VARIANTS.items():
+        with Image.open(tmp_path / f"{variant}.jpeg") as image:
+            assert image.size == (size, size // 2)
+            assert image.format == "JPEG"
+        with Image.open(tmp_path / f"{variant}.webp") as image:
+            assert image.format == "WEBP"
+    assert render_variants(data.getvalue(), str(tmp_path)) == []
+
+
+def test_store_image_rejects_non_images():
+    with pytest.raises(ValueError):
+        store_image(b"not an image")
+
+
+def test_image_urls():
+    urls = image_urls("a" * 32)
+    assert urls["thumb"]["webp"] == f"/api/v1/images/{'a' * 32}/thumb.webp"
+
+
+@pytest.fixture
+def image_store(database, tmp_path, monkeypatch):
+    """Images stored under tmp_path, their variants rendered on a thread pool."""
+    monkeypatch.setitem(app.config, "IMAGE_ROOT", str(tmp_path))
+    pool = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(images, "_executor", lambda: pool)
+    yield pool
+    pool.shutdown()
+
+
+def png(size=(400, 200)):
+    data = io.BytesIO()
+    Image.new("RGB", size, (200, 30, 30)).save(data, "PNG")
+    return data.getvalue()
+
+
+def upload(product, data, headers):
+    return app.test_client().post(f"/api/v1/admin/product/{product.id}/image/",
+                                  headers=headers,
+                                  data={"image": (io.BytesIO(data), "image.png")})
+
+
+def test_uploaded_image_is_served_as_variants(image_store, make_product, admin_headers):
+    """
+    GIVEN a product
+    WHEN an admin uploads a PNG for it and its variants are rendered
+    THEN the product points at the medium JPEG, and every variant is served
+        with its content type as a public, immutable, long-lived resource
+    """
+    product = make_product()
+
+    response = upload(product, png(), admin_headers)
+
+    assert response.status_code == 201
+    data = response.json["data"]
+    db.session.expire_all()
+    assert product.image_id == data["image_id"]
+    assert product.img_url == data["images"]["medium"]["jpeg"]
+    image_store.shutdown(wait=True)
+
+    client = app.test_client()
+    for extension, (_, mimetype, _) in FORMATS.items():
+        response = client.get(data["images"]["thumb"][extension])
+        assert response.status_code == 200
+        assert response.mimetype == mimetype
+        assert response.cache_control.public and response.cache_control.immutable
+        assert response.cache_control.max_age == app.config["IMAGE_MAX_AGE"]
+        with Image.open(io.BytesIO(response.data)) as image:
+            assert max(image.size) == VARIANTS["thumb"]
+
+
+def test_upload_rejects_non_images_and_oversized_files(image_store, make_product,
+                                                       admin_headers, monkeypatch):
+    """
+    GIVEN a product
+    WHEN the upload is missing, not an image, or larger than IMAGE_MAX_BYTES
+    THEN it is rejected with 400, 400 and 413, and the product is unchanged
+    """
+    product = make_product()
+    monkeypatch.setitem(app.config, "IMAGE_MAX_BYTES", 1024)
+
+    assert app.test_client().post(f"/api/v1/admin/product/{product.id}/image/",
+                                  headers=admin_headers).status_code == 400
+    assert upload(product, b"not an image", admin_headers).status_code == 400
+    assert upload(product, png((1000, 1000)) + b"\0" * 1024, admin_headers).status_code == 413
+    db.session.expire_all()
+    assert product.image_id is None
+
+
+def test_upload_is_admin_only(image_store, make_product, customer, admin_headers):
+    product = make_product()
+    headers = {"Authorization": f"Bearer {encode_auth_token(customer.id)}"}
+    assert upload(product, png(), headers).status_code == 403
+
+
+def test_missing_variants_are_not_found(image_store):
+    """
+    GIVEN an image still being processed and one never uploaded
+    WHEN their variants, or unknown variants and formats, are asked for
+    THEN each gets a 404
+    """
+    digest = "a" * 32
+    os.makedirs(images.image_dir(digest))
+    open(os.path.join(images.image_dir(digest), "original"), "wb").close()
+    client = app.test_client()
+
+    response = client.get(f"/api/v1/images/{digest}/thumb.webp")
+    assert response.status_code == 404
+    assert response.json["error"] == "Image is still being processed"
+    assert client.get(f"/api/v1/images/{'b' * 32}/thumb.webp").status_code == 404
+    assert client.get(f"/api/v1/images/{digest}/huge.webp").status_code == 404
+    assert client.get(f"/api/v1/images/{digest}/thumb.gif").status_code == 404
+    assert client.get("/api/v1/images/not-a-digest/thumb.webp").status_code == 404
@@ -0,0 +1,80 @@
+import pytest
+
+from src import db
+from src.helpers import inventory
+from src.helpers.inventory import apply_decrements, validate_cart
+from src.models import Product
+
+
+def test_validate_cart_reports_short_and_missing_lines():
+    """
+    GIVEN a cart and the stock of its products
+    WHEN the cart is validated
+    THEN only lines asking for more than is left, or for unknown
+        products, are reported
+    """
+    stock = {1: 5, 2: 0, 3: 10}
+    cart = {1: 5, 2: 1, 3: 11, 4: 1}
+    assert validate_cart(cart, stock) == [
+        {"product_id": 2, "requested": 1, "available": 0},
+        {"product_id": 3, "requested": 11, "available": 10},
+        {"product_id": 4, "requested": 1, "available": None},
+    ]
+    assert validate_cart({1: 1}, stock) == []
+
+
+@pytest.fixture(params=["update_returning", "per_row"])
+def decrements(request, database, monkeypatch):
+    """apply_decrements, once with the single statement and once with its fallback"""
+    if request.param == "per_row":
+        monkeypatch.setattr(inventory, "_supports_update_returning", lambda: False)
+    return apply_decrements
+
+
+def stock(*products):
+    db.session.expire_all()
+    return [Product.query.get(product.id).quantity for product in products]
+
+
+def test_apply_decrements_takes_sold_quantities(decrements, make_product):
+    first, second = make_product(quantity=5), make_product(quantity=3)
+
+    assert decrements({first.id: 2, second.id: 3}) == []
+    db.session.commit()
+
+    assert stock(first, second) == [3, 0]
+
+
+def test_apply_decrements_never_oversells(decrements, make_product):
+    """
+    GIVEN a product with 2 left
+    WHEN 3 are taken off
+    THEN the stock is left alone and the line is reported
+    """
+    product = make_product(quantity=2)
+
+    assert decrements({product.id: 3}) == [
+        {"product_id": product.id, "requested": 3, "available": 2}]
+    db.session.commit()
+
+    assert stock(product) == [2]
+
+
+def test_apply_decrements_mixed_cart(decrements, make_product):
+    """
+    GIVEN a cart with a line in stock, a short line, a missing product and
+        a zero quantity
+    WHEN it is applied
+    THEN only the line in stock is taken off, the short and missing ones
+        are reported
+    """
+    in_stock, short, untouched = (make_product(quantity=5), make_product(quantity=1),
+                                  make_product(quantity=4))
+    missing = untouched.id + 1
+
+    assert decrements({in_stock.id: 5, short.id: 2, missing: 1, untouched.id: 0}) == [
+        {"product_id": short.id, "requested": 2, "available": 1},
+        {"product_id": missing, "requested": 1, "available": None}]
+    db.session.commit()
+
+    assert stock(in_stock, short, untouched) == [0, 1, 4]
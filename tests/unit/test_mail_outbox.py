@@ -0,0 +1,106 @@
+import socketserver
+import threading
+
+from flask_mail import Mail, Message
+
+from src import app
+from src.helpers import mail_outbox
+from src.helpers.mail_outbox import Mailer, RateLimiter
+
+
+class SMTPStandIn(socketserver.ThreadingTCPServer):
+    """Just enough of an SMTP server to accept mail and record it."""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), SMTPHandler)
+        self.connections = 0
+        self.messages = []
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode("ascii") + b"\r\n")
+
+    def handle(self):
+        self.server.connections += 1
+        self.reply("220 stand-in ready")
+        for line in self.rfile:
+            command = line.decode("ascii").strip().upper()
+            if command.startswith(("EHLO", "HELO")):
+                self.reply("250 stand-in")
+            elif command == "DATA":
+                self.reply("354 go ahead")
+                data = b""
+                for data_line in self.rfile:
+                    if data_line == b".\r\n":
+                        break
+                    data += data_line
+                self.server.messages.append(data)
+                self.reply("250 queued")
+            elif command == "QUIT":
+                self.reply("221 bye")
+                return
+            else:  # MAIL, RCPT, RSET, NOOP
+                self.reply("250 ok")
+
+
+def test_mailer_reuses_its_connection():
+    """
+    GIVEN a Mailer pointed at a local SMTP server
+    WHEN it sends several messages
+    THEN all of them go over one connection, which is closed on close()
+    """
+    server = SMTPStandIn()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    state = Mail().init_mail({"MAIL_SERVER": "127.0.0.1", "MAIL_PORT": server.server_address[1],
+                              "MAIL_USE_SSL": False, "MAIL_USE_TLS": False,
+                              "MAIL_SUPPRESS_SEND": False})
+    mailer = Mailer(state)
+    try:
+        with app.app_context():
+            for number in range(3):
+                mailer.send(Message(subject=f"receipt {number}", recipients=["a@example.com"],
+                                    body="thanks", sender="shop@example.com"))
+        mailer.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert server.connections == 1
+    assert len(server.messages) == 3
+    assert b"receipt 2" in server.messages[2]
+
+
+def test_rate_limiter_spaces_out_sends():
+    """
+    GIVEN a token bucket of 2 sends per second with a burst of 2
+    WHEN 4 sends are made at once
+    THEN the first 2 go straight away and the others wait half a second each
+    """
+    now = [0.0]
+    waits = []
+
+    def sleep(seconds):
+        waits.append(seconds)
+        now[0] += seconds
+
+    limiter = RateLimiter(2, burst=2, clock=lambda: now[0], sleep=sleep)
+    for _ in range(4):
+        limiter.acquire()
+    assert waits == [0.5, 0.5]
+
+
+def test_workers_start_with_the_app(monkeypatch):
+    """
+    GIVEN the serving process
+    WHEN it handles its first request
+    THEN the mail workers are started, without waiting for the next mail
+    """
+    started = []
+    monkeypatch.setattr(mail_outbox, "start_workers", lambda: started.append(True))
+
+    assert mail_outbox._start_on_boot in app.before_first_request_funcs
+    mail_outbox._start_on_boot()
+    assert started == [True]
@@ -0,0 +1,41 @@
+from datetime import datetime
+
+import pytest
+from werkzeug.exceptions import BadRequest
+
+from src.helpers.pagination import decode_cursor, encode_cursor, keyset_filter
+from src.models import Product
+
+
+def test_cursor_round_trip():
+    """
+    GIVEN the sort key of the last row of a page
+    WHEN it is encoded as a cursor and decoded again
+    THEN the same values come back
+    """
+    cursor = encode_cursor([4.5, 17])
+    assert "=" not in cursor
+    assert decode_cursor(cursor, 2) == [4.5, 17]
+    assert decode_cursor("", 2) is None
+
+
+def test_cursor_round_trips_datetimes():
+    last_review = [datetime(2022, 10, 23, 10, 38, 38, 939599), 31]
+    assert decode_cursor(encode_cursor(last_review), 2) == last_review
+
+
+@pytest.mark.parametrize("cursor", ["not-a-cursor", encode_cursor([1])])
+def test_invalid_cursor_is_rejected(cursor):
+    with pytest.raises(BadRequest):
+        decode_cursor(cursor, 2)
+
+
+def test_keyset_filter_uses_row_values_for_one_direction():
+    clause = keyset_filter([(Product.price, False), (Product.id, False)], [100, 7])
+    assert str(clause) == "(products.price, products.id) > (:param_1, :param_2)"
+
+
+def test_keyset_filter_expands_mixed_directions():
+    clause = keyset_filter([(Product.price, True), (Product.id, False)], [100, 7])
+    assert str(clause) == ("products.price < :price_1 OR "
+                           "products.price = :price_2 AND products.id > :id_1")
@@ -0,0 +1,226 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+import pytest
+import stripe
+
+from src.helpers.payment_gateway import (CLOSED, HALF_OPEN, OPEN, CircuitBreaker,
+                                         CircuitOpen, PaymentGateway)
+
+
+class FakeStripe(ThreadingHTTPServer):
+    """
+    Local stand-in for the Stripe API: replies to each request with the
+    next (status, delay) in replies, then with 200s.
+    """
+    daemon_threads = True
+
+    def __init__(self, replies=()):
+        super().__init__(("127.0.0.1", 0), FakeStripeHandler)
+        self.replies = list(replies)
+        self.requests = []
+        self.forms = []
+        self.connections = set()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+
+
+class FakeStripeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        form = parse_qs(self.rfile.read(int(self.headers["Content-Length"])).decode("ascii"))
+        self.server.connections.add(self.client_address)
+        self.server.requests.append((self.path, self.headers.get("Idempotency-Key")))
+        self.server.forms.append(form)
+        status, delay = self.server.replies.pop(0) if self.server.replies else (200, 0)
+        time.sleep(delay)
+        if status == 200:
+            body = {"id": "cs_test_1", "object": "checkout.session",
+                    "url": "https://checkout.stripe.com/pay/cs_test_1"}
+        else:
+            body = {"error": {"type": "api_error", "message": "Stripe is having a bad day"}}
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def make_gateway(server, **kwargs):
+    kwargs.setdefault("sleep", lambda seconds: None)
+    return PaymentGateway("sk_test_fake", api_base=server.url, **kwargs)
+
+
+def test_gateway_reuses_connections():
+    """
+    GIVEN a gateway pointed at a fake Stripe server
+    WHEN it creates several checkout sessions
+    THEN they are parsed as Stripe objects and share one kept-alive connection
+    """
+    with FakeStripe() as server:
+        gateway = make_gateway(server)
+        for _ in range(3):
+            session = gateway.create_checkout_session(mode="payment", line_items=[])
+    assert session.url == "https://checkout.stripe.com/pay/cs_test_1"
+    assert [path for path, _ in server.requests] == ["/v1/checkout/sessions"] * 3
+    assert len(server.connections) == 1
+    assert gateway.stats()["latency"]["checkout_session_create"]["count"] == 3
+
+
+def test_gateway_creates_prices():
+    """
+    GIVEN a gateway pointed at a fake Stripe server
+    WHEN a price is created
+    THEN it is posted to the prices endpoint with its parameters form encoded
+    """
+    with FakeStripe() as server:
+        gateway = make_gateway(server)
+        gateway.create_price(product="prod_1", currency="usd", unit_amount=672,
+                             lookup_key="product-3", transfer_lookup_key=True)
+    assert server.requests[0][0] == "/v1/prices"
+    assert server.forms[0]["unit_amount"] == ["672"]
+    assert server.forms[0]["lookup_key"] == ["product-3"]
+
+
+def test_gateway_retries_with_the_same_idempotency_key():
+    """
+    GIVEN a fake Stripe server failing twice with 500 before succeeding
+    WHEN a checkout session is created
+    THEN the gateway retries and every attempt carries the same idempotency key
+    """
+    with FakeStripe([(500, 0), (500, 0)]) as server:
+        gateway = make_gateway(server, max_retries=2)
+        assert gateway.create_checkout_session(mode="payment").id == "cs_test_1"
+    keys = {key for _, key in server.requests}
+    assert len(server.requests) == 3 and len(keys) == 1 and None not in keys
+    assert gateway.stats()["checkout_session_create.retries"] == 2
+
+
+def test_gateway_times_out_slow_replies():
+    """
+    GIVEN a fake Stripe server slower than the read timeout
+    WHEN a checkout session is created without retries
+    THEN the call fails with a connection error instead of hanging
+    """
+    with FakeStripe([(200, 1)]) as server:
+        gateway = make_gateway(server, read_timeout=0.2, max_retries=0)
+        with pytest.raises(stripe.error.APIConnectionError):
+            gateway.create_checkout_session(mode="payment")
+
+
+def test_gateway_does_not_retry_past_its_total_timeout():
+    """
+    GIVEN a fake Stripe server slower than the read timeout
+    WHEN a checkout session is created with retries left, but no time for
+        another attempt within the total timeout
+    THEN the timed out attempt is not retried
+    """
+    with FakeStripe([(200, 1)] * 3) as server:
+        gateway = make_gateway(server, read_timeout=0.2, total_timeout=0.3, max_retries=2)
+        with pytest.raises(stripe.error.APIConnectionError):
+            gateway.create_checkout_session(mode="payment")
+    assert len(server.requests) == 1
+    assert "checkout_session_create.retries" not in gateway.stats()
+
+
+def test_breaker_counts_each_failed_attempt():
+    """
+    GIVEN a breaker opening after 2 failures and a gateway retrying twice
+    WHEN a call keeps failing
+    THEN the breaker opens after its second attempt, which isn't retried,
+        and the next call is refused
+    """
+    with FakeStripe([(500, 0)] * 5) as server:
+        gateway = make_gateway(server, max_retries=2, breaker=CircuitBreaker(2, 30))
+        with pytest.raises(stripe.error.APIError):
+            gateway.create_checkout_session(mode="payment")
+        assert gateway.stats()["circuit"] == OPEN
+        with pytest.raises(CircuitOpen):
+            gateway.create_checkout_session(mode="payment")
+    assert len(server.requests) == 2
+
+
+def test_gateway_fails_fast_once_the_circuit_opens():
+    """
+    GIVEN a fake Stripe server that keeps failing
+    WHEN calls fail as many times as the breaker's threshold
+    THEN the next call is refused without reaching the server
+    """
+    with FakeStripe([(500, 0)] * 5) as server:
+        gateway = make_gateway(server, max_retries=0, breaker=CircuitBreaker(2, 30))
+        for _ in range(2):
+            with pytest.raises(stripe.error.APIError):
+                gateway.create_checkout_session(mode="payment")
+        with pytest.raises(CircuitOpen):
+            gateway.create_checkout_session(mode="payment")
+    assert len(server.requests) == 2
+    assert gateway.stats()["circuit"] == OPEN
+
+
+def test_circuit_breaker_lets_one_trial_through_after_the_timeout():
+    """
+    GIVEN an open circuit breaker
+    WHEN its reset timeout has passed
+    THEN a single trial call is allowed, and its outcome closes or reopens it
+    """
+    now = [0.0]
+    breaker = CircuitBreaker(1, 10, clock=lambda: now[0])
+    breaker.record_failure()
+    assert breaker.state == OPEN and not breaker.allow()
+    now[0] = 10
+    assert breaker.allow() and not breaker.allow()
+    assert breaker.state == HALF_OPEN
+    breaker.record_failure()
+    assert breaker.state == OPEN and not breaker.allow()
+    now[0] = 20
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CLOSED and breaker.allow()
+
+
+def test_unexpected_error_settles_the_trial_call(monkeypatch):
+    """
+    GIVEN a circuit past its reset timeout
+    WHEN its trial call fails with an error other than a Stripe one
+    THEN the circuit reopens, and lets another trial through after the
+        next timeout rather than refusing calls for good
+    """
+    now = [0.0]
+    breaker = CircuitBreaker(1, 10, clock=lambda: now[0])
+    breaker.record_failure()
+    now[0] = 10
+    with FakeStripe() as server:
+        gateway = make_gateway(server, breaker=breaker)
+
+        def fail(*args, **kwargs):
+            raise RuntimeError("unexpected")
+        with monkeypatch.context() as patched:
+            patched.setattr("stripe.api_requestor.APIRequestor.request", fail)
+            with pytest.raises(RuntimeError):
+                gateway.create_checkout_session(mode="payment")
+        assert breaker.state == OPEN
+        with pytest.raises(CircuitOpen):
+            gateway.create_checkout_session(mode="payment")
+
+        now[0] = 20
+        assert gateway.create_checkout_session(mode="payment").id == "cs_test_1"
+    assert breaker.state == CLOSED
+    assert gateway.stats()["checkout_session_create.errors"] == 1
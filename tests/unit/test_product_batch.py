@@ -0,0 +1,63 @@
+from src import app
+from src.helpers.product_loader import MAX_BATCH
+
+
+def fetch(ids, **params):
+    return app.test_client().get("/api/v1/products/batch/",
+                                 query_string={"ids": ids, **params})
+
+
+def test_batch_returns_each_product_under_its_id(database, make_product):
+    """
+    GIVEN three products
+    WHEN they are fetched in one batch, out of order, with a duplicate and
+        ids that don't exist
+    THEN each product is returned once under its own id, and the unknown
+        ids are listed as missing, in ascending order
+    """
+    products = [make_product(product_name=f"Product {number}", price=100 * number)
+                for number in range(1, 4)]
+    first, second, third = products
+
+    response = fetch(f"{third.id},999,{first.id},{third.id},{second.id},998")
+
+    assert response.status_code == 200
+    data = response.json["data"]
+    assert set(data["products"]) == {str(product.id) for product in products}
+    for product in products:
+        assert data["products"][str(product.id)]["product_name"] == product.product_name
+        assert data["products"][str(product.id)]["price"] == product.price
+    assert data["missing"] == [998, 999]
+
+
+def test_batch_projects_the_requested_fields(database, make_product):
+    """
+    GIVEN a product
+    WHEN it is fetched with a list of fields, known or not
+    THEN only those fields and its id are returned, and unknown ones are
+        rejected with 400
+    """
+    product = make_product(product_name="Phone", price=500)
+
+    response = fetch(str(product.id), fields="product_name,price")
+    assert response.json["data"]["products"] == {
+        str(product.id): {"id": product.id, "product_name": "Phone", "price": 500}}
+    assert fetch(str(product.id), fields="product_name,password").status_code == 400
+
+
+def test_batch_caps_the_number_of_ids(database, make_product):
+    """
+    GIVEN the batch size limit
+    WHEN more ids are sent, even if they repeat a single id
+    THEN the request is rejected with 400, while a full batch is served
+    """
+    product = make_product()
+
+    assert fetch(",".join([str(product.id)] * MAX_BATCH)).status_code == 200
+    assert fetch(",".join([str(product.id)] * (MAX_BATCH + 1))).status_code == 400
+    assert fetch(",".join(str(number) for number in range(MAX_BATCH + 1))).status_code == 400
+
+
+def test_batch_rejects_malformed_ids(database):
+    assert fetch("").status_code == 400
+    assert fetch("1,two").status_code == 400
@@ -0,0 +1,151 @@
+from datetime import datetime, timedelta
+
+from src import app
+from src.helpers.auth_tokens import encode_auth_token
+from src.models import Customer, Order, OrderDetails, Product, Reviews
+
+
+def place_order(database, product, customer, quantity=1):
+    details = OrderDetails(customer_id=customer.id, to_street="1 Main St", to_city="London",
+                           zip="12345", order_date=datetime(2022, 5, 1))
+    database.session.add(Order(product_id=product.id, quantity=quantity, order_name=details))
+    database.session.commit()
+
+
+def add_reviews(database, product, count):
+    """Reviews by as many customers, rated 1 to 5 in turn, one a day, the last one newest."""
+    for number in range(count):
+        rating = number % 5 + 1
+        reviewer = Customer(first_name="Reviewer", last_name=str(number), street="1 Main St",
+                            city="London", zip="12345", phone="0700000000",
+                            mail=f"reviewer{number}@example.com", password="x", role=2)
+        database.session.add(reviewer)
+        database.session.flush()
+        database.session.add(Reviews(customer_id=reviewer.id, product_id=product.id,
+                                     review=f"Review {number}", rating=rating,
+                                     date=datetime(2022, 5, 1) + timedelta(days=number)))
+        Product.apply_rating(product.id, rating)
+    database.session.commit()
+
+
+def pages(client, url, **headers):
+    """The item lists of every page of url, following next_cursor."""
+    key = "reviews" if "/reviews/" in url else "orders"
+    result, cursor = [], None
+    while True:
+        response = client.get(url, query_string={"limit": 5, "cursor": cursor}, **headers)
+        assert response.status_code == 200
+        assert response.json["data"]["per_page"] == 5
+        result.append(response.json["data"][key])
+        cursor = response.json["data"]["next_cursor"]
+        if cursor is None:
+            return result
+
+
+def test_product_detail(database, make_product):
+    """
+    GIVEN a product with more reviews than the detail page shows
+    WHEN its detail is fetched
+    THEN it holds the product's public fields, its rating summary and its
+        newest reviews, with a cursor to the rest
+    """
+    product = make_product(product_name="Pixel")
+    add_reviews(database, product, 12)
+
+    response = app.test_client().get(f"/api/v1/product/{product.id}/")
+
+    assert response.status_code == 200
+    data = response.json["data"]
+    assert set(data["product"]) == set(Product.PUBLIC_FIELDS)
+    assert data["product"]["product_name"] == "Pixel"
+    assert data["average_rating"] == 2.8
+    assert data["rating_summary"]["rating_count"] == 12
+    assert data["rating_summary"]["histogram"] == {"1": 3, "2": 3, "3": 2, "4": 2, "5": 2}
+    assert [review["review"] for review in data["reviews"]] == [
+        f"Review {number}" for number in range(11, 1, -1)]
+    assert data["reviews_next_cursor"] is not None
+
+
+def test_product_reviews_are_paginated_newest_first(database, make_product):
+    """
+    GIVEN a product with 12 reviews
+    WHEN its reviews are paged through 5 at a time
+    THEN they come newest first, each once, over 3 pages
+    """
+    product = make_product()
+    add_reviews(database, product, 12)
+
+    result = pages(app.test_client(), f"/api/v1/product/{product.id}/reviews/")
+
+    assert [len(page) for page in result] == [5, 5, 2]
+    assert [review["review"] for page in result for review in page] == [
+        f"Review {number}" for number in range(11, -1, -1)]
+    assert set(result[0][0]) == {column.name for column in Reviews.__table__.columns}
+
+
+def test_product_orders_are_paginated_newest_first(database, make_product, customer,
+                                                   admin_headers):
+    """
+    GIVEN a product ordered 7 times
+    WHEN an admin pages through its orders 5 at a time
+    THEN they come newest first, each once, over 2 pages
+    """
+    product = make_product()
+    for quantity in range(1, 8):
+        place_order(database, product, customer, quantity)
+
+    result = pages(app.test_client(), f"/api/v1/product/{product.id}/orders/",
+                   headers=admin_headers)
+
+    assert [len(page) for page in result] == [5, 2]
+    assert [order["quantity"] for page in result for order in page] == list(range(7, 0, -1))
+    assert result[0][0]["customer_id"] == customer.id
+
+
+def test_product_sub_resources_of_a_missing_product(database, admin_headers):
+    """
+    GIVEN no product with id 999
+    WHEN its detail, reviews or orders are fetched
+    THEN each is a 404
+    """
+    client = app.test_client()
+    assert client.get("/api/v1/product/999/").status_code == 404
+    assert client.get("/api/v1/product/999/reviews/").status_code == 404
+    assert client.get("/api/v1/product/999/orders/", headers=admin_headers).status_code == 404
+
+
+def test_product_reviews_reject_bad_pagination(database, make_product):
+    """
+    GIVEN a product
+    WHEN its reviews are asked for with a limit below 1 or a forged cursor
+    THEN the request is rejected with 400
+    """
+    product = make_product()
+    client = app.test_client()
+    url = f"/api/v1/product/{product.id}/reviews/"
+    assert client.get(url, query_string={"limit": 0}).status_code == 400
+    assert client.get(url, query_string={"cursor": "not-a-cursor"}).status_code == 400
+
+
+def test_product_orders_are_admin_only_and_never_cached(database, make_product, customer,
+                                                       admin_headers):
+    """
+    GIVEN a product with an order, whose rows carry the customer's address
+    WHEN its orders are fetched anonymously, by a customer and by an admin
+    THEN only the admin gets them, in a response no cache may store
+    """
+    product = make_product()
+    place_order(database, product, customer)
+    client = app.test_client()
+    url = f"/api/v1/product/{product.id}/orders/"
+
+    assert client.get(url).status_code == 401
+    customer_token = encode_auth_token(customer.id)
+    assert client.get(url, headers={"Authorization": f"Bearer {customer_token}"}
+                      ).status_code == 403
+    response = client.get(url, headers=admin_headers)
+
+    assert response.status_code == 200
+    assert response.json["data"]["orders"][0]["to_street"] == "1 Main St"
+    assert response.cache_control.private and response.cache_control.no_store
+    assert response.get_etag() == (None, None)
@@ -0,0 +1,59 @@
+from src import app, db
+from src.models import Customer, Product, Reviews
+
+
+def stats(product_id):
+    db.session.expire_all()
+    product = Product.query.get(product_id)
+    return (product.rating_count, product.rating_sum, product.avg_rating,
+            [getattr(product, f"rating_{star}") for star in range(1, 6)])
+
+
+def test_apply_rating_adds_and_removes_reviews(database, make_product):
+    """
+    GIVEN a product without reviews
+    WHEN reviews are added and one is removed again
+    THEN the count, sum, average and star buckets follow
+    """
+    product = make_product()
+    for rating in (5, 4, 4):
+        Product.apply_rating(product.id, rating)
+    database.session.commit()
+    assert stats(product.id) == (3, 13, 13 / 3, [0, 0, 0, 2, 1])
+
+    Product.apply_rating(product.id, 4, sign=-1)
+    database.session.commit()
+    assert stats(product.id) == (2, 9, 4.5, [0, 0, 0, 1, 1])
+
+    Product.apply_rating(product.id, 4, sign=-1)
+    Product.apply_rating(product.id, 5, sign=-1)
+    database.session.commit()
+    assert stats(product.id) == (0, 0, None, [0, 0, 0, 0, 0])
+
+
+def test_rebuild_rating_stats_matches_incremental(database, make_product, customer):
+    """
+    GIVEN reviews recorded through apply_rating
+    WHEN the stats are wiped and rebuilt from the reviews table
+    THEN the rebuilt stats equal the incremental ones
+    """
+    rated, unrated = make_product(), make_product()
+    other = Customer(first_name="Bob", last_name="B", street="s", city="c", zip="z",
+                     phone="0700000001", mail="bob@example.com", password="x")
+    database.session.add(other)
+    database.session.flush()
+    for reviewer, rating in ((customer, 2), (other, 5)):
+        database.session.add(Reviews(customer_id=reviewer.id, product_id=rated.id,
+                                     review="ok", rating=rating))
+        Product.apply_rating(rated.id, rating)
+    database.session.commit()
+    rated_id, unrated_id = rated.id, unrated.id
+    incremental = stats(rated_id), stats(unrated_id)
+
+    Product.query.update({Product.rating_count: 7, Product.rating_1: 7})
+    database.session.commit()
+    result = app.test_cli_runner().invoke(args=["rebuild-rating-stats"])
+
+    assert "Rebuilt rating stats for 1 products" in result.output
+    assert (stats(rated_id), stats(unrated_id)) == incremental
+    assert incremental[0] == (2, 7, 3.5, [0, 1, 0, 0, 1])
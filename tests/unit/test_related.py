@@ -0,0 +1,140 @@
+from datetime import datetime
+
+import pytest
+
+from src import app
+from src.helpers import related
+from src.helpers.related import JOB_NAME, cooccurrence, refresh_related
+from src.models import JobState, Order, OrderDetails, ProductPair, ProductRelated
+
+
+def test_cooccurrence_counts_baskets_per_product_pair():
+    """
+    GIVEN order lines from three baskets, one listing a product twice
+    WHEN the co-occurrence counts are computed
+    THEN each ordered pair of distinct products counts the baskets holding both
+    """
+    left, right, counts = cooccurrence([1, 1, 1, 2, 2, 2, 3], [5, 6, 7, 5, 6, 6, 5])
+    pairs = dict(zip(zip(left.tolist(), right.tolist()), counts.tolist()))
+    assert pairs == {(5, 6): 2, (6, 5): 2, (5, 7): 1, (7, 5): 1, (6, 7): 1, (7, 6): 1}
+
+
+def test_cooccurrence_of_no_orders_is_empty():
+    left, right, counts = cooccurrence([], [])
+    assert len(left) == len(right) == len(counts) == 0
+
+
+def place_basket(database, customer, products, basket_id=None):
+    details = OrderDetails(id=basket_id, customer_id=customer.id, to_street="1 Main St",
+                           to_city="London", zip="12345", order_date=datetime(2022, 5, 1))
+    database.session.add_all([Order(product_id=product.id, quantity=1, order_name=details)
+                              for product in products])
+    database.session.commit()
+
+
+def related_ids(product):
+    related = ProductRelated.query.get(product.id)
+    return [other_id for other_id, _ in related.related] if related else []
+
+
+@pytest.fixture
+def products(make_product):
+    return [make_product(product_name=f"Product {number}") for number in range(4)]
+
+
+def test_refresh_related_folds_new_baskets_once(database, customer, products):
+    """
+    GIVEN baskets placed before and after a first run
+    WHEN the related products are refreshed each time
+    THEN every basket is counted once, and neighbours rank by count
+    """
+    first, second, third, fourth = products
+    place_basket(database, customer, [first, second, third])
+    place_basket(database, customer, [first, second])
+
+    assert refresh_related() == (2, 3)
+    assert related_ids(first) == [second.id, third.id]
+
+    place_basket(database, customer, [first, fourth])
+    place_basket(database, customer, [first, fourth])
+    place_basket(database, customer, [first, fourth])
+
+    assert refresh_related() == (3, 2)
+    assert related_ids(first) == [fourth.id, second.id, third.id]
+    assert refresh_related() == (0, 0)
+    assert ProductPair.query.get((first.id, second.id)).count == 2
+
+
+def test_refresh_related_folds_baskets_committed_out_of_order(database, customer, products):
+    """
+    GIVEN a basket committed after a basket with a higher id was folded
+    WHEN the related products are refreshed again
+    THEN the late basket is folded in rather than skipped by the watermark
+    """
+    first, second, third, _ = products
+    place_basket(database, customer, [first, second], basket_id=1)
+    place_basket(database, customer, [first, second], basket_id=3)
+    assert refresh_related() == (2, 2)
+
+    place_basket(database, customer, [first, third], basket_id=2)
+
+    assert refresh_related() == (1, 2)
+    assert related_ids(first) == [second.id, third.id]
+    assert JobState.query.get(JOB_NAME).gaps == []
+    assert refresh_related() == (0, 0)
+
+
+def test_refresh_related_forgets_old_gaps(database, customer, products, monkeypatch):
+    """
+    GIVEN an id skipped past, e.g. by a rolled back checkout
+    WHEN no basket shows up with it for GAP_SECONDS
+    THEN it is no longer looked for
+    """
+    first, second, _, _ = products
+    place_basket(database, customer, [first, second], basket_id=1)
+    place_basket(database, customer, [first, second], basket_id=3)
+    refresh_related()
+    assert [basket_id for basket_id, _ in JobState.query.get(JOB_NAME).gaps] == [2]
+
+    monkeypatch.setattr(related, "GAP_SECONDS", -1)
+    refresh_related()
+    assert JobState.query.get(JOB_NAME).gaps == []
+
+
+def test_related_products_endpoint(database, customer, products):
+    """
+    GIVEN refreshed related products
+    WHEN a product's related products are fetched, with and without a limit
+    THEN they come as cards, most often bought together first
+    """
+    first, second, third, _ = products
+    place_basket(database, customer, [first, second, third])
+    place_basket(database, customer, [first, third])
+    refresh_related()
+    client = app.test_client()
+
+    response = client.get(f"/api/v1/product/{first.id}/related/")
+    assert response.status_code == 200
+    assert response.json["data"]["product_id"] == first.id
+    cards = response.json["data"]["products"]
+    assert [card["id"] for card in cards] == [third.id, second.id]
+    assert set(cards[0]) == {"id", "img_url", "product_description", "price"}
+
+    response = client.get(f"/api/v1/product/{first.id}/related/?limit=1")
+    assert [card["id"] for card in response.json["data"]["products"]] == [third.id]
+    response = client.get(f"/api/v1/product/{products[3].id}/related/")
+    assert response.json["data"]["products"] == []
+
+
+def test_related_products_endpoint_rejects_bad_requests(database, products):
+    """
+    GIVEN a product
+    WHEN related products are asked for with a limit below 1, or for a
+        product that doesn't exist
+    THEN the request is rejected with 400, respectively 404
+    """
+    client = app.test_client()
+
+    assert client.get(f"/api/v1/product/{products[0].id}/related/?limit=0").status_code == 400
+    assert client.get(f"/api/v1/product/{products[0].id}/related/?limit=-3").status_code == 400
+    assert client.get("/api/v1/product/999/related/").status_code == 404
@@ -0,0 +1,129 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import func
+
+from src import app, db
+from src.helpers.reservations import (consume, extend, hold, held_quantities, release,
+                                      release_expired, split_stock)
+from src.models import StockReservation, StockShard
+
+
+def test_split_stock_spreads_evenly():
+    """
+    GIVEN a stock level and a shard count
+    WHEN the stock is split over the shards
+    THEN nothing is lost and shards differ by at most one
+    """
+    assert split_stock(10, 4) == [3, 3, 2, 2]
+    assert split_stock(3, 8) == [1, 1, 1, 0, 0, 0, 0, 0]
+    assert split_stock(-2, 2) == [0, 0]
+
+
+def available(product_id):
+    return db.session.query(func.sum(StockShard.available)).filter_by(
+        product_id=product_id).scalar()
+
+
+@pytest.fixture
+def shards(database, monkeypatch):
+    monkeypatch.setitem(app.config, "STOCK_SHARDS", 4)
+    monkeypatch.setitem(app.config, "STOCK_RESERVATIONS", True)
+
+
+def test_hold_takes_and_release_returns_stock(shards, make_product):
+    """
+    GIVEN a product with 10 in stock
+    WHEN a cart holds 3, lowers the hold to 1 and then releases it
+    THEN the shards follow each step and end where they started
+    """
+    product = make_product(quantity=10)
+
+    assert hold("cart", product.id, 3)
+    assert held_quantities("cart") == {product.id: 3}
+    assert available(product.id) == 7
+    assert hold("cart", product.id, 1)
+    assert available(product.id) == 9
+
+    release("cart")
+    assert held_quantities("cart") == {}
+    assert available(product.id) == 10
+
+
+def test_hold_fails_on_insufficient_stock(shards, make_product):
+    """
+    GIVEN a product whose stock is mostly held by another cart
+    WHEN a cart asks for more than is left
+    THEN the hold fails and nothing changes
+    """
+    product = make_product(quantity=10)
+    assert hold("other", product.id, 8)
+
+    assert not hold("cart", product.id, 3)
+    assert held_quantities("cart") == {}
+    assert available(product.id) == 2
+
+
+def test_hold_spans_shards(shards, make_product):
+    """
+    GIVEN 10 in stock split over 4 shards (3, 3, 2, 2)
+    WHEN a cart holds 9
+    THEN the hold is taken from several shards and 1 is left
+    """
+    product = make_product(quantity=10)
+
+    assert hold("cart", product.id, 9)
+
+    assert StockReservation.query.filter_by(cart_id="cart").count() > 1
+    assert held_quantities("cart") == {product.id: 9}
+    assert available(product.id) == 1
+
+
+def test_hold_missing_product(shards, make_product):
+    product = make_product()
+    with pytest.raises(KeyError):
+        hold("cart", product.id + 1, 1)
+    response = app.test_client().post("/api/v1/cart/", json={"prod_id": product.id + 1,
+                                                             "qty": 1})
+    assert response.status_code == 404
+
+
+def test_consume_takes_the_unheld_rest(shards, make_product):
+    """
+    GIVEN a cart holding 3 of one product and 2 of another
+    WHEN 5 of the first and none of the second are sold
+    THEN the holds are gone, 2 more come off the shards and the unsold
+        hold goes back
+    """
+    first, second = make_product(quantity=10), make_product(quantity=10)
+    assert hold("cart", first.id, 3)
+    assert hold("cart", second.id, 2)
+
+    consume("cart", {first.id: 5})
+    db.session.commit()
+
+    assert StockReservation.query.count() == 0
+    assert available(first.id) == 5
+    assert available(second.id) == 10
+
+
+def test_release_expired_and_extend(shards, make_product):
+    """
+    GIVEN two carts' holds that ran out
+    WHEN one cart is extended and the sweep runs
+    THEN only the other cart's hold is released
+    """
+    product = make_product(quantity=10)
+    assert hold("kept", product.id, 2)
+    assert hold("expired", product.id, 1)
+    StockReservation.query.update({StockReservation.expires_at:
+                                   datetime.utcnow() - timedelta(seconds=1)})
+    db.session.commit()
+
+    extend("kept")
+
+    assert release_expired() == 1
+    assert held_quantities("kept") == {product.id: 2}
+    assert held_quantities("expired") == {}
+    assert StockReservation.query.filter_by(cart_id="expired").count() == 0
+    assert available(product.id) == 8
@@ -0,0 +1,13 @@
+from src.helpers.retry import backoff
+
+
+def test_backoff_grows_exponentially_with_jitter():
+    """
+    GIVEN a number of failed attempts
+    WHEN the delay before the next attempt is computed
+    THEN it doubles per attempt, within +-50% jitter, up to the cap
+    """
+    for attempts, delay in ((1, 5), (2, 10), (4, 40)):
+        for _ in range(20):
+            assert delay * 0.5 <= backoff(attempts, 5) <= delay * 1.5
+    assert backoff(30, 5, cap=60) <= 90
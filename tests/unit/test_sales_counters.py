@@ -0,0 +1,99 @@
+from datetime import date, datetime, timedelta
+
+from src import app, db
+from src.commands import refresh_sales_windows
+from src.models import Order, OrderDetails, Product, ProductSalesDaily
+
+
+def counters(product_id):
+    db.session.expire_all()
+    product = Product.query.get(product_id)
+    return product.units_sold, product.units_sold_7d, product.units_sold_30d
+
+
+def record_sales(product_id, sales):
+    today = date.today()
+    for days_ago, quantity in sales:
+        Product.record_sale(product_id, quantity, day=today - timedelta(days=days_ago))
+    db.session.commit()
+
+
+def test_record_sale_bumps_counters_and_daily_bucket(database, make_product):
+    """
+    GIVEN a product without sales
+    WHEN two sales are recorded today
+    THEN every counter and today's bucket hold both
+    """
+    product = make_product()
+    record_sales(product.id, [(0, 2), (0, 3)])
+
+    assert counters(product.id) == (5, 5, 5)
+    bucket = ProductSalesDaily.query.get((product.id, date.today()))
+    assert bucket.units == 5
+
+
+def test_refresh_sales_windows_expires_old_sales(database, make_product):
+    """
+    GIVEN sales today, 10 days ago and 40 days ago
+    WHEN the refresh-sales-windows command runs
+    THEN the 7 day counter keeps today's sales, the 30 day one also the
+        10 day old ones, and the total keeps all of them
+    """
+    product = make_product()
+    product_id = product.id
+    record_sales(product_id, [(0, 1), (10, 2), (40, 4)])
+    assert counters(product_id) == (7, 7, 7)
+
+    result = app.test_cli_runner().invoke(args=["refresh-sales-windows"])
+
+    assert "Refreshed 7 and 30 day sales counters" in result.output
+    assert counters(product_id) == (7, 1, 3)
+
+
+def test_refresh_sales_windows_zeroes_products_without_recent_sales(database, make_product):
+    """
+    GIVEN a product whose only sale aged out of both windows
+    WHEN the windows are refreshed
+    THEN both windowed counters drop to zero
+    """
+    product = make_product()
+    record_sales(product.id, [(40, 4)])
+
+    refresh_sales_windows()
+    db.session.commit()
+
+    assert counters(product.id) == (4, 0, 0)
+
+
+def test_rebuild_sales_stats_matches_incremental(database, make_product, customer):
+    """
+    GIVEN orders whose sales were recorded through record_sale
+    WHEN the counters are wiped and rebuilt from the orders table
+    THEN the rebuilt counters and buckets equal the incremental ones
+    """
+    sold, unsold = make_product(), make_product()
+    sold_id, unsold_id = sold.id, unsold.id
+    today = date.today()
+    for days_ago, quantity in ((0, 1), (10, 2), (40, 4)):
+        day = today - timedelta(days=days_ago)
+        details = OrderDetails(customer_id=customer.id, to_street="1 Main St",
+                               to_city="London", zip="12345",
+                               order_date=datetime.combine(day, datetime.min.time()))
+        db.session.add(Order(product_id=sold_id, quantity=quantity, order_name=details))
+        Product.record_sale(sold_id, quantity, day=day)
+    db.session.commit()
+    refresh_sales_windows()
+    db.session.commit()
+    incremental = counters(sold_id)
+    buckets = sorted((row.day, row.units) for row in ProductSalesDaily.query.all())
+
+    Product.query.update({Product.units_sold: 99, Product.units_sold_7d: 99,
+                          Product.units_sold_30d: 99})
+    ProductSalesDaily.query.delete()
+    db.session.commit()
+    result = app.test_cli_runner().invoke(args=["rebuild-sales-stats"])
+
+    assert "Rebuilt sales stats for 1 products" in result.output
+    assert counters(sold_id) == incremental == (7, 1, 3)
+    assert counters(unsold_id) == (0, 0, 0)
+    assert sorted((row.day, row.units) for row in ProductSalesDaily.query.all()) == buckets
@@ -0,0 +1,116 @@
+import pytest
+
+from src import app, db
+from src.helpers import signals
+from src.helpers import search_index as search_module
+from src.helpers.etags import PRODUCTS
+from src.helpers.search_index import SearchIndex, ensure_search_index, tokenize
+from src.models import Product
+
+
+@pytest.fixture()
+def index():
+    index = SearchIndex()
+    index.build([
+        (1, "Apple iPhone 13", "6.1 inch phone with dual camera", "Phone"),
+        (2, "Samsung Galaxy S22", "Android phone, 128GB storage", "Phone"),
+        (3, "HP EliteBook 840", "14 inch business laptop with 16GB RAM", "Laptop"),
+        (4, "Lenovo Legion 5", "Gaming laptop, RTX 3060", "Laptop"),
+    ])
+    return index
+
+
+def test_tokenize_stems_and_drops_stop_words():
+    """
+    GIVEN text with plurals, inflections and stop words
+    WHEN it is tokenized
+    THEN related word forms share a term and stop words are dropped
+    """
+    assert tokenize("Phones") == tokenize("phone")
+    assert tokenize("gaming games") == ["gam", "gam"]
+    assert tokenize("the laptop with a case") == ["laptop", "cas"]
+
+
+def test_search_ranks_name_matches_first(index):
+    """
+    GIVEN an index over a few products
+    WHEN a term appears in one product name and another's description
+    THEN the name match ranks first
+    """
+    total, hits = index.search("galaxy phones")
+    assert total == 2
+    assert [product_id for _, product_id in hits] == [2, 1]
+
+
+def test_search_paginates_and_counts(index):
+    total, hits = index.search("laptop", limit=1, offset=1)
+    assert total == 2
+    assert len(hits) == 1
+
+
+def test_add_and_remove_keep_index_in_sync(index):
+    """
+    GIVEN an index
+    WHEN a product is renamed and another removed
+    THEN searches reflect the changes without a rebuild
+    """
+    index.add(3, "HP ZBook Firefly", "14 inch workstation", "Laptop")
+    index.remove(4)
+    assert index.search("elitebook") == (0, [])
+    assert [product_id for _, product_id in index.search("zbook")[1]] == [3]
+    assert index.search("legion") == (0, [])
+    assert len(index) == 3
+
+
+def test_correct_replaces_unknown_words(index):
+    """
+    GIVEN an index
+    WHEN a query with misspelled words is corrected
+    THEN the misspellings are replaced by catalog words and a correct
+        query needs no correction
+    """
+    assert index.correct("labtop with camra") == "laptop with camera"
+    assert index.correct("gaming laptop") is None
+
+
+def test_ensure_search_index_rebuilds_when_products_change(database, make_product,
+                                                           other_worker, monkeypatch):
+    """
+    GIVEN a search index built by this worker
+    WHEN another worker adds a product and bumps the products version
+    THEN the next search is answered from a rebuilt index
+    """
+    monkeypatch.setattr(search_module, "search_index", SearchIndex())
+    make_product(product_name="Apple iPhone 13")
+    assert ensure_search_index().search("galaxy") == (0, [])
+
+    db.session.add(Product(product_name="Samsung Galaxy S22", product_description="Phone",
+                           category="Phone", price=1000, quantity=1,
+                           img_url="http://example.com/p.png"))
+    db.session.commit()
+    assert ensure_search_index().search("galaxy") == (0, [])
+    other_worker(PRODUCTS)
+
+    total, _ = ensure_search_index().search("galaxy")
+    assert total == 1
+
+
+def test_own_product_writes_do_not_rebuild(database, make_product, monkeypatch):
+    """
+    GIVEN a search index built by this worker
+    WHEN this worker saves a product, which bumps the products version
+    THEN the signal handler's update is kept and the index isn't rebuilt
+    """
+    index = SearchIndex()
+    monkeypatch.setattr(search_module, "search_index", index)
+    builds = []
+    build = index.build
+    monkeypatch.setattr(index, "build", lambda *args: builds.append(1) or build(*args))
+    make_product(product_name="Apple iPhone 13")
+    ensure_search_index()
+
+    product = make_product(product_name="Samsung Galaxy S22")
+    signals.product_saved.send(app, product=product)
+
+    assert ensure_search_index().search("galaxy")[0] == 1
+    assert len(builds) == 1
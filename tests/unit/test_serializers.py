@@ -0,0 +1,77 @@
+import json
+from datetime import datetime
+
+import pytest
+from flask import jsonify
+
+from src import app
+from src.helpers.json_provider import FastJSONEncoder
+from src.helpers.serializers import compile_serializer, serializer_for
+from src.models import Product, Reviews
+
+
+@pytest.fixture()
+def review():
+    return Reviews(id=3, customer_id=1, product_id=2, review="Great value",
+                   rating=4, date=datetime(2022, 10, 23, 10, 38, 38))
+
+
+def test_compiled_to_dict_matches_columns(review):
+    """
+    GIVEN a model instance
+    WHEN it is serialized with the compiled to_dict
+    THEN every column is present with its value
+    """
+    expected = {column.name: getattr(review, column.name)
+                for column in Reviews.__table__.columns}
+    assert review.to_dict() == expected
+
+
+def test_unset_columns_fall_back_to_attribute_access():
+    product = Product(id=1, product_name="Pixel")
+    assert product.to_dict()["price"] is None
+    assert product.to_dict()["product_name"] == "Pixel"
+
+
+def test_projection_serializer_is_cached(review):
+    serializer = serializer_for(Reviews, ("id", "rating"))
+    assert serializer is serializer_for(Reviews, ("id", "rating"))
+    assert serializer(review) == {"id": 3, "rating": 4}
+
+
+def test_unknown_field_is_rejected():
+    with pytest.raises(ValueError):
+        compile_serializer(Reviews, ["id", "password"])
+
+
+def test_fast_encoder_handles_datetimes_and_int_keys(review):
+    with app.app_context():
+        encoded = json.dumps({"review": review.to_dict(), "cart": {5: 2}},
+                             cls=FastJSONEncoder, sort_keys=True)
+    decoded = json.loads(encoded)
+    assert decoded["review"]["date"] == "Sun, 23 Oct 2022 10:38:38 GMT"
+    assert decoded["cart"] == {"5": 2}
+
+
+def test_responses_keep_the_rfc_822_datetime_format(review):
+    """
+    GIVEN a review with a datetime
+    WHEN it is returned by a view
+    THEN its date is encoded as Flask always did, not as ISO 8601
+    """
+    with app.test_request_context():
+        response = jsonify({"date": review.date})
+    assert response.json == {"date": "Sun, 23 Oct 2022 10:38:38 GMT"}
+
+
+def test_product_to_dict_leaves_out_the_stats_counters():
+    """
+    GIVEN a product with ratings and sales
+    WHEN it is serialized for the API
+    THEN only its public fields are returned, not the counters behind them
+    """
+    product = Product(id=1, product_name="Pixel", rating_count=2, rating_sum=9, rating_5=1,
+                      rating_4=1, avg_rating=4.5, units_sold=3, units_sold_7d=1,
+                      units_sold_30d=3, price_version=2)
+    assert set(product.to_dict()) == set(Product.PUBLIC_FIELDS)
+    assert product.to_dict()["avg_rating"] == 4.5
@@ -0,0 +1,84 @@
+import time
+
+import pytest
+from flask import Flask, session
+
+from src.helpers.session_store import (RedisSessionStore, SQLiteSessionStore,
+                                       StoreSessionInterface)
+
+
+class FakeRedis:
+    """The part of the redis client the session store uses."""
+
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        value, expires = self.values.get(key, (None, 0))
+        return value if expires > time.time() else None
+
+    def set(self, key, value, ex):
+        self.values[key] = (value, time.time() + ex)
+
+    def delete(self, key):
+        self.values.pop(key, None)
+
+
+@pytest.fixture(params=["sqlite", "redis"])
+def store(request, tmp_path):
+    if request.param == "sqlite":
+        return SQLiteSessionStore(str(tmp_path / "sessions.db"))
+    return RedisSessionStore(FakeRedis())
+
+
+def test_store_get_set_delete(store):
+    store.set("a", b"data", 60)
+    assert store.get("a") == b"data"
+    store.set("a", b"other", 60)
+    assert store.get("a") == b"other"
+    store.delete("a")
+    assert store.get("a") is None
+
+
+def test_expired_sessions_are_hidden_and_collected(tmp_path):
+    """
+    GIVEN an SQLite store holding a live and an expired session
+    WHEN it is read and garbage collected
+    THEN the expired session is invisible and deleted, the live one kept
+    """
+    store = SQLiteSessionStore(str(tmp_path / "sessions.db"))
+    store.set("live", b"1", 60)
+    store.set("dead", b"2", -1)
+    assert store.get("dead") is None
+    assert store.gc() == 1
+    assert store.gc() == 0
+    assert store.get("live") == b"1"
+
+
+def test_session_interface_round_trip(store):
+    """
+    GIVEN an app using the store-backed session interface
+    WHEN a request writes the session and a later request reads it
+    THEN the values survive with their types, and an unmodified session
+        is not written back
+    """
+    app = Flask(__name__)
+    app.secret_key = "test"
+    app.session_interface = StoreSessionInterface(store, gc_interval=0)
+
+    @app.route("/write")
+    def write():
+        session["cart_dict"] = {"3": 2}
+        session["seen"] = (1, b"x")
+        return ""
+
+    @app.route("/read")
+    def read():
+        return {"cart": session.get("cart_dict"), "seen": repr(session.get("seen"))}
+
+    client = app.test_client()
+    response = client.get("/write")
+    assert "session=" in response.headers["Set-Cookie"]
+    response = client.get("/read")
+    assert response.json == {"cart": {"3": 2}, "seen": "(1, b'x')"}
+    assert "Set-Cookie" not in response.headers
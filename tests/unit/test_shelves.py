@@ -0,0 +1,106 @@
+import json
+
+import pytest
+
+from src import app
+from src.helpers import signals
+from src.helpers.shelves import ShelfEngine
+from src.models import Product
+
+
+def shelf_ids(engine, shelf):
+    return [product["id"] for product in json.loads(engine.payload())["data"]["products"][shelf]]
+
+
+@pytest.fixture
+def catalog(make_product):
+    return [make_product(product_name=f"Phone {number}", category="Phone")
+            for number in range(3)] + [make_product(product_name="Laptop 0", category="Laptop")]
+
+
+@pytest.fixture
+def engine(catalog):
+    engine = ShelfEngine(size=2)
+    engine.payload()
+    return engine
+
+
+def test_product_saved_reloads_the_shelves(database, engine, catalog, make_product):
+    """
+    GIVEN warm shelves
+    WHEN a product on a shelf is renamed and a new laptop is added
+    THEN the category shelves show the change
+    """
+    phone = catalog[0]
+    phone.product_name = "Renamed phone"
+    database.session.commit()
+    signals.product_saved.send(app, product=phone)
+    laptop = make_product(product_name="Laptop 1", category="Laptop")
+    signals.product_saved.send(app, product=laptop)
+
+    products = json.loads(engine.payload())["data"]["products"]
+    assert products["phones"][0]["product_name"] == "Renamed phone"
+    assert [product["id"] for product in products["laptops"]] == [catalog[3].id, laptop.id]
+
+
+def test_product_deleted_refills_the_shelf(database, engine, catalog):
+    """
+    GIVEN warm shelves showing the first two phones
+    WHEN the first phone is deleted
+    THEN the next phone moves up into the shelf
+    """
+    deleted_id = catalog[0].id
+    database.session.delete(catalog[0])
+    database.session.commit()
+    signals.product_deleted.send(app, product_id=deleted_id)
+
+    assert shelf_ids(engine, "phones") == [catalog[1].id, catalog[2].id]
+
+
+def test_review_changed_reranks_highly_rated(database, engine, catalog):
+    """
+    GIVEN warm shelves and no reviews yet
+    WHEN reviews are added
+    THEN the highly rated shelf lists the best rated products first
+    """
+    assert shelf_ids(engine, "highly_rated") == []
+    Product.apply_rating(catalog[1].id, 5)
+    Product.apply_rating(catalog[2].id, 3)
+    Product.apply_rating(catalog[3].id, 4)
+    database.session.commit()
+    signals.review_added.send(app, product_id=catalog[3].id, rating=4)
+
+    assert shelf_ids(engine, "highly_rated") == [catalog[1].id, catalog[3].id]
+
+
+def test_order_placed_reranks_most_purchased(database, engine, catalog):
+    """
+    GIVEN warm shelves
+    WHEN orders are placed
+    THEN the most purchased shelf follows the units sold
+    """
+    Product.record_sale(catalog[2].id, 1)
+    Product.record_sale(catalog[3].id, 4)
+    database.session.commit()
+    signals.order_placed.send(app, quantities={catalog[2].id: 1, catalog[3].id: 4})
+    assert shelf_ids(engine, "most_purchased") == [catalog[3].id, catalog[2].id]
+
+    Product.record_sale(catalog[2].id, 5)
+    database.session.commit()
+    signals.order_placed.send(app, quantities={catalog[2].id: 5})
+    assert shelf_ids(engine, "most_purchased") == [catalog[2].id, catalog[3].id]
+
+
+def test_shelves_are_kept_until_the_version_moves(database, engine, catalog, other_worker):
+    """
+    GIVEN warm shelves
+    WHEN a product is renamed without a version bump, then another worker
+        bumps the version
+    THEN the shelves are served as built until the bump
+    """
+    catalog[0].product_name = "Renamed phone"
+    database.session.commit()
+    assert b"Renamed phone" not in engine.payload()
+
+    other_worker()
+    assert b"Renamed phone" in engine.payload()
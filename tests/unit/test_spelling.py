@@ -0,0 +1,31 @@
+from src.helpers.spelling import SpellingIndex, edit_distance
+
+
+def test_edit_distance_counts_transpositions_once():
+    assert edit_distance("iphnoe", "iphone", 2) == 1
+    assert edit_distance("labtop", "laptop", 2) == 1
+    assert edit_distance("laptop", "tablet", 2) == 3
+
+
+def test_correct_prefers_closest_then_most_frequent_word():
+    """
+    GIVEN a vocabulary with two words one edit away from a typo
+    WHEN the typo is corrected
+    THEN the more frequent word wins, and known words are left alone
+    """
+    index = SpellingIndex()
+    index.add(["laptop", "lapdog"])
+    index.add(["laptop"])
+    assert index.correct("lapton") == "laptop"
+    assert index.correct("laptop") is None
+    assert index.correct("xyz") is None
+
+
+def test_removed_words_are_no_longer_suggested():
+    index = SpellingIndex()
+    index.add(["camera"])
+    index.add(["camera"])
+    index.remove(["camera"])
+    assert index.correct("camra") == "camera"
+    index.remove(["camera"])
+    assert index.correct("camra") is None
@@ -0,0 +1,176 @@
+import itertools
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from src import app, db, payments
+from src.helpers import stripe_catalog
+from src.helpers.auth_tokens import encode_auth_token
+from src.helpers.stripe_catalog import lookup_key, price_ids, sync_prices, unit_amount
+from src.models import StripePrice
+
+
+def test_unit_amount_converts_to_cents():
+    """
+    GIVEN catalog prices
+    WHEN they are converted for Stripe
+    THEN they come out as whole cents, as the inline checkout lines had them
+    """
+    assert unit_amount(744) == 100
+    assert unit_amount(50000) == int((50000 / 744) * 100)
+    assert unit_amount(0) == 0
+
+
+def test_lookup_key_is_stable_per_product():
+    """
+    GIVEN a product id
+    WHEN its Stripe lookup key is built
+    THEN every price version of the product shares it
+    """
+    assert lookup_key(3) == lookup_key(3) == "product-3"
+
+
+class StubGateway:
+    """Records the Stripe calls made and replies with fresh ids."""
+
+    def __init__(self):
+        self.calls = []
+        self.threads = set()
+        self._ids = itertools.count(1)
+
+    def _reply(self, call, prefix):
+        self.calls.append(call)
+        self.threads.add(threading.current_thread().name)
+        return SimpleNamespace(id=f"{prefix}_{next(self._ids)}",
+                               url="https://checkout.stripe.com/pay/cs_test")
+
+    def create_product(self, **params):
+        return self._reply(("create_product", params["name"]), "prod")
+
+    def update_product(self, product_id, **params):
+        return self._reply(("update_product", product_id, params["name"]), "prod")
+
+    def create_price(self, **params):
+        return self._reply(("create_price", params["product"], params["unit_amount"]), "price")
+
+    def update_price(self, price_id, **params):
+        return self._reply(("update_price", price_id, params), "price")
+
+    def create_checkout_session(self, **params):
+        return self._reply(("create_checkout_session", params["line_items"]), "cs")
+
+
+@pytest.fixture
+def stub_gateway(database, monkeypatch):
+    stub = StubGateway()
+    monkeypatch.setattr(stripe_catalog, "gateway", lambda: stub)
+    monkeypatch.setattr(payments, "gateway", lambda: stub)
+    return stub
+
+
+def test_sync_creates_the_stripe_product_and_price(stub_gateway, make_product):
+    """
+    GIVEN a product never synced
+    WHEN prices are synced
+    THEN a Stripe product and a price in cents are created and remembered
+        for the product's price version
+    """
+    product = make_product(product_name="Pixel", price=7440)
+
+    assert sync_prices() == 1
+
+    assert stub_gateway.calls == [("create_product", "Pixel"), ("create_price", "prod_1", 1000)]
+    synced = StripePrice.query.get(product.id)
+    assert (synced.stripe_product_id, synced.stripe_price_id, synced.price_version) == (
+        "prod_1", "price_2", 1)
+    assert price_ids({product.id: 1}) == {product.id: "price_2"}
+    assert price_ids({product.id: 2}) == {}
+
+
+def test_sync_replaces_the_price_of_a_repriced_product(stub_gateway, make_product):
+    """
+    GIVEN a synced product whose price then changed
+    WHEN prices are synced again
+    THEN a new price is created for the new version and the old one archived
+    """
+    product = make_product(product_name="Pixel", price=7440)
+    sync_prices()
+    stub_gateway.calls.clear()
+    product.price = 14880
+    product.price_version = 2
+    db.session.commit()
+
+    assert sync_prices() == 1
+
+    assert stub_gateway.calls == [("update_product", "prod_1", "Pixel"),
+                                  ("create_price", "prod_1", 2000),
+                                  ("update_price", "price_2", {"active": False})]
+    assert price_ids({product.id: 2}) == {product.id: "price_4"}
+
+
+def test_sync_leaves_unchanged_products_alone(stub_gateway, make_product):
+    """
+    GIVEN synced products, one edited without a price change
+    WHEN prices are synced again
+    THEN nothing is sent to Stripe
+    """
+    product = make_product()
+    make_product()
+    assert sync_prices() == 2
+    stub_gateway.calls.clear()
+    product.quantity = 3
+    db.session.commit()
+
+    assert sync_prices() == 0
+    assert stub_gateway.calls == []
+
+
+def test_checkout_references_the_synced_prices(stub_gateway, make_product, customer,
+                                               monkeypatch):
+    """
+    GIVEN price sync on, one product in the cart synced and one not
+    WHEN the customer checks out
+    THEN the synced line references its Stripe price and the other is sent
+        inline, to be synced in the background
+    """
+    monkeypatch.setitem(app.config, "STRIPE_PRICE_SYNC", True)
+    synced, unsynced = make_product(price=7440), make_product(price=744)
+    sync_prices([synced.id])
+    resynced = []
+    monkeypatch.setattr(stripe_catalog, "resync_async", resynced.extend)
+    stub_gateway.calls.clear()
+    client = app.test_client()
+    client.post("/api/v1/cart/", json={"prod_id": synced.id, "qty": 2})
+    client.post("/api/v1/cart/", json={"prod_id": unsynced.id, "qty": 1})
+
+    response = client.post(f"/api/v1/user/{customer.id}/payments/checkout/",
+                           json={"street": "1 Main St", "city": "London", "zip": "12345"},
+                           headers={"Authorization": f"Bearer {encode_auth_token(customer.id)}"})
+
+    assert response.status_code == 303
+    (call, line_items), = stub_gateway.calls
+    assert line_items[0] == {"price": price_ids({synced.id: 1})[synced.id], "quantity": 2}
+    assert line_items[1]["price_data"]["unit_amount"] == 100
+    assert resynced == [unsynced.id]
+
+
+def test_saved_product_is_synced_after_the_request(stub_gateway, admin_headers, monkeypatch):
+    """
+    GIVEN price sync on
+    WHEN an admin creates a product
+    THEN its price is synced by the background worker, from the committed
+        product, rather than inside the request's transaction
+    """
+    monkeypatch.setitem(app.config, "STRIPE_PRICE_SYNC", True)
+
+    response = app.test_client().post("/api/v1/admin/products/", headers=admin_headers, json={
+        "quantity": 5, "product_name": "Pixel", "product_description": "A phone",
+        "category": "Phone", "price": 7440, "img_url": "https://example.com/pixel.png"})
+    assert response.status_code == 201
+    stripe_catalog._executor.submit(lambda: None).result(timeout=5)
+
+    assert stub_gateway.threads == {"stripe-sync_0"}
+    db.session.expire_all()
+    synced = StripePrice.query.get(response.json["data"]["product"]["id"])
+    assert synced is not None and synced.stripe_price_id == "price_2"
@@ -0,0 +1,109 @@
+import pytest
+
+from src import app
+from src.helpers import signals, suggest as suggest_module
+from src.helpers.etags import PRODUCTS
+from src.helpers.suggest import SuggestIndex, ensure_suggest_index, suggestion_weight
+
+
+@pytest.fixture()
+def index():
+    index = SuggestIndex()
+    index.build([
+        (1, "Apple iPhone 13", "Phone", 5, 4.5),
+        (2, "Apple iPhone 12", "Phone", 50, 4.0),
+        (3, "Apple MacBook Air", "Laptop", 1, None),
+        (4, "Lenovo Legion 5", "Laptop", 0, None),
+    ])
+    return index
+
+
+def test_suggest_matches_any_word_and_ranks_by_weight(index):
+    """
+    GIVEN an index over a few products
+    WHEN a prefix of a word in the middle of several names is typed
+    THEN those products are suggested, best selling / rated first
+    """
+    assert [s["id"] for s in index.suggest("iph")] == [2, 1]
+    assert [s["id"] for s in index.suggest("  APPLE i")] == [2, 1]
+    assert [s["id"] for s in index.suggest("apple", limit=1)] == [2]
+
+
+def test_suggest_includes_categories(index):
+    suggestions = index.suggest("la")
+    assert {"type": "category", "name": "Laptop", "label": "Laptop"} in suggestions
+
+
+def test_suggest_empty_prefix(index):
+    assert index.suggest("") == []
+    assert index.suggest("zzz") == []
+
+
+def test_updates_keep_index_in_sync(index):
+    """
+    GIVEN an index
+    WHEN a product is renamed, another removed and a third re-weighted
+    THEN suggestions reflect the changes without a rebuild
+    """
+    index.add_product(4, "Lenovo ThinkPad X1", "Laptop", 0)
+    index.remove_product(3)
+    index.set_weight(1, suggestion_weight(500, 5))
+    assert index.suggest("legion") == []
+    assert [s["id"] for s in index.suggest("think")] == [4]
+    assert [s["id"] for s in index.suggest("apple")] == [1, 2]
+    assert [s["label"] for s in index.suggest("lap")] == ["Laptop"]
+
+
+def test_set_weight_updates_only_matching_cached_lists(monkeypatch):
+    """
+    GIVEN cached top lists for two prefixes
+    WHEN a product matching one of them is re-weighted up, then down
+    THEN only that prefix's list changes, and it stays correctly ranked
+    """
+    monkeypatch.setattr("src.helpers.suggest.SCAN_LIMIT", 0)
+    index = SuggestIndex()
+    index.build([(product_id, f"Apple phone {product_id}", "Phone", product_id, None)
+                 for product_id in range(1, 16)]
+                + [(20, "Lenovo Legion 5", "Laptop", 0, None)])
+    assert [s["id"] for s in index.suggest("apple")] == list(range(15, 5, -1))
+    lenovo = index.suggest("lenovo")
+    cached_lenovo = index._top["lenovo"]
+
+    index.set_weight(1, 100)
+    assert [s["id"] for s in index.suggest("apple")] == [1] + list(range(15, 6, -1))
+    assert index._top["lenovo"] is cached_lenovo
+
+    index.set_weight(1, 0)
+    assert [s["id"] for s in index.suggest("apple")] == list(range(15, 5, -1))
+    assert index.suggest("lenovo") == lenovo
+
+
+def test_suggest_endpoint_rejects_non_positive_limit():
+    response = app.test_client().get("/api/v1/products/suggest/?q=apple&limit=-1")
+    assert response.status_code == 400
+
+
+def test_ensure_suggest_index_rebuilds_only_for_other_workers(database, make_product,
+                                                              other_worker, monkeypatch):
+    """
+    GIVEN a suggest index built by this worker
+    WHEN this worker saves a product, then another worker does
+    THEN the first is applied by the signal handler, the second rebuilds
+    """
+    index = SuggestIndex()
+    monkeypatch.setattr(suggest_module, "suggest_index", index)
+    builds = []
+    build = index.build
+    monkeypatch.setattr(index, "build", lambda *args: builds.append(1) or build(*args))
+    make_product(product_name="Apple iPhone 13")
+    ensure_suggest_index()
+
+    product = make_product(product_name="Samsung Galaxy S22")
+    signals.product_saved.send(app, product=product)
+    assert [s["id"] for s in ensure_suggest_index().suggest("galaxy")] == [product.id]
+    assert len(builds) == 1
+
+    other = make_product(product_name="Galaxy Tab")
+    other_worker(PRODUCTS)
+    assert {s["id"] for s in ensure_suggest_index().suggest("galaxy")} == {product.id, other.id}
+    assert len(builds) == 2
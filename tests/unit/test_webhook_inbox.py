@@ -0,0 +1,197 @@
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+from src import app, db
+from src.helpers import webhook_inbox
+from src.helpers.webhook_inbox import (DEAD, DONE, PENDING, PROCESSING, claim_batch, drain,
+                                       event_id, process_batch, record_event)
+from src.models import WebhookEvent
+
+
+def test_event_id_falls_back_to_payload_hash():
+    """
+    GIVEN events with and without a provider id
+    WHEN their inbox key is computed
+    THEN the provider id is used, else a stable hash of the raw payload
+    """
+    assert event_id({"id": "evt_1"}, b"{}") == "evt_1"
+    assert event_id({}, b'{"a": 1}') == event_id({}, b'{"a": 1}')
+    assert event_id({}, b'{"a": 1}') != event_id({}, b'{"a": 2}')
+
+
+def record(event_type, event_id="evt_1", **data):
+    payload = json.dumps({"id": event_id, "type": event_type,
+                          "data": {"object": data}}).encode("utf-8")
+    return record_event(json.loads(payload), payload)
+
+
+def stored(event_id="evt_1"):
+    db.session.expire_all()
+    return WebhookEvent.query.get(event_id)
+
+
+@pytest.fixture
+def handled(database, monkeypatch):
+    """Events handled so far by a "test.ok" and a failing "test.fail" handler."""
+    calls = []
+
+    def fail(event):
+        raise ValueError("boom")
+    monkeypatch.setitem(webhook_inbox._handlers, "test.ok",
+                        lambda event: calls.append(event["id"]))
+    monkeypatch.setitem(webhook_inbox._handlers, "test.fail", fail)
+    return calls
+
+
+def test_duplicate_delivery_is_recorded_and_handled_once(handled):
+    """
+    GIVEN an event delivered twice, as a provider retry would
+    WHEN both deliveries are recorded and the inbox drained
+    THEN the second is reported as a duplicate and the handler runs once
+    """
+    assert record("test.ok")
+    assert not record("test.ok")
+
+    assert drain() == 1
+    assert handled == ["evt_1"]
+    assert stored().status == DONE
+    assert WebhookEvent.query.count() == 1
+
+
+def test_claim_leases_events(handled, monkeypatch):
+    """
+    GIVEN two due events
+    WHEN a worker claims them
+    THEN they are leased to it, not claimable again until the lease runs
+        out, and claimable again afterwards
+    """
+    monkeypatch.setitem(app.config, "WEBHOOK_LEASE_SECONDS", 60)
+    record("test.ok", "evt_1")
+    record("test.ok", "evt_2")
+
+    claimed, lease_until = claim_batch(10)
+    assert sorted(claimed) == ["evt_1", "evt_2"]
+    event = stored()
+    assert (event.status, event.attempts) == (PROCESSING, 1)
+    assert event.next_attempt_at == lease_until
+    assert lease_until > datetime.utcnow() + timedelta(seconds=50)
+    assert claim_batch(10)[0] == []
+
+    WebhookEvent.query.filter_by(id="evt_1").update(
+        {WebhookEvent.next_attempt_at: datetime.utcnow() - timedelta(seconds=1)})
+    db.session.commit()
+    assert claim_batch(10)[0] == ["evt_1"]
+    assert stored().attempts == 2
+
+
+def test_event_with_lost_lease_is_not_settled(handled):
+    """
+    GIVEN an event whose lease ran out and was claimed again by another
+        worker while the first one was still handling it
+    WHEN the first worker finishes, successfully or not
+    THEN it leaves the event to the worker now holding the lease
+    """
+    record("test.ok")
+    record("test.fail", "evt_2")
+    claimed, lease_until = claim_batch(10)
+    new_lease = lease_until + timedelta(seconds=60)
+    WebhookEvent.query.update({WebhookEvent.next_attempt_at: new_lease})
+    db.session.commit()
+
+    for event_id in claimed:
+        webhook_inbox._process(event_id, lease_until)
+
+    assert handled == ["evt_1"]
+    for event_id in claimed:
+        event = stored(event_id)
+        assert (event.status, event.next_attempt_at, event.last_error) == (
+            PROCESSING, new_lease, None)
+
+
+def test_workers_start_with_the_app(monkeypatch):
+    """
+    GIVEN the serving process
+    WHEN it handles its first request
+    THEN the webhook workers are started, without waiting for a webhook
+    """
+    started = []
+    monkeypatch.setattr(webhook_inbox, "start_workers", lambda: started.append(True))
+
+    assert webhook_inbox._start_on_boot in app.before_first_request_funcs
+    webhook_inbox._start_on_boot()
+    assert started == [True]
+
+
+def test_failed_event_backs_off_then_dead_letters(handled, monkeypatch):
+    """
+    GIVEN an event whose handler fails, at most 2 attempts
+    WHEN it is processed, then processed again once due
+    THEN it is first rescheduled with backoff, then moved to dead with its
+        last error
+    """
+    monkeypatch.setitem(app.config, "WEBHOOK_MAX_ATTEMPTS", 2)
+    monkeypatch.setitem(app.config, "WEBHOOK_RETRY_BASE", 10)
+    record("test.fail")
+
+    before = datetime.utcnow()
+    assert process_batch() == 1
+    event = stored()
+    assert (event.status, event.attempts) == (PENDING, 1)
+    assert "boom" in event.last_error
+    # base 10s, +-50% jitter
+    assert before + timedelta(seconds=5) <= event.next_attempt_at
+    assert event.next_attempt_at <= datetime.utcnow() + timedelta(seconds=15)
+    assert process_batch() == 0
+
+    event.next_attempt_at = datetime.utcnow()
+    db.session.commit()
+    assert process_batch() == 1
+    event = stored()
+    assert (event.status, event.attempts) == (DEAD, 2)
+    assert process_batch() == 0
+
+
+def test_replay_webhooks_command(handled, tmp_path):
+    """
+    GIVEN recorded event files, one repeated and one not JSON
+    WHEN they are replayed
+    THEN each event is recorded and processed once, the others skipped
+    """
+    files = []
+    for name, content in (("ok.json", {"id": "evt_1", "type": "test.ok"}),
+                          ("again.json", {"id": "evt_1", "type": "test.ok"}),
+                          ("other.json", {"id": "evt_2", "type": "test.ok"})):
+        path = tmp_path / name
+        path.write_text(json.dumps(content))
+        files.append(str(path))
+    broken = tmp_path / "broken.json"
+    broken.write_text("{")
+    files.append(str(broken))
+
+    result = app.test_cli_runner().invoke(args=["replay-webhooks", *files])
+
+    assert "again.json: already in the inbox" in result.output
+    assert "Skipped " + str(broken) in result.output
+    assert "Recorded 2 webhook events, processed 2" in result.output
+    assert handled == ["evt_1", "evt_2"]
+
+
+def test_payment_failed_webhook_is_acknowledged(database):
+    """
+    GIVEN a payment_intent.payment_failed event
+    WHEN Stripe posts it
+    THEN it is stored and acknowledged with 200 (it used to get a 400,
+        which made Stripe redeliver it), and processing it marks it done
+    """
+    payload = {"id": "evt_failed", "type": "payment_intent.payment_failed",
+               "data": {"object": {"amount": 1000}}}
+
+    response = app.test_client().post("/api/v1/payments/stripe-webhooks/", json=payload)
+
+    assert response.status_code == 200
+    assert response.json == {"success": True}
+    assert stored("evt_failed").status == PENDING
+    assert drain() == 1
+    assert stored("evt_failed").status == DONE